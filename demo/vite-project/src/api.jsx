@@ -5,10 +5,17 @@ const API_BASE = "http://127.0.0.1:8000";
 
 const listFiltersApi = async () =>
   (await axios.get(`${API_BASE}/api/filters`)).data;
-const listImagesApi = async () =>
-  (await axios.get(`${API_BASE}/api/images`)).data.images || [];
-const listOutputsApi = async () =>
-  (await axios.get(`${API_BASE}/api/outputs`)).data.outputs || [];
+// params: {limit, offset, prefix, sort: "name"|"mtime"|"size", order: "asc"|"desc",
+//          refresh: true -> server quét lại thư mục ngay}
+// -> {images|outputs, total, offset, next_offset}
+const listImagesApi = async (params = {}) =>
+  (await axios.get(`${API_BASE}/api/images`, { params })).data;
+const listOutputsApi = async (params = {}) =>
+  (await axios.get(`${API_BASE}/api/outputs`, { params })).data;
+// thumbnail cho gallery (server cache sẵn, trả 304 nếu trình duyệt đã có); version đổi khi file đổi
+const THUMB_WIDTH = 400;
+const thumbUrl = (file, width = THUMB_WIDTH) =>
+  `${API_BASE}${file.url}?w=${width}&v=${file.version}`;
 
 const uploadFilesApi = async (files) => {
   const form = new FormData();
@@ -20,9 +27,20 @@ const uploadFilesApi = async (files) => {
 };
 
 const startProcessApi = async (payload) =>
-  (await axios.post(`${API_BASE}/api/process`, payload)).data; // {job_id, status}
-const jobStatusApi = async (jobId) =>
-  (await axios.get(`${API_BASE}/api/jobs/${jobId}/status`)).data;
+  (await axios.post(`${API_BASE}/api/process`, payload)).data; // {job_id, status, plan_changes}
+// dry-run: chuỗi bước sau khi optimizer sắp xếp lại ({steps, changes, stages}), không tạo job
+const planApi = async (steps, optimize = true) =>
+  (await axios.post(`${API_BASE}/api/plan`, { steps, optimize })).data;
+// since: cursor trả về từ lần gọi trước -> chỉ nhận log/state mới
+const jobStatusApi = async (jobId, since) =>
+  (
+    await axios.get(`${API_BASE}/api/jobs/${jobId}/status`, {
+      params: since !== undefined ? { since } : {},
+    })
+  ).data;
+// Server-Sent Events: event "update" ({logs, images, cursor}) và "end" ({status, error})
+const jobEventsUrl = (jobId, since = 0) =>
+  `${API_BASE}/api/jobs/${jobId}/events?since=${since}`;
 const jobOutputsApi = async (jobId) =>
   (await axios.get(`${API_BASE}/api/jobs/${jobId}/outputs`)).data.outputs || [];
 
@@ -31,8 +49,11 @@ export {
   listFiltersApi,
   listImagesApi,
   listOutputsApi,
+  thumbUrl,
   uploadFilesApi,
   startProcessApi,
+  planApi,
   jobStatusApi,
+  jobEventsUrl,
   jobOutputsApi,
 };
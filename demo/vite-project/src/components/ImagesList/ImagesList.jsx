@@ -1,16 +1,28 @@
 import { useEffect, useState } from "react";
-import { API_BASE, listImagesApi, uploadFilesApi } from "../../api";
-import { Button, Col, Row } from "antd";
+import { listImagesApi, thumbUrl, uploadFilesApi } from "../../api";
+import { Button, Col, Pagination, Row } from "antd";
 import "./ImagesList.css";
 
+const PAGE_SIZE = 24;
+
 const ImagesList = ({ selected, setSelected }) => {
   const [images, setImages] = useState([]);
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
 
-  const refresh = async () => setImages(await listImagesApi());
+  const refresh = async (p = page, force = false) => {
+    const data = await listImagesApi({
+      limit: PAGE_SIZE,
+      offset: (p - 1) * PAGE_SIZE,
+      refresh: force,
+    });
+    setImages(data.images || []);
+    setTotal(data.total || 0);
+  };
 
   useEffect(() => {
-    refresh();
-  }, []);
+    refresh(page);
+  }, [page]);
 
   const onUpload = async (e) => {
     const files = e.target.files;
@@ -40,7 +52,7 @@ const ImagesList = ({ selected, setSelected }) => {
           type="primary"
           style={{ marginLeft: "20px" }}
           s
-          onClick={refresh}
+          onClick={() => refresh(page, true)}
         >
           Tải lại danh sách
         </Button>
@@ -60,16 +72,21 @@ const ImagesList = ({ selected, setSelected }) => {
                 </div>
 
                 <div className="media">
-                  <img
-                    src={`${API_BASE}${it.url}?v=${Date.now()}`}
-                    alt={it.name}
-                  />
+                  <img src={thumbUrl(it)} alt={it.name} loading="lazy" />
                 </div>
               </div>
             </Col>
           ))}
         </Row>
       </div>
+      <Pagination
+        current={page}
+        pageSize={PAGE_SIZE}
+        total={total}
+        showSizeChanger={false}
+        hideOnSinglePage
+        onChange={setPage}
+      />
     </div>
   );
 };
@@ -1,16 +1,28 @@
 import { useEffect, useState } from "react";
-import { API_BASE, listOutputsApi } from "../../api";
-import { Button, Col, Row } from "antd";
+import { listOutputsApi, thumbUrl } from "../../api";
+import { Button, Col, Pagination, Row } from "antd";
 import "./OutputsList.css";
 
+const PAGE_SIZE = 24;
+
 const OutputsList = ({ externalOutputs }) => {
   const [outputs, setOutputs] = useState([]);
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
 
-  const refresh = async () => setOutputs(await listOutputsApi());
+  const refresh = async (p = page, force = false) => {
+    const data = await listOutputsApi({
+      limit: PAGE_SIZE,
+      offset: (p - 1) * PAGE_SIZE,
+      refresh: force,
+    });
+    setOutputs(data.outputs || []);
+    setTotal(data.total || 0);
+  };
 
   useEffect(() => {
-    refresh();
-  }, []);
+    refresh(page);
+  }, [page]);
 
   useEffect(() => {
     if (externalOutputs?.length) {
@@ -21,7 +33,7 @@ const OutputsList = ({ externalOutputs }) => {
   return (
     <div className="outputs-list-container">
       <h2>4. Kết quả</h2>
-      <Button type="primary" style={{ width: "fit-content" }} onClick={refresh}>
+      <Button type="primary" style={{ width: "fit-content" }} onClick={() => refresh(page, true)}>
         Tải lại
       </Button>
       <div className="output-images-area">
@@ -31,16 +43,21 @@ const OutputsList = ({ externalOutputs }) => {
               <div className="output-image-card">
                 <div className="output-image-title">{o.name}</div>
                 <div className="output-image-wrapper">
-                  <img
-                    src={`${API_BASE}${o.url}?v=${Date.now()}`}
-                    alt={o.name}
-                  />
+                  <img src={thumbUrl(o)} alt={o.name} loading="lazy" />
                 </div>
               </div>
             </Col>
           ))}
         </Row>
       </div>
+      <Pagination
+        current={page}
+        pageSize={PAGE_SIZE}
+        total={total}
+        showSizeChanger={false}
+        hideOnSinglePage
+        onChange={setPage}
+      />
     </div>
   );
 };
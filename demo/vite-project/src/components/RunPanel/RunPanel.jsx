@@ -1,7 +1,12 @@
 // src/components/RunPanel/RunPanel.jsx
 import { useEffect, useRef, useState } from "react";
 import { Button } from "antd";
-import { startProcessApi, jobStatusApi, jobOutputsApi } from "../../api";
+import {
+  startProcessApi,
+  jobStatusApi,
+  jobEventsUrl,
+  jobOutputsApi,
+} from "../../api";
 import JobStatusTable from "./JobStatusTable";
 import "./RunPanel.css";
 
@@ -11,8 +16,10 @@ const RunPanel = ({ selectedImages, steps, onDone }) => {
   const [jobId, setJobId] = useState(null);
   const [displayMap, setDisplayMap] = useState({}); // map hiển thị (đã xử lý sink)
   const timerRef = useRef(null);
+  const sourceRef = useRef(null); // EventSource đang mở
   const historyRef = useRef({}); // { [filename]: [{state, current_filter, worker, ts}] }
-  const lastLogCountRef = useRef(0); // <-- track logs consumed
+  const imagesRef = useRef({}); // state mới nhất của từng ảnh (server chỉ gửi phần thay đổi)
+  const cursorRef = useRef(0); // cursor events đã nhận
 
   const append = (line) => setLog((x) => (x ? x + "\n" + line : line));
 
@@ -21,6 +28,10 @@ const RunPanel = ({ selectedImages, steps, onDone }) => {
       clearInterval(timerRef.current);
       timerRef.current = null;
     }
+    if (sourceRef.current) {
+      sourceRef.current.close();
+      sourceRef.current = null;
+    }
   };
 
   useEffect(() => () => clearTimer(), []);
@@ -89,10 +100,50 @@ const RunPanel = ({ selectedImages, steps, onDone }) => {
     setDisplayMap({});
     setJobId(null);
     historyRef.current = {};
-    lastLogCountRef.current = 0;
+    imagesRef.current = {};
+    cursorRef.current = 0;
     setRunning(true);
     append("Gửi job...");
 
+    // áp phần thay đổi {logs, images, cursor} vào history + display map
+    const applyDelta = (delta) => {
+      const imgs = delta.images || {};
+      for (const [name, snap] of Object.entries(imgs)) pushHistory(name, snap);
+      imagesRef.current = { ...imagesRef.current, ...imgs };
+      recomputeDisplayMap(imagesRef.current);
+      for (const l of delta.logs || []) append(formatLogEntry(l));
+      if (typeof delta.cursor === "number") cursorRef.current = delta.cursor;
+    };
+
+    const finish = async (jobIdDone, st) => {
+      clearTimer();
+      append(JSON.stringify({ status: st.status, error: st.error }));
+      if (st.status === "done") {
+        const outs = await jobOutputsApi(jobIdDone);
+        append(`Outputs: ${outs.map((o) => o.name).join(", ")}`);
+        onDone?.(outs);
+      } else if (st.status === "error") {
+        append(`Job error: ${st.error || "unknown"}`);
+      }
+      setRunning(false);
+    };
+
+    // fallback khi không dùng được SSE: poll theo cursor
+    const poll = (jobIdPoll) => {
+      timerRef.current = setInterval(async () => {
+        try {
+          const st = await jobStatusApi(jobIdPoll, cursorRef.current);
+          applyDelta(st);
+          if (st.status !== "running") await finish(jobIdPoll, st);
+        } catch (e) {
+          console.error(e);
+          append("Poll lỗi, dừng.");
+          clearTimer();
+          setRunning(false);
+        }
+      }, 500);
+    };
+
     try {
       const { job_id } = await startProcessApi({
         images: selectedImages,
@@ -101,45 +152,27 @@ const RunPanel = ({ selectedImages, steps, onDone }) => {
       setJobId(job_id);
       append(`Job: ${job_id}`);
 
-      // Poll nhanh để bắt processing
-      timerRef.current = setInterval(async () => {
-        try {
-          const st = await jobStatusApi(job_id);
-
-          // lưu history + cập nhật display map
-          const imgs = st.images || {};
-          for (const [name, snap] of Object.entries(imgs))
-            pushHistory(name, snap);
-          recomputeDisplayMap(imgs);
-
-          // append new logs (if any)
-          const logs = Array.isArray(st.logs) ? st.logs : [];
-          if (logs.length > lastLogCountRef.current) {
-            const newLogs = logs.slice(lastLogCountRef.current);
-            for (const l of newLogs) append(formatLogEntry(l));
-            lastLogCountRef.current = logs.length;
-          }
-
-          if (st.status !== "running") {
-            append(JSON.stringify(st));
-            clearTimer();
-
-            if (st.status === "done") {
-              const outs = await jobOutputsApi(job_id);
-              append(`Outputs: ${outs.map((o) => o.name).join(", ")}`);
-              onDone?.(outs);
-            } else if (st.status === "error") {
-              append(`Job error: ${st.error || "unknown"}`);
-            }
-            setRunning(false);
-          }
-        } catch (e) {
+      if (typeof EventSource === "undefined") {
+        poll(job_id);
+        return;
+      }
+      const es = new EventSource(jobEventsUrl(job_id, cursorRef.current));
+      sourceRef.current = es;
+      es.addEventListener("update", (ev) => applyDelta(JSON.parse(ev.data)));
+      es.addEventListener("end", (ev) => {
+        finish(job_id, JSON.parse(ev.data)).catch((e) => {
           console.error(e);
-          append("Poll lỗi, dừng.");
-          clearTimer();
           setRunning(false);
-        }
-      }, 300);
+        });
+      });
+      es.onerror = () => {
+        // server đóng kết nối hoặc mạng lỗi -> chuyển sang poll từ cursor hiện tại
+        if (sourceRef.current !== es) return;
+        es.close();
+        sourceRef.current = null;
+        append("SSE ngắt, chuyển sang poll.");
+        poll(job_id);
+      };
     } catch (e) {
       console.error(e);
       append("Có lỗi khi chạy pipeline (xem console).");
@@ -1,28 +1,54 @@
-import cv2
 import os
 import hashlib
+import numpy as np
 from utils.dlq import write_dlq
-from utils.dedup import DedupStore
+from utils.dedup import as_store
+from utils.reduced_decode import imdecode, jpeg_size
 from utils.thread_log import log_start, log_end
 
-def make_id_for_path(path: str) -> str:
-    try:
-        stat = os.stat(path)
-        s = f"{path}|{stat.st_size}|{int(stat.st_mtime)}"
-    except Exception:
-        s = f"{path}|{os.path.basename(path)}"
-    return hashlib.sha1(s.encode()).hexdigest()
+def hash_bytes(data) -> str:
+    # blake2b nhanh hơn sha1/sha256 trên CPU 64-bit; 20 byte là đủ làm id
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+def make_id_for_path(path: str, dedup=None) -> str:
+    """Id theo nội dung file (file copy/touch vẫn cùng id); ``dedup`` dùng làm memo path|size|mtime."""
+    return _identify(path, dedup)[0]
+
+def _identify(path: str, dedup=None):
+    """Trả về (id, bytes); bytes là None nếu id lấy từ memo (chưa đọc file)."""
+    st = os.stat(path)
+    if dedup is not None:
+        id_ = dedup.path_id(path, st.st_size, st.st_mtime_ns)
+        if id_ is not None:
+            return id_, None
+    data = np.fromfile(path, dtype=np.uint8)
+    id_ = hash_bytes(data)
+    if dedup is not None:
+        dedup.remember_path(path, st.st_size, st.st_mtime_ns, id_)
+    return id_, data
 
 class ConvertFilter:
-    def __init__(self, dedup_db="dedup.db"):
-        self.dedup = DedupStore(dedup_db)
+    def __init__(self, dedup_db="dedup.db", skip_if_done=None, resize_hint=None):
+        self.dedup = as_store(dedup_db)
         self.stage_name = "convert"
+        # tên các stage phía sau; ảnh đã qua đủ các stage này thì bỏ luôn, không decode
+        self.skip_if_done = set(skip_if_done or ())
+        # fn(w, h) -> kích thước đích của ResizeFilter phía sau (hoặc None); có thì JPEG lớn được decode giảm
+        self.resize_hint = resize_hint
 
     def process_single(self, path):
         log_start(self.stage_name, {"filename": os.path.basename(path), "path": path})
-        id_ = make_id_for_path(path)
         try:
-            img = cv2.imread(path)
+            id_, data = _identify(path, self.dedup)
+            if self.skip_if_done and self.skip_if_done <= self.dedup.get_stages(id_):
+                log_end(self.stage_name, {"id": id_, "filename": os.path.basename(path), "path": path}, status="skip")
+                return None
+            # đã đọc bytes để hash thì decode luôn từ buffer, khỏi đọc file lần hai
+            if data is None:
+                data = np.fromfile(path, dtype=np.uint8)
+            size = jpeg_size(data) if self.resize_hint is not None else None
+            target = self.resize_hint(*size) if size else None
+            img, factor = imdecode(data, size, target)
             if img is None:
                 raise ValueError(f"Cannot read image: {path}")
 
@@ -32,13 +58,16 @@ class ConvertFilter:
                 "image": img,
                 "filename": os.path.basename(path),
             }
+            if factor > 1:
+                # ảnh đã giảm 1/factor: ResizeFilter resize về đúng kích thước tính trên ảnh gốc
+                envelope["resize_to"] = list(target)
 
             self.dedup.add_stage(id_, self.stage_name)
             log_end(self.stage_name, envelope)
             return envelope
         except Exception as e:
             log_end(self.stage_name, {"filename": os.path.basename(path), "path": path}, status="error")
-            write_dlq({"path": path, "error": str(e)})
+            write_dlq({"path": path, "filename": os.path.basename(path)}, stage=self.stage_name, error=str(e))
             return None
 
     def process(self, in_q, out_q):
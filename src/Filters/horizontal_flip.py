@@ -1,12 +1,12 @@
-import cv2
-from utils.dedup import DedupStore
+from utils.dedup import as_store
 from utils.retry import retry
 from utils.dlq import write_dlq
 from utils.thread_log import log_start, log_end
+from utils.tiling import flip_h
 
 class HorizontalFlip:
     def __init__(self, dedup_db="dedup.db"):
-        self.dedup = DedupStore(dedup_db)
+        self.dedup = as_store(dedup_db)
         self.stage_name = "hflip"
 
     @retry(max_attempts=2, backoff=0.1)
@@ -20,13 +20,13 @@ class HorizontalFlip:
             img = envelope.get("image")
             if img is None:
                 raise ValueError("No image")
-            envelope["image"] = cv2.flip(img, 1)
+            envelope["image"] = flip_h(img)
             self.dedup.add_stage(id_, self.stage_name)
             log_end(self.stage_name, envelope)
             return envelope
         except Exception as e:
             log_end(self.stage_name, envelope, status="error")
-            write_dlq(envelope)
+            write_dlq(envelope, stage=self.stage_name, error=str(e))
             return envelope
 
     def process(self, in_q, out_q):
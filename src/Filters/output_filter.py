@@ -1,18 +1,20 @@
 # file: Filters/output_filter.py
 
 import os
-import cv2
 from utils.dlq import write_dlq
-from utils.dedup import DedupStore
+from utils.dedup import as_store
 from utils.retry import retry
 from utils.thread_log import log_start, log_end
+from utils import encoding
 
 class OutputFilter:
-    def __init__(self, output_dir, dedup_db="dedup.db"):
+    def __init__(self, output_dir, dedup_db="dedup.db", output_format=None):
         self.output_dir = os.path.abspath(output_dir)
         os.makedirs(self.output_dir, exist_ok=True)
-        self.dedup = DedupStore(dedup_db)
+        self.dedup = as_store(dedup_db)
         self.stage_name = "output"
+        # dict định dạng (xem utils/encoding.py); None = giữ đuôi file gốc như cv2.imwrite
+        self.output_format = encoding.normalize(output_format) if output_format else None
 
     @retry(max_attempts=3, backoff=0.2)
     def process_single(self, envelope):
@@ -26,16 +28,18 @@ class OutputFilter:
             fname = envelope.get("filename")
             if img is None or fname is None:
                 raise ValueError("Missing image or filename")
+            if self.output_format:
+                fname = os.path.splitext(fname)[0] + encoding.extension(self.output_format)
             out_path = os.path.join(self.output_dir, fname)
-            if not cv2.imwrite(out_path, img):
-                raise IOError(f"Failed to write {out_path}")
+            # ghi file tạm rồi rename -> không bao giờ để lại file output ghi dở
+            encoding.save(img, out_path, self.output_format)
             self.dedup.add_stage(id_, self.stage_name)
             log_end(self.stage_name, envelope)
             return envelope
         except Exception as e:
             # Ghi lỗi và DLQ sau khi retry đã thất bại
             log_end(self.stage_name, envelope, status="error")
-            write_dlq(envelope)
+            write_dlq(envelope, stage=self.stage_name, error=str(e))
             return envelope
 
     def process(self, in_q, out_q):
@@ -1,24 +1,33 @@
+import threading
 import cv2
-import numpy as np
 from rembg import remove
-from utils.dedup import DedupStore
+from utils.compositing import composite
+from utils.dedup import as_store
+from utils.rembg_session import new_session
 from utils.retry import retry
 from utils.dlq import write_dlq
 from utils.thread_log import log_start, log_end
 
 class RemoveBackground:
-    def __init__(self, dedup_db="dedup.db", checker_size=20):
-        self.dedup = DedupStore(dedup_db)
+    def __init__(self, dedup_db="dedup.db", checker_size=20, model=None, replicas=1,
+                 background="checker", color=(255, 255, 255)):
+        self.dedup = as_store(dedup_db)
         self.stage_name = "rembg"
         self.checker_size = checker_size
+        # "checker" | "solid" (màu BGR ``color``) | "transparent" (giữ kênh alpha, ra BGRA)
+        self.background = background
+        self.color = color
+        self.model = model
+        # số worker thread chạy stage này, để chia intra-op thread của onnxruntime
+        self.replicas = replicas
+        self._local = threading.local()
 
-    def _create_checkerboard(self, w, h):
-        img = np.zeros((h, w, 3), np.uint8)
-        for y in range(0, h, self.checker_size):
-            for x in range(0, w, self.checker_size):
-                color = (255,255,255) if (x//self.checker_size+y//self.checker_size)%2==0 else (200,200,200)
-                cv2.rectangle(img, (x,y), (x+self.checker_size, y+self.checker_size), color, -1)
-        return img
+    def _session(self):
+        # mỗi worker thread một session riêng, tạo + warm-up ở lần đầu
+        sess = getattr(self._local, "session", None)
+        if sess is None:
+            sess = self._local.session = new_session(self.model, replicas=self.replicas)
+        return sess
 
     @retry(max_attempts=2, backoff=0.1)
     def process_single(self, envelope):
@@ -32,23 +41,20 @@ class RemoveBackground:
             img = envelope.get("image")
             if img is None:
                 raise ValueError("No image")
-            h, w = img.shape[:2]
             img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            rgba = remove(img_rgb)
-            alpha = rgba[:,:,3]/255.0
-            fg = rgba[:,:,:3]
-            bg = cv2.cvtColor(self._create_checkerboard(w,h), cv2.COLOR_BGR2RGB)
-            combined = (fg*alpha[:,:,None]+bg*(1-alpha[:,:,None])).astype(np.uint8)
-            envelope["image"] = cv2.cvtColor(combined, cv2.COLOR_RGB2BGR)
+            rgba = remove(img_rgb, session=self._session())
+            envelope["image"] = composite(rgba, self.background, self.checker_size, self.color)
             self.dedup.add_stage(id_, self.stage_name)
             log_end(self.stage_name, envelope)
             return envelope
         except Exception as e:
             log_end(self.stage_name, envelope, status="error")
-            write_dlq(envelope)
+            write_dlq(envelope, stage=self.stage_name, error=str(e))
             return envelope
 
     def process(self, in_q, out_q):
+        # load model trước khi nhận ảnh đầu tiên
+        self._session()
         while True:
             envelope = in_q.get()
             if envelope is None:
@@ -1,17 +1,29 @@
-import cv2
-from utils.dedup import DedupStore
+from utils.dedup import as_store
 from utils.retry import retry
 from utils.dlq import write_dlq
 from utils.thread_log import log_start, log_end
+from utils.tiling import resize_area
 
 class ResizeFilter:
     def __init__(self, width=None, height=None, keep_aspect_ratio=True, dedup_db="dedup.db"):
         self.width = width
         self.height = height
         self.keep_aspect_ratio = keep_aspect_ratio
-        self.dedup = DedupStore(dedup_db)
+        self.dedup = as_store(dedup_db)
         self.stage_name = "resize"
 
+    def target_size(self, w, h):
+        """Kích thước (w, h) sau resize của ảnh ``w`` x ``h``; None nếu giữ nguyên."""
+        if not self.keep_aspect_ratio:
+            return (self.width or w, self.height or h)
+        if self.width and not self.height:
+            return (self.width, int(h * (self.width / w)))
+        if self.height and not self.width:
+            return (int(w * (self.height / h)), self.height)
+        if self.width and self.height:
+            return (self.width, self.height)
+        return None
+
     @retry(max_attempts=3, backoff=0.2)
     def process_single(self, envelope):
         log_start(self.stage_name, envelope)
@@ -25,29 +37,21 @@ class ResizeFilter:
             if img is None:
                 raise ValueError("No image in envelope")
 
+            # ConvertFilter đã decode giảm thì kích thước đích (tính trên ảnh gốc) đi kèm envelope
             h, w = img.shape[:2]
-            if self.keep_aspect_ratio:
-                if self.width and not self.height:
-                    ratio = self.width / w
-                    new_size = (self.width, int(h * ratio))
-                elif self.height and not self.width:
-                    ratio = self.height / h
-                    new_size = (int(w * ratio), self.height)
-                elif self.width and self.height:
-                    new_size = (self.width, self.height)
-                else:
-                    log_end(self.stage_name, envelope)
-                    return envelope
-            else:
-                new_size = (self.width or w, self.height or h)
+            new_size = envelope.get("resize_to") or self.target_size(w, h)
+            if new_size is None:
+                log_end(self.stage_name, envelope)
+                return envelope
 
-            envelope["image"] = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+            envelope["image"] = resize_area(img, new_size)
+            envelope.pop("resize_to", None)
             self.dedup.add_stage(id_, self.stage_name)
             log_end(self.stage_name, envelope)
             return envelope
         except Exception as e:
             log_end(self.stage_name, envelope, status="error")
-            write_dlq(envelope)
+            write_dlq(envelope, stage=self.stage_name, error=str(e))
             return envelope
 
     def process(self, in_q, out_q):
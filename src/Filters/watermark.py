@@ -1,5 +1,5 @@
 import cv2
-from utils.dedup import DedupStore
+from utils.dedup import as_store
 from utils.retry import retry
 from utils.dlq import write_dlq
 from utils.thread_log import log_start, log_end
@@ -11,7 +11,7 @@ class Watermark:
         self.font_scale = font_scale
         self.color = color
         self.thickness = thickness
-        self.dedup = DedupStore(dedup_db)
+        self.dedup = as_store(dedup_db)
         self.stage_name = "watermark"
 
     @retry(max_attempts=2, backoff=0.1)
@@ -34,7 +34,7 @@ class Watermark:
             return envelope
         except Exception as e:
             log_end(self.stage_name, envelope, status="error")
-            write_dlq(envelope)
+            write_dlq(envelope, stage=self.stage_name, error=str(e))
             return envelope
 
     def process(self, in_q, out_q):
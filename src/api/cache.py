@@ -0,0 +1,193 @@
+"""Cache trên đĩa theo content hash, có giới hạn dung lượng (LRU) và bộ đếm hit/miss.
+
+Mỗi entry là một file ``<key><ext>`` trong ``root``; chỉ mục + thống kê nằm trong
+``index.db`` (SQLite WAL) nên nhiều process (runner, sink, warm pool) dùng chung được.
+Ghi entry luôn qua file tạm + ``os.replace`` để không ai đọc phải file dở dang.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    ext TEXT,
+    size INTEGER,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_used ON entries(last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def digest_bytes(data) -> str:
+    """Hash nội dung (blake2b-160, nhanh hơn sha256 mà vẫn đủ chống trùng)."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def steps_key(steps: List[Dict]) -> str:
+    """Chuỗi chuẩn hoá của chuỗi bước (tên + params, bỏ param None) để ghép vào key."""
+    norm = [[s["name"], {k: v for k, v in sorted((s.get("params") or {}).items()) if v is not None}] for s in steps]
+    return json.dumps(norm, sort_keys=True, separators=(",", ":"))
+
+
+class DiskCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.root, exist_ok=True)
+        self._pid = None
+        self._ensure_local()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def __getstate__(self):
+        return {"root": self.root, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pid = None
+
+    def _ensure_local(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, f"{key}{ext}")
+
+    def _bump(self, conn, name: str, n: int = 1):
+        conn.execute(
+            "INSERT INTO stats(name, value) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET value=value+?",
+            (name, n, n),
+        )
+
+    # ---------- đọc ----------
+    def get(self, key: str) -> Optional[str]:
+        """Đường dẫn entry nếu có (đánh dấu vừa dùng), None nếu miss."""
+        self._ensure_local()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT ext FROM entries WHERE key=?", (key,)).fetchone()
+            path = self._path(key, row[0]) if row else None
+            if path is not None and not os.path.exists(path):
+                # file bị xoá ngoài ý muốn -> coi như miss
+                self._conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                path = None
+            if path is None:
+                self._bump(self._conn, "misses")
+                return None
+            self._conn.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+            self._bump(self._conn, "hits")
+            return path
+
+    def get_first(self, keys: Sequence[str]) -> Tuple[Optional[int], Optional[str]]:
+        """Tra nhiều key theo thứ tự ưu tiên, trả (vị trí, đường dẫn) của key đầu tiên có; tính một hit/miss."""
+        if not keys:
+            return None, None
+        self._ensure_local()
+        with self._lock, self._conn:
+            marks = ",".join("?" * len(keys))
+            rows = dict(self._conn.execute(f"SELECT key, ext FROM entries WHERE key IN ({marks})", tuple(keys)).fetchall())
+            for i, key in enumerate(keys):
+                if key in rows and os.path.exists(self._path(key, rows[key])):
+                    self._conn.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+                    self._bump(self._conn, "hits")
+                    return i, self._path(key, rows[key])
+            self._bump(self._conn, "misses")
+            return None, None
+
+    def get_array(self, key: str):
+        path = self.get(key)
+        return np.load(path) if path is not None else None
+
+    # ---------- ghi ----------
+    def put_file(self, key: str, src: str, ext: Optional[str] = None) -> Optional[str]:
+        """Đưa file ``src`` vào cache (hardlink nếu được, không thì copy)."""
+        ext = ext if ext is not None else os.path.splitext(src)[1]
+        size = os.path.getsize(src)
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return None
+        tmp = self._path(f".{key}.{uuid4().hex[:8]}", ext)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        return self._commit(key, tmp, ext, size)
+
+    def put_bytes(self, key: str, data: bytes, ext: str) -> Optional[str]:
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return None
+        tmp = self._path(f".{key}.{uuid4().hex[:8]}", ext)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self._commit(key, tmp, ext, len(data))
+
+    def put_array(self, key: str, arr) -> Optional[str]:
+        """Lưu mảng numpy dạng .npy (đọc lại không phải decode)."""
+        if self.max_bytes <= 0 or arr.nbytes > self.max_bytes:
+            return None
+        tmp = self._path(f".{key}.{uuid4().hex[:8]}", ".npy")
+        with open(tmp, "wb") as f:
+            np.save(f, arr, allow_pickle=False)
+        return self._commit(key, tmp, ".npy", os.path.getsize(tmp))
+
+    def _commit(self, key: str, tmp: str, ext: str, size: int) -> str:
+        path = self._path(key, ext)
+        os.replace(tmp, path)
+        self._ensure_local()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO entries(key, ext, size, last_used) VALUES(?,?,?,?) "
+                "ON CONFLICT(key) DO UPDATE SET ext=excluded.ext, size=excluded.size, last_used=excluded.last_used",
+                (key, ext, size, time.time()),
+            )
+            self._evict(self._conn)
+        return path
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, ext, size in conn.execute("SELECT key, ext, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM entries WHERE key=?", (key,))
+            total -= size
+            evicted += 1
+        self._bump(conn, "evictions", evicted)
+
+    def stats(self) -> Dict:
+        self._ensure_local()
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
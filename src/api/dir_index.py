@@ -0,0 +1,270 @@
+"""Chỉ mục thư mục ảnh (input/output) trong SQLite: tên, size, mtime, kích thước ảnh, hash.
+
+Liệt kê ảnh đọc thẳng từ chỉ mục (phân trang, lọc theo tiền tố, sắp xếp bằng index SQL), không
+``listdir`` + ``sorted`` cả thư mục mỗi request:
+
+- ``refresh()`` chỉ ``stat`` thư mục; mtime/ctime thư mục không đổi (thêm/xoá/``os.replace``
+  đều làm đổi) thì không quét gì. Đổi thì ``scandir`` một lượt, chỉ ghi những file mới/đổi
+  size-mtime/bị xoá. Ngoài ra vẫn quét lại khi:
+  - lần quét trước rơi vào cùng "tick" thời gian với mtime thư mục (file thêm ngay sau lúc quét
+    có thể không làm mtime đổi trên FS có độ phân giải thô),
+  - quá ``max_age`` giây từ lần quét trước (file bị ghi đè tại chỗ không đổi mtime thư mục),
+  - ``force=True`` (nút "Tải lại" của front end).
+- Kích thước ảnh + hash cần đọc cả file nên do một thread nền điền dần; trong lúc chờ, các
+  trường này là None.
+- ``record()``: ai vừa ghi file và đã có hash (upload) báo luôn, khỏi đọc lại.
+
+Hash là blake2b-160 giống ``digest_bytes`` của cache, nên loader dùng lại được thay vì hash lại.
+Nhiều process dùng chung một file DB (WAL); mỗi process tự mở connection.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.api.cache import digest_bytes
+from src.utils import reduced_decode
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+SORT_COLUMNS = {"name": "name", "mtime": "mtime_ns", "size": "size"}
+META_BATCH = 32
+# độ phân giải mtime thô nhất cần tính tới (FAT/SMB: 2 s); quét sát mtime thư mục hơn mức này thì chưa tin
+MTIME_TICK_NS = 2_000_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    hash TEXT,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS idx_files_mtime ON files(dir, mtime_ns);
+CREATE INDEX IF NOT EXISTS idx_files_size ON files(dir, size);
+CREATE INDEX IF NOT EXISTS idx_files_pending ON files(dir, hash);
+"""
+
+
+def version(size: int, mtime_ns: int) -> str:
+    """Chuỗi đổi khi file bị ghi đè; front end gắn vào URL (giống ETag của /api/file)."""
+    return f"{size:x}-{mtime_ns:x}"
+
+
+def image_size(data) -> Optional[Tuple[int, int]]:
+    """(w, h) đọc từ header (JPEG có xoay EXIF, PNG, BMP); định dạng khác thì decode."""
+    size = reduced_decode.jpeg_size(data)
+    if size is not None:
+        return size
+    head = bytes(data[:32])
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if head[:2] == b"BM" and len(head) >= 26:
+        return int.from_bytes(head[18:22], "little", signed=True), abs(int.from_bytes(head[22:26], "little", signed=True))
+    img = cv2.imdecode(np.asarray(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return (img.shape[1], img.shape[0]) if img is not None else None
+
+
+class DirIndex:
+    def __init__(self, db_path: str, root: str, kind: str, extensions=IMAGE_EXTENSIONS, max_age: float = 30.0):
+        self.db_path = os.path.abspath(db_path)
+        self.root = os.path.abspath(root)
+        self.kind = kind
+        self.extensions = tuple(extensions)
+        self.max_age = max_age
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._pid = None
+        self._ensure_local()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def __getstate__(self):
+        return {"db_path": self.db_path, "root": self.root, "kind": self.kind, "extensions": self.extensions,
+                "max_age": self.max_age}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pid = None
+
+    def _ensure_local(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._dir_sig = None
+        self._settled = False
+        self._scanned_at = 0.0
+        self._wake = threading.Event()
+        self._meta_thread = None
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    # ---------- cập nhật ----------
+    def refresh(self, force: bool = False) -> bool:
+        """Quét lại nếu thư mục có thể đã đổi từ lần trước (xem docstring module); True nếu có quét."""
+        self._ensure_local()
+        try:
+            st = os.stat(self.root)
+            sig = (st.st_mtime_ns, st.st_ctime_ns)
+        except FileNotFoundError:
+            sig = None
+        if not force and self._fresh(sig):
+            return False
+        with self._scan_lock:
+            if not force and self._fresh(sig):
+                return False  # request khác vừa quét xong
+            started = time.time_ns()
+            self._scan()
+            self._dir_sig = sig
+            # thay đổi trong cùng tick với lúc quét có thể không làm mtime đổi -> lần sau quét tiếp
+            self._settled = sig is None or started - sig[0] >= MTIME_TICK_NS
+            self._scanned_at = time.monotonic()
+        self._start_meta()
+        return True
+
+    def _fresh(self, sig) -> bool:
+        return (self._scanned_at > 0 and sig == self._dir_sig and self._settled
+                and time.monotonic() - self._scanned_at < self.max_age)
+
+    def _scan(self):
+        found: Dict[str, Tuple[int, int]] = {}
+        if os.path.isdir(self.root):
+            with os.scandir(self.root) as it:
+                for e in it:
+                    if not e.name.lower().endswith(self.extensions):
+                        continue
+                    try:
+                        if not e.is_file():
+                            continue
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    found[e.name] = (st.st_size, st.st_mtime_ns)
+        with self._lock, self._conn:
+            known = {name: (size, mtime) for name, size, mtime in self._conn.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE dir=?", (self.kind,))}
+            gone = [(self.kind, n) for n in known if n not in found]
+            changed = [(self.kind, n, size, mtime) for n, (size, mtime) in found.items() if known.get(n) != (size, mtime)]
+            self._conn.executemany("DELETE FROM files WHERE dir=? AND name=?", gone)
+            # file mới/đổi: metadata cũ không còn đúng -> để thread nền tính lại
+            self._conn.executemany(
+                "INSERT INTO files(dir, name, size, mtime_ns) VALUES(?,?,?,?) "
+                "ON CONFLICT(dir, name) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, "
+                "width=NULL, height=NULL, hash=NULL",
+                changed,
+            )
+
+    def record(self, name: str, digest: Optional[str] = None):
+        """Báo file ``name`` vừa được ghi (kèm hash nếu đã biết); kích thước ảnh để thread nền điền."""
+        self._ensure_local()
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO files(dir, name, size, mtime_ns, hash) VALUES(?,?,?,?,?) "
+                "ON CONFLICT(dir, name) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, "
+                "width=NULL, height=NULL, hash=excluded.hash",
+                (self.kind, name, st.st_size, st.st_mtime_ns, digest),
+            )
+        self._start_meta()
+
+    # ---------- metadata (thread nền) ----------
+    def _start_meta(self):
+        self._wake.set()
+        if self._meta_thread is None or not self._meta_thread.is_alive():
+            self._meta_thread = threading.Thread(target=self._meta_loop, name=f"index-{self.kind}", daemon=True)
+            self._meta_thread.start()
+
+    def _meta_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self._fill_batch():
+                pass
+
+    def _fill_batch(self) -> bool:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, size, mtime_ns, hash FROM files WHERE dir=? AND (hash IS NULL OR width IS NULL) LIMIT ?",
+                (self.kind, META_BATCH),
+            ).fetchall()
+        updates = []
+        for name, size, mtime, digest in rows:
+            path = os.path.join(self.root, name)
+            try:
+                # đã có hash (upload) thì thường chỉ cần header để biết kích thước
+                data = np.fromfile(path, dtype=np.uint8, count=reduced_decode.HEAD_BYTES if digest else -1)
+                dims = image_size(data) if digest else None
+                if dims is None:
+                    data = np.fromfile(path, dtype=np.uint8)
+                    dims = image_size(data)
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or (st.st_size, st.st_mtime_ns) != (size, mtime):
+                # file đổi/mất trong lúc đọc: đánh dấu -1 để không lặp, lần quét sau sẽ ghi lại
+                updates.append((-1, -1, digest or "", self.kind, name, size, mtime))
+                continue
+            dims = dims or (-1, -1)
+            updates.append((dims[0], dims[1], digest or digest_bytes(data), self.kind, name, size, mtime))
+        if updates:
+            with self._lock, self._conn:
+                # chỉ ghi nếu file chưa đổi kể từ lúc chọn
+                self._conn.executemany(
+                    "UPDATE files SET width=?, height=?, hash=? WHERE dir=? AND name=? AND size=? AND mtime_ns=?",
+                    updates,
+                )
+        return len(rows) == META_BATCH
+
+    # ---------- đọc ----------
+    def digest(self, name: str) -> Optional[str]:
+        """Hash đã biết của ``name`` nếu file chưa đổi kể từ lúc ghi nhận (một lần stat), không thì None."""
+        self._ensure_local()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, hash FROM files WHERE dir=? AND name=?", (self.kind, name)
+            ).fetchone()
+        if not row or not row[2]:
+            return None
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None
+        return row[2] if (st.st_size, st.st_mtime_ns) == row[:2] else None
+
+    def list(self, limit: Optional[int] = None, offset: int = 0, prefix: str = "",
+             sort: str = "name", descending: bool = False) -> Tuple[List[Dict], int]:
+        """(trang kết quả, tổng số file khớp ``prefix``)."""
+        self._ensure_local()
+        where, args = "dir=?", [self.kind]
+        if prefix:
+            where += " AND name >= ? AND name < ?"
+            args += [prefix, prefix + "\U0010ffff"]
+        order = "DESC" if descending else "ASC"
+        sql = (f"SELECT name, size, mtime_ns, width, height, hash FROM files WHERE {where} "
+               f"ORDER BY {SORT_COLUMNS[sort]} {order}, name {order} LIMIT ? OFFSET ?")
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM files WHERE {where}", args).fetchone()[0]
+            rows = self._conn.execute(sql, args + [-1 if limit is None else limit, offset]).fetchall()
+        items = []
+        for name, size, mtime, w, h, digest in rows:
+            items.append({
+                "name": name,
+                "size": size,
+                "mtime": mtime / 1e9,
+                "width": w if w is not None and w >= 0 else None,
+                "height": h if h is not None and h >= 0 else None,
+                "hash": digest or None,
+                "version": version(size, mtime),
+            })
+        return items, total
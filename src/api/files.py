@@ -0,0 +1,156 @@
+"""Phục vụ file ảnh cho front end: thumbnail có cache, GET có điều kiện (ETag / 304) và byte range.
+
+- ETag / Last-Modified lấy từ (size, mtime) của file nên không phải đọc nội dung; file bị ghi
+  đè (upload trùng tên, job chạy lại) thì ETag đổi, trình duyệt tải lại.
+- ``Cache-Control: no-cache``: trình duyệt giữ bản cũ nhưng hỏi lại mỗi lần, thường nhận 304.
+- Thumbnail ``?w=`` encode WebP, lưu trong ``DiskCache`` với key theo đường dẫn + size + mtime
+  của file gốc + chiều rộng: file gốc đổi là key đổi, entry cũ tự bị LRU đẩy ra.
+- Range chỉ hỗ trợ một khoảng (``bytes=a-b``, ``bytes=a-``, ``bytes=-n``), và chỉ cho file gốc;
+  nhiều khoảng thì trả cả file.
+"""
+import email.utils
+import mimetypes
+import os
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from src.api.cache import DiskCache, digest_bytes
+from src.utils import encoding, reduced_decode, tiling
+
+THUMB_FORMAT = {"format": "webp", "quality": 75}
+THUMB_MEDIA_TYPE = "image/webp"
+CHUNK = 1 << 16
+CACHE_CONTROL = "no-cache"
+
+
+def etag_for(st: os.stat_result, variant: str = "") -> str:
+    return '"' + f"{st.st_size:x}-{st.st_mtime_ns:x}{variant}" + '"'
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        # so sánh yếu (bỏ W/), "*" khớp mọi thứ
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= email.utils.parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) bao gồm cả end; None = trả cả file; raise ValueError nếu khoảng không hợp lệ (416)."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            n = int(last)
+            if n <= 0:
+                raise ValueError
+            start, end = max(0, size - n), size - 1
+    except ValueError:
+        raise ValueError("invalid range")
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _read_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = f.read(min(CHUNK, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+
+def _validators(st: os.stat_result, variant: str = "", ranges: bool = True):
+    etag = etag_for(st, variant)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": email.utils.formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+    if ranges:
+        headers["Accept-Ranges"] = "bytes"
+    return etag, headers
+
+
+def serve(request: Request, path: str) -> Response:
+    """Trả ``path`` với ETag/Last-Modified, 304 khi client đã có bản này, 206 khi xin một khoảng."""
+    st = os.stat(path)
+    etag, headers = _validators(st)
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    rng = None
+    if_range = request.headers.get("if-range")
+    if request.method == "GET" and (if_range is None or if_range.strip() == etag):
+        try:
+            rng = parse_range(request.headers.get("range"), st.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+    if rng is None:
+        return FileResponse(path, headers=headers, stat_result=st)
+    start, end = rng
+    headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return StreamingResponse(_read_range(path, start, end), status_code=206, headers=headers, media_type=media_type)
+
+
+def _decode(path: str, width: int):
+    data = np.fromfile(path, dtype=np.uint8)
+    size = reduced_decode.jpeg_size(data)
+    if size is not None:
+        # JPEG: decode giảm ngay từ libjpeg, chỉ cần đủ chiều rộng
+        return reduced_decode.imdecode(data, size, (width, 1))[0]
+    img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)  # giữ kênh alpha của output PNG/WebP
+    if img is not None and img.dtype != np.uint8:
+        img = (img >> 8).astype(np.uint8) if img.dtype == np.uint16 else cv2.convertScaleAbs(img)
+    if img is not None and img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img
+
+
+def render_thumbnail(path: str, width: int) -> Optional[bytes]:
+    """WebP rộng ``width`` của ảnh ``path``; None nếu ảnh không rộng hơn ``width`` hoặc không decode được."""
+    img = _decode(path, width)
+    if img is None or img.shape[1] <= width:
+        return None
+    height = max(1, round(img.shape[0] * width / img.shape[1]))
+    return encoding.encode(tiling.resize_area(img, (width, height)), THUMB_FORMAT).tobytes()
+
+
+def serve_thumbnail(request: Request, path: str, width: int, cache: Optional[DiskCache]) -> Response:
+    """Thumbnail của ``path``: 304 ngay theo stat của file gốc (không decode), không thì lấy từ cache
+    hoặc tạo mới; ảnh gốc đã nhỏ hơn ``width`` thì trả luôn file gốc."""
+    st = os.stat(path)
+    etag, headers = _validators(st, f"-w{width}", ranges=False)
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    key = digest_bytes(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{width}".encode())
+    hit = cache.get(key) if cache is not None else None
+    if hit is not None:
+        return FileResponse(hit, headers=headers, media_type=THUMB_MEDIA_TYPE)
+    data = render_thumbnail(path, width)
+    if data is None:
+        # ảnh gốc đã đủ nhỏ: trả file gốc nhưng giữ ETag của thumbnail để lần sau vẫn được 304
+        return FileResponse(path, headers=headers, stat_result=st)
+    if cache is not None:
+        cache.put_bytes(key, data, encoding.extension(THUMB_FORMAT))
+    return Response(content=data, headers=headers, media_type=THUMB_MEDIA_TYPE)
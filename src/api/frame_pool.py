@@ -0,0 +1,198 @@
+"""Pool khung ảnh dùng shared memory cho pipeline của API.
+
+Queue giữa các stage chỉ chở ``FrameHandle`` (name, shape, dtype, offset, slot)
+thay vì cả mảng numpy; pixel nằm trong block ``SharedMemory`` và các stage
+đọc/ghi tại chỗ. Mỗi slot có refcount, về 0 thì slot quay lại free-list và
+block được dùng lại cho ảnh sau (không tạo/xoá shm cho từng ảnh).
+
+Khi hết slot hoặc vượt ngân sách bộ nhớ, ``put`` trả lại chính mảng numpy
+(đi qua queue theo kiểu pickle như cũ) nên pipeline không bao giờ bị kẹt.
+"""
+import os
+import multiprocessing as mp
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+from uuid import uuid4
+
+import numpy as np
+
+FrameHandle = namedtuple("FrameHandle", ["name", "shape", "dtype", "offset", "slot"])
+
+_BLOCK_ALIGN = 1 << 20  # làm tròn block lên bội số 1 MiB để dễ tái sử dụng
+_SHM_DIR = "/dev/shm"
+
+
+def _round_up(n: int) -> int:
+    return max(_BLOCK_ALIGN, -(-n // _BLOCK_ALIGN) * _BLOCK_ALIGN)
+
+
+def _shm_has_room(nbytes: int) -> bool:
+    # /dev/shm đầy thì ghi vào block sẽ SIGBUS -> kiểm tra trước khi tạo
+    try:
+        st = os.statvfs(_SHM_DIR)
+    except (OSError, AttributeError):
+        return True
+    return st.f_bavail * st.f_frsize >= nbytes
+
+
+def is_handle(frame) -> bool:
+    return isinstance(frame, FrameHandle)
+
+
+class FramePool:
+    """Free-list các block shared memory, chia sẻ giữa process cha và các worker.
+
+    Tạo trong process chạy job rồi truyền cho ``Process(args=...)`` (kế thừa
+    lock/array lúc spawn); mỗi process tự attach block theo tên khi cần.
+    """
+
+    def __init__(self, capacity: int = 64, max_bytes: int = 1 << 30, prefix: str = None):
+        self.capacity = max(1, int(capacity))
+        self.max_bytes = int(max_bytes)
+        self.prefix = prefix or f"pf{uuid4().hex[:10]}"
+        self._lock = mp.Lock()
+        self._refs = mp.RawArray("i", self.capacity)
+        self._sizes = mp.RawArray("q", self.capacity)
+        self._gens = mp.RawArray("i", self.capacity)
+        self._attached = {}  # slot -> (name, SharedMemory), riêng từng process
+        self._stale = []
+        # resource tracker phải chạy trước khi fork worker để mọi process dùng chung
+        # một tracker; nếu không, tracker của worker sẽ xoá block khi worker thoát.
+        resource_tracker.ensure_running()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_attached"] = {}
+        state["_stale"] = []
+        return state
+
+    # ---------- quản lý slot ----------
+    def _name(self, slot: int) -> str:
+        return f"{self.prefix}_{slot}_{self._gens[slot]}"
+
+    def _block(self, slot: int):
+        name = self._name(slot)
+        cached = self._attached.get(slot)
+        if cached is not None and cached[0] == name:
+            return cached[1]
+        if cached is not None:
+            self._drop(cached[1])
+        shm = shared_memory.SharedMemory(name=name)
+        self._attached[slot] = (name, shm)
+        return shm
+
+    def _drop(self, shm):
+        try:
+            shm.close()
+        except BufferError:
+            # còn view numpy trỏ vào block cũ -> đóng lại sau
+            self._stale.append(shm)
+
+    def _acquire(self, nbytes: int):
+        need = _round_up(nbytes)
+        with self._lock:
+            best = empty = grow = None
+            used = 0
+            for i in range(self.capacity):
+                size = self._sizes[i]
+                used += size
+                if self._refs[i]:
+                    continue
+                if size == 0:
+                    if empty is None:
+                        empty = i
+                elif size >= need:
+                    if best is None or size < self._sizes[best]:
+                        best = i
+                elif grow is None or size > self._sizes[grow]:
+                    grow = i
+            if best is not None:
+                self._refs[best] = 1
+                return best
+            slot = empty if empty is not None else grow
+            if slot is None:
+                return None
+            old = self._sizes[slot]
+            if used - old + need > self.max_bytes or not _shm_has_room(need):
+                return None
+            if old:
+                self._unlink(slot)
+                self._gens[slot] += 1
+            shm = shared_memory.SharedMemory(name=self._name(slot), create=True, size=need)
+            self._attached[slot] = (shm.name, shm)
+            self._sizes[slot] = need
+            self._refs[slot] = 1
+            return slot
+
+    def _unlink(self, slot: int):
+        cached = self._attached.pop(slot, None)
+        try:
+            shm = cached[1] if cached else shared_memory.SharedMemory(name=self._name(slot))
+            shm.unlink()
+            self._drop(shm)
+        except FileNotFoundError:
+            pass
+
+    # ---------- API cho worker ----------
+    def put(self, img):
+        """Chép ảnh vào một block trống, trả về handle (hoặc chính ảnh nếu hết chỗ)."""
+        img = np.ascontiguousarray(img)
+        slot = self._acquire(img.nbytes)
+        if slot is None:
+            return img
+        dst = np.ndarray(img.shape, dtype=img.dtype, buffer=self._block(slot).buf)
+        dst[...] = img
+        return FrameHandle(self._name(slot), img.shape, img.dtype.str, 0, slot)
+
+    def view(self, frame):
+        """Mảng numpy trỏ thẳng vào block (không copy); ảnh inline trả nguyên."""
+        if not is_handle(frame):
+            return frame
+        buf = self._block(frame.slot).buf
+        return np.ndarray(frame.shape, dtype=np.dtype(frame.dtype), buffer=buf, offset=frame.offset)
+
+    def store(self, out, frame):
+        """Ghi kết quả của stage về block của ``frame`` nếu vừa, ngược lại cấp block mới."""
+        if not is_handle(frame):
+            return self.put(out)
+        out = np.ascontiguousarray(out)
+        if frame.offset + out.nbytes <= self._sizes[frame.slot]:
+            buf = self._block(frame.slot).buf
+            dst = np.ndarray(out.shape, dtype=out.dtype, buffer=buf, offset=frame.offset)
+            if dst.__array_interface__["data"][0] != out.__array_interface__["data"][0]:
+                np.copyto(dst, out)  # filter trả mảng mới; nếu ghi tại chỗ thì bỏ qua
+            return frame._replace(shape=out.shape, dtype=out.dtype.str)
+        new = self.put(out)
+        self.release(frame)
+        return new
+
+    def incref(self, frame):
+        if is_handle(frame):
+            with self._lock:
+                self._refs[frame.slot] += 1
+        return frame
+
+    def release(self, frame):
+        if not is_handle(frame):
+            return
+        with self._lock:
+            if self._refs[frame.slot] > 0:
+                self._refs[frame.slot] -= 1
+
+    def close(self):
+        """Gọi ở process tạo pool sau khi mọi worker đã join: xoá toàn bộ block."""
+        with self._lock:
+            for i in range(self.capacity):
+                if self._sizes[i]:
+                    self._unlink(i)
+                    self._sizes[i] = 0
+                    self._refs[i] = 0
+        for _, shm in list(self._attached.values()):
+            self._drop(shm)
+        self._attached.clear()
+        for shm in self._stale:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        self._stale = []
@@ -0,0 +1,264 @@
+"""Job store cho API: SQLite (WAL) thay cho multiprocessing.Manager.
+
+Worker ghi state/log/output vào buffer trong process rồi một thread nền gom lại
+ghi thành một transaction mỗi ``flush_interval`` giây (append-only, không round-trip
+mỗi lần như proxy Manager). Endpoint đọc thẳng từ SQLite:
+- ``images``: snapshot state mới nhất của từng ảnh (upsert theo ts),
+- ``events``: journal log/state/output có ``seq`` tăng dần để đọc theo cursor.
+- ``metrics``: bộ đếm/histogram theo stage, mỗi process cộng dồn phần thay đổi lúc flush;
+  ``gauges``: giá trị tức thời (ví dụ độ sâu queue của job đang chạy).
+
+Object ``JobStore`` truyền được sang process con (fork hoặc spawn); mỗi process tự
+mở connection riêng.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from multiprocessing import util
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.metrics import Registry
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT,
+    error TEXT,
+    steps TEXT,
+    inputs TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS images (
+    job_id TEXT,
+    file TEXT,
+    ts REAL,
+    data TEXT,
+    PRIMARY KEY (job_id, file)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT,
+    kind TEXT,
+    file TEXT,
+    ts REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_job ON events(job_id, kind, seq);
+CREATE TABLE IF NOT EXISTS metrics (
+    stage TEXT,
+    key TEXT,
+    value REAL,
+    PRIMARY KEY (stage, key)
+);
+CREATE TABLE IF NOT EXISTS gauges (
+    name TEXT,
+    labels TEXT,
+    value REAL,
+    ts REAL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+
+class JobStore:
+    def __init__(self, db_path: str, flush_interval: float = 0.2, batch_size: int = 512):
+        self.db_path = os.path.abspath(db_path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._pid = None
+        self._ensure_local()
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+
+    def __getstate__(self):
+        return {"db_path": self.db_path, "flush_interval": self.flush_interval, "batch_size": self.batch_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pid = None
+
+    # ---------- per-process ----------
+    def _ensure_local(self):
+        """Mở connection/buffer/thread flush riêng cho process hiện tại (sau fork thì mở lại)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._images: List[tuple] = []
+        self._events: List[tuple] = []
+        self._metrics = Registry()
+        self._gauges: Dict[tuple, float] = {}
+        self._wake = threading.Event()
+        self._flusher = None
+        # process con của multiprocessing không chạy atexit -> dùng Finalize để flush lúc thoát
+        util.Finalize(None, self.flush, exitpriority=10)
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="job-store-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        pid = self._pid
+        while pid == os.getpid():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    # ---------- ghi (buffer) ----------
+    def _buffer(self, image=None, event=None):
+        self._ensure_local()
+        with self._lock:
+            if image is not None:
+                self._images.append(image)
+            if event is not None:
+                self._events.append(event)
+            full = len(self._events) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self._wake.set()
+
+    def set_state(self, job_id: str, filename: str, state: Dict):
+        ts = time.time()
+        data = json.dumps(state)
+        self._buffer(image=(job_id, filename, ts, data), event=(job_id, "state", filename, ts, data))
+
+    def log(self, job_id: str, entry: Dict):
+        self._buffer(event=(job_id, "log", entry.get("file"), time.time(), json.dumps(entry)))
+
+    def add_output(self, job_id: str, name: str):
+        self._buffer(event=(job_id, "output", None, time.time(), json.dumps(name)))
+
+    def observe(self, stage: str, seconds: float, status: str = "done"):
+        """Một mẫu latency của stage (gom trong process, cộng vào bảng metrics lúc flush)."""
+        self._ensure_local()
+        self._metrics.observe(stage, seconds, status)
+        self._start_flusher()
+
+    def set_gauge(self, name: str, labels: Dict, value: float):
+        self._ensure_local()
+        with self._lock:
+            self._gauges[(name, json.dumps(labels, sort_keys=True))] = value
+        self._start_flusher()
+
+    def flush(self):
+        self._ensure_local()
+        with self._lock:
+            images, self._images = self._images, []
+            events, self._events = self._events, []
+            gauges, self._gauges = self._gauges, {}
+            metrics = self._metrics.drain()
+            if not images and not events and not gauges and not metrics:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO metrics(stage, key, value) VALUES(?,?,?) "
+                    "ON CONFLICT(stage, key) DO UPDATE SET value=value+excluded.value",
+                    metrics,
+                )
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO gauges(name, labels, value, ts) VALUES(?,?,?,?)",
+                    [(n, lb, v, now) for (n, lb), v in gauges.items()],
+                )
+                # ảnh có thể được ghi từ nhiều process: chỉ giữ bản có ts mới nhất
+                self._conn.executemany(
+                    "INSERT INTO images(job_id, file, ts, data) VALUES(?,?,?,?) "
+                    "ON CONFLICT(job_id, file) DO UPDATE SET ts=excluded.ts, data=excluded.data "
+                    "WHERE excluded.ts >= images.ts",
+                    images,
+                )
+                self._conn.executemany(
+                    "INSERT INTO events(job_id, kind, file, ts, data) VALUES(?,?,?,?,?)", events
+                )
+
+    # ---------- job ----------
+    def create_job(self, job_id: str, steps: List[Dict], inputs: List[str]):
+        self._ensure_local()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs(id, status, error, steps, inputs, created) VALUES(?,?,?,?,?,?)",
+                (job_id, "running", None, json.dumps(steps), json.dumps(inputs), time.time()),
+            )
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        # flush trước để client thấy "done" thì cũng thấy đủ state/log của job
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status=?, error=? WHERE id=?", (status, error, job_id))
+
+    # ---------- đọc ----------
+    def _query(self, sql: str, args=()):
+        self._ensure_local()
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        rows = self._query("SELECT status, error, steps, inputs FROM jobs WHERE id=?", (job_id,))
+        if not rows:
+            return None
+        status, error, steps, inputs = rows[0]
+        return {"status": status, "error": error, "steps": json.loads(steps or "[]"), "inputs": json.loads(inputs or "[]")}
+
+    def image_states(self, job_id: str) -> Dict[str, Dict]:
+        rows = self._query("SELECT file, data FROM images WHERE job_id=?", (job_id,))
+        return {f: json.loads(d) for f, d in rows}
+
+    def logs(self, job_id: str) -> List[Dict]:
+        rows = self._query("SELECT data FROM events WHERE job_id=? AND kind='log' ORDER BY seq", (job_id,))
+        return [json.loads(d) for (d,) in rows]
+
+    def cursor(self, job_id: str) -> int:
+        rows = self._query("SELECT MAX(seq) FROM events WHERE job_id=?", (job_id,))
+        return rows[0][0] or 0
+
+    def changes(self, job_id: str, since: int) -> Dict:
+        """Log mới + state các ảnh thay đổi kể từ ``since`` (seq của events), kèm cursor mới.
+
+        Transaction SQLite ghi tuần tự nên seq commit sau luôn lớn hơn -> đọc theo cursor
+        không bỏ sót event.
+        """
+        rows = self._query(
+            "SELECT seq, kind, file, data FROM events WHERE job_id=? AND seq>? AND kind IN ('log','state') ORDER BY seq",
+            (job_id, since),
+        )
+        logs, files = [], set()
+        cursor = since
+        for seq, kind, f, data in rows:
+            cursor = seq
+            if kind == "log":
+                logs.append(json.loads(data))
+            else:
+                files.add(f)
+        images = {}
+        if files:
+            # lấy snapshot (bản ts mới nhất) thay vì event cuối theo seq
+            marks = ",".join("?" * len(files))
+            snap = self._query(f"SELECT file, data FROM images WHERE job_id=? AND file IN ({marks})", (job_id, *files))
+            images = {f: json.loads(d) for f, d in snap}
+        return {"logs": logs, "images": images, "cursor": cursor}
+
+    def clear_gauges(self, job_id: str):
+        """Xoá các gauge gắn nhãn job (gọi khi job kết thúc)."""
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM gauges WHERE json_extract(labels, '$.job')=?", (job_id,))
+
+    def metrics(self) -> Tuple[Registry, List[tuple]]:
+        """Metrics cộng dồn của mọi process + danh sách gauge (name, labels, value)."""
+        reg = Registry.from_rows(self._query("SELECT stage, key, value FROM metrics"))
+        gauges = [(n, json.loads(lb), v) for n, lb, v in self._query("SELECT name, labels, value FROM gauges ORDER BY name, labels")]
+        return reg, gauges
+
+    def outputs(self, job_id: str) -> List[str]:
+        rows = self._query("SELECT data FROM events WHERE job_id=? AND kind='output' ORDER BY seq", (job_id,))
+        return [json.loads(d) for (d,) in rows]
@@ -1,15 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from fastapi.responses import RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Union, Literal
 from uuid import uuid4
+import asyncio
+import json
 import os
+import shutil
 import numpy as np
 import cv2
 
-from multiprocessing import Process, Queue, Manager, current_process
+from multiprocessing import Pipe, Process, Queue, Value, current_process
+from multiprocessing.connection import wait as mp_wait
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import asynccontextmanager
 import datetime
+from functools import lru_cache
+import threading
+import time
+
+from src.api import files
+from src.api.cache import DiskCache, digest_bytes, steps_key
+from src.api.dir_index import SORT_COLUMNS, DirIndex
+from src.api.frame_pool import FramePool
+from src.api.job_store import JobStore
+from src.api.upload import UploadError, receive_upload
+from src.utils.metrics import render_prometheus
+from src.utils.plan_optimizer import optimize_steps
+from src.utils import encoding, reduced_decode, tiling
 
 # =========================
 # Windows multiprocessing (ổn định khi --reload)
@@ -30,11 +51,61 @@ INPUT_DIR = os.path.join(ROOT_DIR, "data", "input")
 OUTPUT_DIR = os.path.join(ROOT_DIR, "data", "output")
 os.makedirs(INPUT_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+JOBS_DB = os.environ.get("PIPELINE_JOBS_DB", os.path.join(ROOT_DIR, "data", "jobs.db"))
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache")
+
+# Result cache: hash(ảnh input) + chuỗi bước -> output đã encode (0 = tắt)
+RESULT_CACHE_MAX_MB = int(os.environ.get("PIPELINE_RESULT_CACHE_MB", "512"))
+# Cache khung trung gian: hash(input) + tiền tố chuỗi bước -> ảnh đã decode / sau bước nặng (0 = tắt)
+STAGE_CACHE_MAX_MB = int(os.environ.get("PIPELINE_STAGE_CACHE_MB", "1024"))
+# cache thumbnail cho gallery (0 = tắt, thumbnail tạo lại mỗi lần trình duyệt chưa có)
+THUMB_CACHE_MAX_MB = int(os.environ.get("PIPELINE_THUMB_CACHE_MB", "128"))
+THUMB_MIN_WIDTH, THUMB_MAX_WIDTH = 16, 1024
+# chỉ mục thư mục input/output (tên, size, mtime, kích thước, hash) cho /api/images, /api/outputs
+INDEX_DB = os.environ.get("PIPELINE_INDEX_DB", os.path.join(CACHE_DIR, "dirs.db"))
+# quét lại cả thư mục sau chừng này giây dù mtime thư mục không đổi (file bị ghi đè tại chỗ)
+INDEX_MAX_AGE = float(os.environ.get("PIPELINE_INDEX_MAX_AGE", "30"))
+LIST_MAX_LIMIT = 1000
+
+# WarmPool: số worker sống lâu; job có <= POOL_MAX_IMAGES ảnh chạy trên pool,
+# job lớn hơn vẫn dựng pipeline process riêng (0 = tắt pool)
+POOL_WORKERS = int(os.environ.get("PIPELINE_POOL_WORKERS", str(os.cpu_count() or 2)))
+POOL_MAX_IMAGES = int(os.environ.get("PIPELINE_POOL_MAX_IMAGES", "8"))
+
+# Loader: số thread decode song song; maxsize mặc định của queue giữa các stage
+LOADER_THREADS = int(os.environ.get("PIPELINE_LOADER_THREADS", "4"))
+# upload: tổng byte chờ ghi tối đa mỗi request, giới hạn mỗi file (0 = không giới hạn), số thread ghi
+UPLOAD_MEMORY_MB = int(os.environ.get("PIPELINE_UPLOAD_MEMORY_MB", "32"))
+UPLOAD_MAX_FILE_MB = int(os.environ.get("PIPELINE_UPLOAD_MAX_FILE_MB", "0"))
+UPLOAD_WORKERS = int(os.environ.get("PIPELINE_UPLOAD_WORKERS", "8"))
+# số thread encode ảnh output trong sink (cv2.imencode nhả GIL nên scale theo core)
+SINK_ENCODERS = int(os.environ.get("PIPELINE_SINK_ENCODERS", str(os.cpu_count() or 2)))
+QUEUE_MAXSIZE = int(os.environ.get("PIPELINE_QUEUE_MAXSIZE", "8"))
+
+# SSE: chu kỳ đọc store và gửi keep-alive (giây)
+SSE_POLL_INTERVAL = 0.25
+SSE_HEARTBEAT = 15.0
+METRICS_SAMPLE_INTERVAL = 0.5  # chu kỳ lấy mẫu độ sâu queue của job (giây)
+
+# Số slot / ngân sách bytes của shared-memory frame pool cho mỗi job
+FRAME_POOL_SLOTS = int(os.environ.get("PIPELINE_FRAME_POOL_SLOTS", "64"))
+FRAME_POOL_MAX_BYTES = int(os.environ.get("PIPELINE_FRAME_POOL_MAX_MB", "1024")) * (1 << 20)
 
 # =========================
 # FastAPI + CORS (dev)
 # =========================
-app = FastAPI(title="Pipes & Filters API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _POOL
+    if POOL_WORKERS > 0 and POOL_MAX_IMAGES > 0:
+        _POOL = WarmPool(POOL_WORKERS, get_store())
+        _POOL.start()
+    yield
+    if _POOL is not None:
+        _POOL.stop()
+        _POOL = None
+
+app = FastAPI(title="Pipes & Filters API", version="1.0.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -49,33 +120,63 @@ app.add_middleware(
 class StepConfig(BaseModel):
     name: str
     params: Optional[Dict] = {}
+    # số process chạy song song cho bước này (chỉ áp dụng cho pipeline process riêng);
+    # "auto" = chia số core còn lại cho các bước auto
+    replicas: Union[Literal["auto"], int] = 1
+
+class OutputConfig(BaseModel):
+    format: Literal["png", "jpeg", "webp"] = "png"
+    # PNG: mức nén zlib 0-9 (thấp = nhanh, file to); None = mặc định OpenCV
+    compression: Optional[int] = Field(None, ge=0, le=9)
+    # JPEG 0-100 / WebP 1-100; None = mặc định
+    quality: Optional[int] = Field(None, ge=0, le=100)
+    # WebP lossless (bỏ qua quality)
+    lossless: bool = False
 
 class ProcessRequest(BaseModel):
     images: List[str]
     steps: List[StepConfig]
+    # định dạng ảnh output của job; None = PNG mặc định
+    output: Optional[OutputConfig] = None
+    # kích thước tối đa mỗi queue giữa các stage (backpressure); None = QUEUE_MAXSIZE
+    queue_maxsize: Optional[int] = None
+    # False = chạy đúng thứ tự người dùng chọn, không qua plan optimizer
+    optimize: bool = True
+
+class PlanRequest(BaseModel):
+    steps: List[StepConfig]
+    optimize: bool = True
 
 # =========================
 # IO utils
 # =========================
-def read_image_from_disk(path: str):
+def read_bytes_from_disk(path: str):
     if not os.path.exists(path):
         return None
-    data = np.fromfile(path, dtype=np.uint8)
-    img = cv2.imdecode(data, cv2.IMREAD_COLOR)  # BGR
-    return img
+    return np.fromfile(path, dtype=np.uint8)
 
-def save_png_to_disk(img, path_out: str):
-    ok, buf = cv2.imencode(".png", img)
-    if not ok:
-        raise RuntimeError("Encode PNG failed")
-    with open(path_out, "wb") as f:
-        f.write(buf.tobytes())
+def _replace_atomic(write, path_out: str):
+    # ghi ra file tạm rồi os.replace: output luôn là inode mới, không ghi đè lên file
+    # đang được hardlink từ result cache
+    tmp = f"{path_out}.{uuid4().hex[:8]}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path_out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 # =========================
 # Filters (theo repo)
 # =========================
 class FilterBase:
     name = "Base"
+    def warmup(self, replicas: int = 1):
+        """Chuẩn bị tài nguyên nặng (model, cache) trước khi nhận ảnh đầu tiên.
+
+        ``replicas``: số process cùng chạy filter này, để chia ngân sách thread.
+        """
+        pass
     def apply(self, img, **kwargs):
         return img
 
@@ -84,86 +185,133 @@ class Converter(FilterBase):
     def apply(self, img, mode: str = "BGR2GRAY", **kwargs):
         m = (mode or "BGR2GRAY").upper()
         if m == "BGR2GRAY":
-            return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            return tiling.cvt_color(img, cv2.COLOR_BGR2GRAY)
         if m == "BGR2RGB":
-            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            return tiling.cvt_color(img, cv2.COLOR_BGR2RGB)
         if m == "BGR2HSV":
-            return cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            return tiling.cvt_color(img, cv2.COLOR_BGR2HSV)
         return img
 
 class HorizontalFlip(FilterBase):
     name = "HorizontalFlip"
     def apply(self, img, **kwargs):
-        return cv2.flip(img, 1)
+        return tiling.flip_h(img)
 
 class Resize(FilterBase):
     name = "Resize"
-    def apply(self, img, width: Optional[int] = None, height: Optional[int] = None, scale: Optional[float] = None, **kwargs):
-        h, w = img.shape[:2]
+    @staticmethod
+    def target_size(w: int, h: int, width: Optional[int] = None, height: Optional[int] = None,
+                    scale: Optional[float] = None, **kwargs):
+        """Kích thước (w, h) sau resize của ảnh ``w`` x ``h``; None nếu không có tham số nào."""
         if scale is not None:
             s = float(scale)
-            new_w = max(1, int(w * s))
-            new_h = max(1, int(h * s))
-            return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            return max(1, int(w * s)), max(1, int(h * s))
         if width is not None and height is not None:
-            return cv2.resize(img, (int(width), int(height)), interpolation=cv2.INTER_AREA)
+            return int(width), int(height)
         if width is not None:
             new_w = int(width)
-            new_h = max(1, int(h * (new_w / w)))
-            return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            return new_w, max(1, int(h * (new_w / w)))
         if height is not None:
             new_h = int(height)
-            new_w = max(1, int(w * (new_h / h)))
-            return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        return img
+            return max(1, int(w * (new_h / h))), new_h
+        return None
+    def apply(self, img, width: Optional[int] = None, height: Optional[int] = None, scale: Optional[float] = None, **kwargs):
+        h, w = img.shape[:2]
+        size = self.target_size(w, h, width, height, scale)
+        if size is None:
+            return img
+        return tiling.resize_area(img, size)
 
 class Watermark(FilterBase):
+    """Watermark ảnh hoặc text, chỉ blend trên vùng ROI của mark (không copy cả khung).
+
+    Sprite được chuẩn bị một lần mỗi (nguồn, scale, opacity) và cache trong process worker
+    dưới dạng ``out_roi = roi * K + P`` (K: hệ số giữ lại, P: phần màu đã nhân alpha).
+    """
     name = "Watermark"
     def apply(self, img, text: str = "", image: str = "", pos: str = "bottom-right",
               opacity: float = 0.5, scale: float = 1.0, **kwargs):
-        out = img.copy()
+        out = img if img.flags.writeable else img.copy()
         h, w = out.shape[:2]
 
         # ưu tiên watermark ảnh
         if image:
             wm_path = os.path.join(ROOT_DIR, image) if not os.path.isabs(image) else image
             if os.path.exists(wm_path):
-                wm = cv2.imread(wm_path, cv2.IMREAD_UNCHANGED)
-                if wm is not None:
-                    if scale and scale != 1.0:
-                        wm = cv2.resize(
-                            wm,
-                            (max(1, int(wm.shape[1] * scale)), max(1, int(wm.shape[0] * scale))),
-                            interpolation=cv2.INTER_AREA,
-                        )
-                    if wm.shape[2] == 4:
-                        alpha = wm[:, :, 3] / 255.0 * float(opacity)
-                        wm_rgb = wm[:, :, :3]
-                    else:
-                        alpha = np.full(wm.shape[:2], float(opacity), dtype=np.float32)
-                        wm_rgb = wm
-                    hh, ww = wm_rgb.shape[:2]
+                st = os.stat(wm_path)
+                sprite = _image_sprite(wm_path, st.st_mtime_ns, st.st_size, float(scale or 1.0), float(opacity))
+                if sprite is not None:
+                    K, P = sprite
+                    hh, ww = K.shape[:2]
                     x, y = _place_xy(pos, w, h, ww, hh)
-                    roi = out[y:y+hh, x:x+ww]
-                    if roi.shape[0] == hh and roi.shape[1] == ww:
-                        for c in range(3):
-                            roi[:, :, c] = (alpha * wm_rgb[:, :, c] + (1 - alpha) * roi[:, :, c]).astype(np.uint8)
-                        out[y:y+hh, x:x+ww] = roi
+                    if y + hh <= h and x + ww <= w:
+                        _blend_roi(out[y:y+hh, x:x+ww], K, P)
                     return out
 
-        # watermark text
+        # watermark text (bóng đen + chữ trắng theo opacity)
         if text:
-            fs = 1.0 * float(scale)
-            th = max(1, int(2 * scale))
-            (tw, th_text), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, fs, th)
+            K, P, tw, th_text, pad = _text_sprite(text, float(scale), float(opacity))
             x, y = _place_xy(pos, w, h, tw, th_text)
             y = max(th_text + 5, y + th_text)
-            cv2.putText(out, text, (x+2, y+2), cv2.FONT_HERSHEY_SIMPLEX, fs, (0,0,0), th+1, cv2.LINE_AA)
-            overlay = out.copy()
-            cv2.putText(overlay, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, fs, (255,255,255), th, cv2.LINE_AA)
-            cv2.addWeighted(overlay, float(opacity), out, 1.0 - float(opacity), 0, out)
+            # góc trên-trái của sprite trong ảnh, cắt phần nằm ngoài khung
+            x0, y0 = x - pad, y - th_text - pad
+            sh, sw = K.shape[:2]
+            cx0, cy0 = max(0, -x0), max(0, -y0)
+            cx1, cy1 = min(sw, w - x0), min(sh, h - y0)
+            if cx1 > cx0 and cy1 > cy0:
+                _blend_roi(out[y0+cy0:y0+cy1, x0+cx0:x0+cx1], K[cy0:cy1, cx0:cx1], P[cy0:cy1, cx0:cx1])
         return out
 
+def _blend_roi(roi, K, P):
+    """Ghi tại chỗ ``roi = roi * K + P`` trên 3 kênh màu (ảnh BGRA giữ nguyên alpha); ROI lớn thì chia dải."""
+    tiling.blend(roi, K, P)
+
+@lru_cache(maxsize=32)
+def _image_sprite(path: str, mtime_ns: int, size: int, scale: float, opacity: float):
+    # mtime/size nằm trong key để file watermark đổi thì sprite được dựng lại
+    wm = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if wm is None:
+        return None
+    if wm.ndim == 2:
+        wm = cv2.cvtColor(wm, cv2.COLOR_GRAY2BGR)
+    if scale != 1.0:
+        wm = cv2.resize(
+            wm,
+            (max(1, int(wm.shape[1] * scale)), max(1, int(wm.shape[0] * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    if wm.shape[2] == 4:
+        alpha = wm[:, :, 3:4].astype(np.float32) * np.float32(opacity / 255.0)
+    else:
+        alpha = np.full(wm.shape[:2] + (1,), opacity, dtype=np.float32)
+    P = wm[:, :, :3] * alpha
+    return _frozen(1.0 - alpha), _frozen(P)
+
+@lru_cache(maxsize=64)
+def _text_sprite(text: str, scale: float, opacity: float):
+    """Mask bóng (ms) và chữ (mt) vẽ một lần trên canvas nhỏ, gộp thành K/P:
+    ``out = (roi * (1-ms)) * (1 - op*mt) + 255 * op*mt``.
+    """
+    fs = 1.0 * scale
+    th = max(1, int(2 * scale))
+    (tw, th_text), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, fs, th)
+    pad = th + 4
+    size = (th_text + baseline + 2 * pad + 2, tw + 2 * pad + 2)
+    shadow = np.zeros(size, np.uint8)
+    mark = np.zeros(size, np.uint8)
+    cv2.putText(shadow, text, (pad + 2, pad + th_text + 2), cv2.FONT_HERSHEY_SIMPLEX, fs, 255, th + 1, cv2.LINE_AA)
+    cv2.putText(mark, text, (pad, pad + th_text), cv2.FONT_HERSHEY_SIMPLEX, fs, 255, th, cv2.LINE_AA)
+    ms = shadow[:, :, None].astype(np.float32) / 255.0
+    mt = mark[:, :, None].astype(np.float32) * np.float32(opacity / 255.0)
+    K = (1.0 - ms) * (1.0 - mt)
+    P = np.repeat(255.0 * mt, 3, axis=2)
+    return _frozen(K), _frozen(P), tw, th_text, pad
+
+def _frozen(arr):
+    arr = np.ascontiguousarray(arr, dtype=np.float32)
+    arr.setflags(write=False)
+    return arr
+
 def _place_xy(pos: str, W: int, H: int, w: int, h: int):
     pos = (pos or "bottom-right").lower()
     margin = 10
@@ -180,64 +328,222 @@ def _place_xy(pos: str, W: int, H: int, w: int, h: int):
 class OutputFilter(FilterBase):
     name = "OutputFilter"
 
+def _hex_to_bgr(color: str):
+    c = (color or "#ffffff").lstrip("#")
+    try:
+        r, g, b = (int(c[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        r, g, b = 255, 255, 255
+    return (b, g, r)
+
 # RemoveBackground (nếu có rembg)
 try:
     from rembg import remove as _rembg_remove  # type: ignore
+    from src.utils.rembg_session import REMBG_MODEL, REMBG_MODELS, new_session
+    from src.utils.compositing import BACKGROUNDS, composite
     class RemoveBackground(FilterBase):
         name = "RemoveBackground"
-        def apply(self, img, **kwargs):
+        def __init__(self):
+            self._sessions = {}  # model -> session, sống cùng process worker
+            self._replicas = 1
+        def warmup(self, replicas: int = 1):
+            self._replicas = replicas
+            self._session(REMBG_MODEL)
+        def _session(self, model: str):
+            sess = self._sessions.get(model)
+            if sess is None:
+                sess = self._sessions[model] = new_session(model, replicas=self._replicas)
+            return sess
+        def apply(self, img, model: str = None, background: str = "none", color: str = "#ffffff",
+                  checker_size: int = 20, **kwargs):
             rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            out = _rembg_remove(rgb)
+            out = _rembg_remove(rgb, session=self._session(model or REMBG_MODEL))
+            if background and background != "none":
+                return composite(out, background, checker_size or 20, _hex_to_bgr(color))
             bgr = cv2.cvtColor(out, cv2.COLOR_RGB2BGR)
             return bgr
     _HAVE_REMBG = True
 except Exception:
     _HAVE_REMBG = False
 
+def _resize_noop(p: Dict) -> bool:
+    return p.get("width") is None and p.get("height") is None and (p.get("scale") is None or float(p["scale"]) == 1.0)
+
+def _resize_downscale(p: Dict) -> bool:
+    # chỉ scale < 1 chắc chắn là thu nhỏ; width/height tuyệt đối phụ thuộc ảnh nguồn
+    return p.get("scale") is not None and float(p["scale"]) < 1.0
+
 # Registry
+# "cost": "light" -> filter rẻ (vài ms), các bước light liền nhau được fuse vào một process;
+#         "heavy" -> luôn chạy ở stage riêng.
+# "files": tên các param là đường dẫn file (nội dung file ảnh hưởng kết quả -> vào cache key).
+# "commutes"/"identity"/"noop"/"downscale"/"involution": metadata cho plan optimizer
+# (xem src/utils/plan_optimizer.py). Watermark phụ thuộc vị trí và kích thước pixel nên không
+# giao hoán với flip/resize. "exact" chỉ dành cho cặp cho ra ảnh y hệt từng bit (có test
+# tests/test_plan_optimizer.py); flip/resize INTER_AREA lệch do làm tròn nên chỉ "approx".
 FILTERS: Dict[str, Dict] = {
-    "Converter": {"cls": Converter, "params": {
+    "Converter": {"cls": Converter, "cost": "light", "commutes": {"HorizontalFlip": "exact", "Resize": "approx"}, "params": {
         "mode": {"type": "enum", "options": ["BGR2GRAY", "BGR2RGB", "BGR2HSV"], "default": "BGR2GRAY"}
     }},
-    "HorizontalFlip": {"cls": HorizontalFlip, "params": {}},
-    "Resize": {"cls": Resize, "params": {
+    "HorizontalFlip": {"cls": HorizontalFlip, "cost": "light", "involution": True,
+                       "commutes": {"Resize": "approx"}, "params": {}},
+    "Resize": {"cls": Resize, "cost": "light", "noop": _resize_noop, "downscale": _resize_downscale, "params": {
         "width":  {"type": "int", "min": 1, "max": 8192, "default": None, "step": 1},
         "height": {"type": "int", "min": 1, "max": 8192, "default": None, "step": 1},
         "scale":  {"type": "float",  "min": 0.1, "max": 4.0, "default": None, "step": 0.1}
     }},
-    "Watermark": {"cls": Watermark, "params": {
+    "Watermark": {"cls": Watermark, "cost": "light", "files": ["image"], "params": {
         "text":    {"type": "string", "default": ""},
         "image":   {"type": "string", "default": ""},
         "pos":     {"type": "enum", "options": ["top-left","top-right","bottom-left","bottom-right","center"], "default": "bottom-right"},
         "opacity": {"type": "float", "min": 0.0, "max": 1.0, "default": 0.5, "step": 0.05},
         "scale":   {"type": "float", "min": 0.1, "max": 3.0, "default": 1.0, "step": 0.1}
     }},
-    "OutputFilter": {"cls": OutputFilter, "params": {}},
+    "OutputFilter": {"cls": OutputFilter, "cost": "light", "identity": True, "params": {}},
 }
+def _rembg_commutes(p: Dict, _other: Dict) -> Optional[str]:
+    # ô checker cố định theo pixel và neo ở góc trái trên: resize/lật trước hay sau cho
+    # ô to nhỏ / lệch pha khác hẳn, không còn là "gần đúng"
+    return None if p.get("background") == "checker" else "approx"
+
 if _HAVE_REMBG:
-    FILTERS["RemoveBackground"] = {"cls": RemoveBackground, "params": {}}
+    # mask tính trên ảnh đã thu nhỏ/lật gần như bằng mask của ảnh gốc rồi thu nhỏ/lật
+    FILTERS["RemoveBackground"] = {"cls": RemoveBackground, "cost": "heavy",
+                                   "commutes": {"HorizontalFlip": _rembg_commutes, "Resize": _rembg_commutes}, "params": {
+        "model": {"type": "enum", "options": REMBG_MODELS, "default": REMBG_MODEL},
+        "background": {"type": "enum", "options": ["none"] + BACKGROUNDS, "default": "none"},
+        "color": {"type": "string", "default": "#ffffff"},
+        "checker_size": {"type": "int", "min": 2, "max": 256, "default": 20, "step": 1}
+    }}
+
+def plan_stages(steps: List[Dict]) -> List[List[int]]:
+    """Gom các bước light liền nhau thành một stage; bước heavy đứng riêng.
+
+    Trả về danh sách stage, mỗi stage là list index của bước trong ``steps``.
+    """
+    stages: List[List[int]] = []
+    prev_light = False
+    for i, s in enumerate(steps):
+        light = FILTERS[s["name"]].get("cost", "heavy") == "light"
+        if light and prev_light:
+            stages[-1].append(i)
+        else:
+            stages.append([i])
+        prev_light = light
+    return stages
+
+def resolve_replicas(steps: List[Dict], stages: List[List[int]]) -> List[int]:
+    """Số replica cho từng stage: lấy max của các bước trong stage, "auto" tính theo os.cpu_count()."""
+    wanted = []
+    for stage in stages:
+        reps = [steps[i].get("replicas", 1) or 1 for i in stage]
+        wanted.append("auto" if "auto" in reps else max(1, max(int(r) for r in reps)))
+    n_auto = sum(1 for w in wanted if w == "auto")
+    if n_auto:
+        fixed = sum(w for w in wanted if w != "auto") + 1  # + sink
+        auto = max(1, ((os.cpu_count() or 1) - fixed) // n_auto)
+        wanted = [auto if w == "auto" else w for w in wanted]
+    return wanted
 
 # =========================
-# Store dùng Manager — LAZY (không tạo lúc import)
+# Job store (SQLite WAL) — LAZY (không tạo lúc import)
 # =========================
-_manager = None
-_JOBS = None
-
-def get_store():
-    """Khởi tạo Manager + JOBS đúng lúc (chỉ trong process cha)."""
-    global _manager, _JOBS
-    if _manager is None:
-        _manager = Manager()
-    if _JOBS is None:
-        _JOBS = _manager.dict()
-    return _manager, _JOBS
+_STORE: Optional[JobStore] = None
+
+def get_store() -> JobStore:
+    """Khởi tạo JobStore đúng lúc (process cha); object truyền được sang process con."""
+    global _STORE
+    if _STORE is None:
+        _STORE = JobStore(JOBS_DB)
+    return _STORE
+
+_RESULT_CACHE: Optional[DiskCache] = None
+
+def get_result_cache() -> Optional[DiskCache]:
+    global _RESULT_CACHE
+    if _RESULT_CACHE is None and RESULT_CACHE_MAX_MB > 0:
+        _RESULT_CACHE = DiskCache(os.path.join(CACHE_DIR, "results"), RESULT_CACHE_MAX_MB << 20)
+    return _RESULT_CACHE
+
+_STAGE_CACHE: Optional[DiskCache] = None
+
+def get_stage_cache() -> Optional[DiskCache]:
+    global _STAGE_CACHE
+    if _STAGE_CACHE is None and STAGE_CACHE_MAX_MB > 0:
+        _STAGE_CACHE = DiskCache(os.path.join(CACHE_DIR, "stages"), STAGE_CACHE_MAX_MB << 20)
+    return _STAGE_CACHE
+
+_THUMB_CACHE: Optional[DiskCache] = None
+
+def get_thumb_cache() -> Optional[DiskCache]:
+    global _THUMB_CACHE
+    if _THUMB_CACHE is None and THUMB_CACHE_MAX_MB > 0:
+        _THUMB_CACHE = DiskCache(os.path.join(CACHE_DIR, "thumbs"), THUMB_CACHE_MAX_MB << 20)
+    return _THUMB_CACHE
+
+_INDEXES: Dict[str, DirIndex] = {}
+
+def get_dir_index(kind: str) -> DirIndex:
+    """Chỉ mục của thư mục ``kind`` ("input" / "output"), tạo lúc cần."""
+    idx = _INDEXES.get(kind)
+    if idx is None:
+        idx = _INDEXES[kind] = DirIndex(INDEX_DB, INPUT_DIR if kind == "input" else OUTPUT_DIR, kind,
+                                        max_age=INDEX_MAX_AGE)
+    return idx
+
+def normalize_steps(steps: List[Dict]) -> List[Dict]:
+    """Điền default từ registry vào params để hai chuỗi bước tương đương cho ra cùng cache key."""
+    out = []
+    for s in steps:
+        spec = FILTERS[s["name"]].get("params", {})
+        params = {k: v.get("default") for k, v in spec.items()}
+        params.update(s.get("params") or {})
+        out.append({"name": s["name"], "params": params})
+    return out
+
+def _file_stamp(value: str) -> str:
+    # cùng cách tìm file như filter (tương đối theo ROOT_DIR); đổi nội dung tại chỗ -> size/mtime đổi
+    path = value if os.path.isabs(value) else os.path.join(ROOT_DIR, value)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+def _with_file_stamps(steps: List[Dict]) -> List[Dict]:
+    """Thêm ``@<param>`` = size/mtime của file mà param (khai báo trong ``"files"``) trỏ tới, chỉ dùng cho key."""
+    out = []
+    for s in steps:
+        params = dict(s.get("params") or {})
+        for name in FILTERS[s["name"]].get("files", ()):
+            if params.get(name):
+                params[f"@{name}"] = _file_stamp(params[name])
+        out.append({**s, "params": params})
+    return out
+
+def cache_plan(steps: List[Dict], output: Optional[Dict] = None) -> Dict:
+    """Key chuỗi bước cho result cache và cho các điểm lưu khung trung gian.
+
+    ``prefixes[k]`` = key của k bước đầu; chỉ lưu sau decode (k=0) và sau các bước nặng,
+    vì tính lại tiền tố chỉ gồm bước nhẹ rẻ hơn đọc .npy từ đĩa.
+    ``resize``: params của bước đầu nếu đó là Resize (None nếu không).
+    ``output``: định dạng output đã chuẩn hoá; khác PNG mặc định thì nằm trong key kết quả.
+    """
+    norm = _with_file_stamps(normalize_steps(steps))
+    points = [0] + [i + 1 for i, s in enumerate(steps) if FILTERS[s["name"]].get("cost") == "heavy"]
+    fmt = encoding.normalize(output)
+    result = norm if encoding.is_default(fmt) else norm + [{"name": "@output", "params": fmt}]
+    plan = {"result": steps_key(result), "prefixes": {k: steps_key(norm[:k]) for k in points}, "output": fmt}
+    # bước đầu là Resize: loader decode giảm rồi làm luôn bước này (xem _decode_input)
+    plan["resize"] = norm[0]["params"] if norm and norm[0]["name"] == "Resize" else None
+    return plan
 
 def _now_iso():
     return datetime.datetime.utcnow().isoformat() + "Z"
 
-def _append_log(logs_list, level, stage_idx, stage_label, worker_name, filename, message):
+def _append_log(store: JobStore, job_id: str, level, stage_idx, stage_label, worker_name, filename, message):
     try:
-        logs_list.append({
+        store.log(job_id, {
             "ts": _now_iso(),
             "level": level,
             "stage_idx": stage_idx,
@@ -253,115 +559,662 @@ def _append_log(logs_list, level, stage_idx, stage_label, worker_name, filename,
 # =========================
 # Workers
 # =========================
-def worker_filter(in_q: Queue, out_q: Queue, filt_cls, step_label, stage_idx: int, job_id: str, state_map, worker_name: str, params: Dict, logs_list):
-    filt = filt_cls()
+def _run_steps(chain, img, filename: str, store: JobStore, job_id: str):
+    """Áp lần lượt các filter trong ``chain`` = [(step, filter_obj)], ghi state/log theo từng filter.
+
+    Lỗi ở bước nào thì ghi state error cho bước đó và trả về None.
+    """
+    st = chain[0][0]
+    t0 = time.perf_counter()
+    try:
+        for st, filt in chain:
+            store.set_state(job_id, filename, {"state": "processing", "current_filter": st["name"], "worker": st["worker"]})
+            _append_log(store, job_id, "info", st["idx"], st["name"], st["worker"], filename, "received")
+            t0 = time.perf_counter()
+            img = filt.apply(img, **(st["params"] or {}))
+            if img is not None and img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            store.observe(st["name"], time.perf_counter() - t0)
+            _append_log(store, job_id, "info", st["idx"], st["name"], st["worker"], filename, "processed")
+        return img
+    except Exception as ex:
+        store.observe(st["name"], time.perf_counter() - t0, "error")
+        store.set_state(job_id, filename, {"state": "error", "current_filter": st["name"], "worker": st["worker"], "error": str(ex)})
+        _append_log(store, job_id, "error", st["idx"], st["name"], st["worker"], filename, f"error: {ex}")
+        return None
+
+def _save_output(img, filename: str, store: JobStore, job_id: str, sink_name: str, cache_key: Optional[str] = None,
+                 output: Optional[Dict] = None) -> bool:
+    name, _ = os.path.splitext(os.path.basename(filename))
+    out_name = f"{name}__out{encoding.extension(output)}"
+    out_path = os.path.join(OUTPUT_DIR, out_name)
+    _append_log(store, job_id, "info", None, "sink", sink_name, filename, "received")
+    t0 = time.perf_counter()
+    try:
+        encoding.save(img, out_path, encoding.normalize(output))
+        store.observe("sink", time.perf_counter() - t0)
+        store.add_output(job_id, out_name)
+        store.set_state(job_id, filename, {"state": "done", "current_filter": None, "worker": "sink"})
+        _append_log(store, job_id, "info", None, "sink", sink_name, filename, f"saved -> {out_name}")
+        cache = get_result_cache()
+        if cache is not None and cache_key:
+            try:
+                cache.put_file(cache_key, out_path)
+            except OSError:
+                pass
+        return True
+    except Exception as ex:
+        store.observe("sink", time.perf_counter() - t0, "error")
+        store.set_state(job_id, filename, {"state": "error", "current_filter": "sink", "worker": "sink", "error": str(ex)})
+        _append_log(store, job_id, "error", None, "sink", sink_name, filename, f"error: {ex}")
+        return False
+
+def _input_digest(path: str, data) -> str:
+    # hash đã có trong chỉ mục (upload hoặc thread nền đã tính) và file chưa đổi -> khỏi hash lại
+    known = get_dir_index("input").digest(os.path.basename(path))
+    return known if known is not None else digest_bytes(data)
+
+def _open_input(filename: str, plan: Dict, use_result: bool = True):
+    """Đọc file input một lần: hash nội dung, tra result cache, rồi tới cache khung trung gian.
+
+    Trả về (img, cached_path, meta); img None và cached_path None nghĩa là không đọc được.
+    ``meta["start"]``: số bước đầu đã có sẵn trong ``img`` (resume từ tiền tố dài nhất);
+    ``meta["stage_keys"]``: {k: key} để worker lưu khung sau bước k.
+    ``use_result=False``: không trả cache hit (vẫn tính key để lưu kết quả sau khi xử lý).
+    """
+    path = os.path.join(INPUT_DIR, filename)
+    data = read_bytes_from_disk(path)
+    if data is None:
+        return None, None, {}
+    meta = {"input": _input_digest(path, data), "start": 0}
+    cache = get_result_cache()
+    if cache is not None:
+        meta["key"] = digest_bytes(f"{meta['input']}|{plan['result']}".encode())
+        hit = cache.get(meta["key"]) if use_result else None
+        if hit is not None:
+            return None, hit, meta
+    stages = get_stage_cache()
+    if stages is None:
+        img, meta["start"], meta["decoded_resize"] = _decode_input(data, plan)
+        return img, None, meta
+    meta["stage_keys"] = {k: digest_bytes(f"{meta['input']}|{pk}".encode()) for k, pk in plan["prefixes"].items()}
+    order = sorted(meta["stage_keys"], reverse=True)
+    pos, path = stages.get_first([meta["stage_keys"][k] for k in order])
+    if path is not None:
+        try:
+            meta["start"] = order[pos]
+            return np.load(path), None, meta
+        except (OSError, ValueError):
+            meta["start"] = 0
+    img, meta["start"], meta["decoded_resize"] = _decode_input(data, plan)
+    if img is not None and meta["start"] == 0:
+        # khung decode giảm không phải khung gốc -> không lưu làm tiền tố k=0
+        _store_stage(meta, 0, img)
+    return img, None, meta
+
+def _decode_input(data, plan: Dict):
+    """Decode input. Nếu bước đầu là Resize thu nhỏ và input là JPEG thì decode giảm (1/2, 1/4, 1/8)
+    rồi resize luôn về đúng kích thước bước đó tính trên ảnh gốc.
+
+    Trả về (img, số bước đã làm xong: 0 hoặc 1, info); ``info`` = {"factor", "seconds"} khi đã
+    làm luôn bước Resize (để ghi log/metrics cho bước đó như khi chạy filter), ngược lại None.
+    """
+    params = plan.get("resize")
+    size = reduced_decode.jpeg_size(data) if params is not None else None
+    target = Resize.target_size(size[0], size[1], **params) if size else None
+    img, factor = reduced_decode.imdecode(data, size, target)
+    if img is None or factor == 1:
+        return img, 0, None
+    t0 = time.perf_counter()
+    img = tiling.resize_area(img, target)
+    return img, 1, {"factor": factor, "seconds": time.perf_counter() - t0}
+
+def _load_input(filename: str, plan: Dict, store: JobStore, use_result: bool = True):
+    """``_open_input`` + metrics stage "load" (cache hit tính là skip)."""
+    t0 = time.perf_counter()
+    img, cached, meta = _open_input(filename, plan, use_result)
+    status = "skip" if cached is not None else ("error" if img is None else "done")
+    store.observe("load", time.perf_counter() - t0, status)
+    return img, cached, meta
+
+def _load_or_serve(filename: str, plan: Dict, store: JobStore, job_id: str):
+    """``_load_input`` và trả luôn output nếu có trong result cache.
+
+    Trả về (img, served, meta). Entry bị process khác evict giữa lúc tra và lúc link/copy thì
+    không coi là lỗi: đọc lại input và xử lý như cache miss.
+    """
+    img, cached, meta = _load_input(filename, plan, store)
+    if cached is None:
+        return img, False, meta
+    if _serve_cached(cached, filename, store, job_id):
+        return None, True, meta
+    img, _, meta = _load_input(filename, plan, store, use_result=False)
+    return img, False, meta
+
+def _log_start(store: JobStore, job_id: str, worker_name: str, filename: str, meta: Dict):
+    """Log các bước đầu không phải chạy filter: Resize đã làm lúc decode, hoặc tiền tố lấy từ cache."""
+    info = meta.get("decoded_resize")
+    if info:
+        # bước 1 (Resize) chạy ngay lúc decode: vẫn ghi như một bước đã xong cho job view + /metrics
+        store.observe("Resize", info["seconds"])
+        _append_log(store, job_id, "info", 0, "Resize", worker_name, filename,
+                    f"resize applied at decode (JPEG 1/{info['factor']})")
+    elif meta.get("start"):
+        _append_log(store, job_id, "info", None, "loader", worker_name, filename, f"resume after step {meta['start']} (cached)")
+
+def _store_stage(meta: Dict, k: int, img):
+    key = meta.get("stage_keys", {}).get(k)
+    stages = get_stage_cache()
+    if key is None or stages is None or img is None:
+        return
+    try:
+        stages.put_array(key, img)
+    except OSError:
+        pass
+
+def _run_cached(chain, img, filename: str, store: JobStore, job_id: str, meta: Dict):
+    """``_run_steps`` có biết tới cache trung gian: bỏ các bước đã có trong ``img``,
+    cắt chain tại các điểm lưu và lưu khung sau mỗi đoạn. Không còn bước nào thì trả nguyên ``img``.
+    """
+    start = meta.get("start", 0)
+    todo = [c for c in chain if c[0]["idx"] >= start]
+    keys = meta.get("stage_keys", {})
+    seg = []
+    for c in todo:
+        seg.append(c)
+        k = c[0]["idx"] + 1
+        if k in keys:
+            img = _run_steps(seg, img, filename, store, job_id)
+            if img is None:
+                return None
+            _store_stage(meta, k, img)
+            seg = []
+    if seg:
+        img = _run_steps(seg, img, filename, store, job_id)
+    return img
+
+def _serve_cached(cached_path: str, filename: str, store: JobStore, job_id: str) -> bool:
+    """Cache hit: hardlink (hoặc copy) output đã có vào OUTPUT_DIR, đánh dấu done + cached."""
+    name, _ = os.path.splitext(os.path.basename(filename))
+    out_name = f"{name}__out{os.path.splitext(cached_path)[1]}"
+    def write(tmp):
+        try:
+            os.link(cached_path, tmp)
+        except OSError:
+            shutil.copyfile(cached_path, tmp)
+    try:
+        _replace_atomic(write, os.path.join(OUTPUT_DIR, out_name))
+    except OSError as ex:
+        # thường là entry vừa bị evict: caller xử lý lại ảnh như cache miss
+        _append_log(store, job_id, "warning", None, "cache", "cache", filename, f"cache entry unusable ({ex}), reprocessing")
+        return False
+    store.add_output(job_id, out_name)
+    store.set_state(job_id, filename, {"state": "done", "current_filter": None, "worker": "cache", "cached": True})
+    _append_log(store, job_id, "info", None, "cache", "cache", filename, f"cache hit -> {out_name}")
+    return True
+
+def _make_filter(cls, replicas: int = 1):
+    filt = cls()
+    filt.warmup(replicas)
+    return filt
+
+# Giao thức sentinel khi stage có nhiều replica:
+# - None: một replica của stage trước đã xong (mỗi replica gửi đúng một None).
+# - _STOP: lệnh dừng nội bộ của stage. Replica nhận None cuối cùng (đủ số replica
+#   upstream) đẩy _STOP vào chính input queue cho từng replica cùng stage; replica nào
+#   nhận _STOP thì gửi None xuống dưới rồi thoát. Mỗi process đẩy item trước None của
+#   nó nên stage sau chỉ kết thúc khi mọi replica phía trước đã xong.
+_STOP = "__stop__"
+
+def worker_filter(in_q: Queue, out_q: Queue, stage_steps: List[Dict], job_id: str, store: JobStore, pool: FramePool,
+                  n_upstream: int, n_replicas: int, ends_seen):
+    """Một process (một replica) cho một stage; stage có thể gồm nhiều filter đã fuse, áp lần lượt.
+
+    ``stage_steps``: [{"idx", "name", "cls", "params", "worker"}] theo thứ tự chạy.
+    State/log vẫn ghi theo từng filter để UI hiển thị như khi mỗi bước một process.
+    ``ends_seen``: Value đếm None đã nhận, dùng chung giữa các replica của stage.
+    """
+    chain = [(st, _make_filter(st["cls"], n_replicas)) for st in stage_steps]
     _ = current_process().name
-    while True:
-        item = in_q.get()
-        if item is None:
-            # propagate sentinel and log
-            _append_log(logs_list, "info", stage_idx, step_label, worker_name, None, "sentinel received, exiting")
+    ended = False
+    try:
+        while True:
+            item = in_q.get()
+            if item is None:
+                with ends_seen.get_lock():
+                    ends_seen.value += 1
+                    last = ends_seen.value == n_upstream
+                if not last:
+                    continue
+                if n_replicas > 1:
+                    for _r in range(n_replicas):
+                        in_q.put(_STOP)
+                    continue
+                item = _STOP
+            if isinstance(item, str) and item == _STOP:
+                # propagate sentinel and log
+                for st, _f in chain:
+                    _append_log(store, job_id, "info", st["idx"], st["name"], st["worker"], None, "sentinel received, exiting")
+                store.flush()
+                ended = True
+                out_q.put(None)
+                break
+            filename, frame, meta = item
+            if chain[-1][0]["idx"] < meta.get("start", 0):
+                # cả stage nằm trong tiền tố đã cache -> chuyển tiếp nguyên frame
+                out_q.put(item)
+                continue
+            try:
+                out = _run_cached(chain, pool.view(frame), filename, store, job_id, meta)
+                # ghi kết quả về block shm (tại chỗ nếu vừa) -> queue chỉ chở handle
+                result = pool.store(out, frame) if out is not None else None
+            except Exception as ex:
+                # lỗi ngoài filter (shm đầy, không map được block...): chỉ hỏng ảnh này
+                st = chain[0][0]
+                store.set_state(job_id, filename, {"state": "error", "current_filter": st["name"], "worker": st["worker"], "error": str(ex)})
+                _append_log(store, job_id, "error", st["idx"], st["name"], st["worker"], filename, f"error: {ex}")
+                out = None
+            if out is None:
+                pool.release(frame)
+                continue
+            out_q.put((filename, result, meta))
+    finally:
+        # process chết giữa chừng vẫn phải báo None, không thì stage sau / sink chờ mãi
+        if not ended:
             out_q.put(None)
-            break
-        filename, img = item
-        state_map[filename] = {"state": "processing", "current_filter": step_label, "worker": worker_name}
-        _append_log(logs_list, "info", stage_idx, step_label, worker_name, filename, "received")
+
+def worker_sink(in_q: Queue, job_id: str, store: JobStore, pool: FramePool, sink_name="sink", n_upstream: int = 1,
+                output: Optional[Dict] = None, n_encoders: int = 1):
+    """Sink: encode + ghi output trên ``n_encoders`` thread; tối đa 2 * n_encoders frame đang encode
+    (mỗi frame giữ một block shm) để stage trước không bị giữ hết block."""
+    def save(filename, frame, meta, worker):
         try:
-            out = filt.apply(img, **(params or {}))
-            if out is not None and out.ndim == 2:
-                out = cv2.cvtColor(out, cv2.COLOR_GRAY2BGR)
-            _append_log(logs_list, "info", stage_idx, step_label, worker_name, filename, "processed")
-            out_q.put((filename, out))
-        except Exception as ex:
-            state_map[filename] = {"state": "error", "current_filter": step_label, "worker": worker_name, "error": str(ex)}
-            _append_log(logs_list, "error", stage_idx, step_label, worker_name, filename, f"error: {ex}")
+            _save_output(pool.view(frame), filename, store, job_id, worker, meta.get("key"), output)
+        finally:
+            # encode xong -> trả block về free-list
+            pool.release(frame)
+            slots.release()
+
+    def report(fut, filename, worker):
+        # _save_output tự bắt lỗi encode/ghi; lỗi ngoài đó (map block shm...) không được mất trong future
+        ex = fut.exception()
+        if ex is not None:
+            store.set_state(job_id, filename, {"state": "error", "current_filter": "sink", "worker": worker, "error": str(ex)})
+            _append_log(store, job_id, "error", None, "sink", worker, filename, f"error: {ex}")
+
+    n_encoders = max(1, n_encoders)
+    slots = threading.BoundedSemaphore(2 * n_encoders)
+    ends = 0
+    k = 0
+    with ThreadPoolExecutor(max_workers=n_encoders, thread_name_prefix="encoder") as ex:
+        while True:
+            item = in_q.get()
+            if item is None:
+                # chờ đủ None từ mọi replica của stage cuối
+                ends += 1
+                if ends < n_upstream:
+                    continue
+                break
+            filename, frame, meta = item
+            slots.acquire()
+            k += 1
+            worker = f"{sink_name}-e{(k - 1) % n_encoders + 1}" if n_encoders > 1 else sink_name
+            fut = ex.submit(save, filename, frame, meta, worker)
+            fut.add_done_callback(lambda f, fn=filename, w=worker: report(f, fn, w))
+    # thoát khỏi with = mọi frame đã encode xong
+    _append_log(store, job_id, "info", None, "sink", sink_name, None, "sentinel received, exiting")
+    store.flush()
+
+def worker_pool(conn, store: JobStore, worker_name: str, n_workers: int = 1):
+    """Worker sống lâu của WarmPool: nhận từng ảnh (của bất kỳ job nào) qua ``conn``, chạy trọn chuỗi bước,
+    lưu output rồi báo xong qua chính ``conn``.
+
+    Filter được tạo + warmup ở lần đầu có bước cần tới rồi dùng lại cho mọi job (không job nào
+    dùng RemoveBackground thì worker không nạp model rembg); task gắn job_id nên
+    state/log/output vẫn đi đúng vào job tương ứng.
+    """
+    filters = {}
+    def get_filter(name: str):
+        filt = filters.get(name)
+        if filt is None:
+            filt = filters[name] = _make_filter(FILTERS[name]["cls"], n_workers)
+        return filt
 
-def worker_sink(in_q: Queue, job_id: str, state_map, outputs_list, logs_list, sink_name="sink"):
     while True:
-        item = in_q.get()
-        if item is None:
-            _append_log(logs_list, "info", None, "sink", sink_name, None, "sentinel received, exiting")
+        try:
+            task = conn.recv()
+        except EOFError:  # process cha đã đóng pipe
+            break
+        if task is None:
             break
-        filename, img = item
-        name, _ = os.path.splitext(os.path.basename(filename))
-        out_name = f"{name}__out.png"
-        out_path = os.path.join(OUTPUT_DIR, out_name)
-        _append_log(logs_list, "info", None, "sink", sink_name, filename, "received")
+        job_id, filename, steps, plan = task
         try:
-            save_png_to_disk(img, out_path)
-            outputs_list.append(out_name)
-            state_map[filename] = {"state": "done", "current_filter": None, "worker": "sink"}
-            _append_log(logs_list, "info", None, "sink", sink_name, filename, f"saved -> {out_name}")
+            img, served, meta = _load_or_serve(filename, plan, store, job_id)
+            if served:
+                continue
+            if img is None:
+                store.set_state(job_id, filename, {"state": "error", "current_filter": "load", "worker": "loader", "error": "cannot read"})
+                _append_log(store, job_id, "error", None, "loader", worker_name, filename, "cannot read")
+                continue
+            chain = [({
+                "idx": i,
+                "name": s["name"],
+                "params": s.get("params") or {},
+                "worker": f"{worker_name}-{s['name']}-{i+1}",
+            }, get_filter(s["name"])) for i, s in enumerate(steps)]
+            _log_start(store, job_id, worker_name, filename, meta)
+            if chain:
+                img = _run_cached(chain, img, filename, store, job_id, meta)
+            if img is not None:
+                _save_output(img, filename, store, job_id, worker_name, meta.get("key"), plan.get("output"))
         except Exception as ex:
-            state_map[filename] = {"state": "error", "current_filter": "sink", "worker": "sink", "error": str(ex)}
-            _append_log(logs_list, "error", None, "sink", sink_name, filename, f"error: {ex}")
+            # lỗi ngoài filter (load, cache, lưu...) vẫn phải hiện ở ảnh, không để kẹt "processing"
+            store.set_state(job_id, filename, {"state": "error", "current_filter": None, "worker": worker_name, "error": str(ex)})
+            _append_log(store, job_id, "error", None, "pool", worker_name, filename, f"error: {ex}")
+        finally:
+            # flush trước khi báo xong để collector đóng job thì state/log đã nằm trong DB
+            store.flush()
+            conn.send((job_id, filename))
+
+class WarmPool:
+    """Pool process dựng sẵn cùng app (lifespan), dùng chung cho mọi job nhỏ.
+
+    Tránh chi phí spawn process + import cv2/numpy/rembg cho từng job. Mỗi worker có một Pipe
+    riêng: process cha giữ hàng task, giao từng task cho worker rảnh nên biết worker nào đang
+    giữ ảnh nào; một thread collector nhận báo xong để đóng job.
+    Worker chết giữa chừng (OOM, onnxruntime crash...) thì collector thấy qua ``sentinel``: ảnh
+    đang làm bị đánh lỗi, job kết thúc với status error thay vì treo "running", và một worker
+    mới được dựng thay chỗ.
+    """
+
+    def __init__(self, n_workers: int, store: JobStore):
+        self.n_workers = max(1, n_workers)
+        self.store = store
+        self._workers: List[tuple] = []  # k -> (Process, Connection)
+        self._queue: deque = deque()  # task chưa giao
+        self._idle: List[int] = []
+        self._busy: Dict[int, tuple] = {}  # worker k -> task đang làm
+        self._pending: Dict[str, int] = {}
+        self._failed: Dict[str, str] = {}  # job_id -> lỗi worker chết, báo khi job xong
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = Pipe(duplex=False)
+        self._collector = None
+
+    def _spawn(self, k: int) -> tuple:
+        conn, child = Pipe()
+        p = Process(target=worker_pool, args=(child, self.store, f"pool{k+1}", self.n_workers), daemon=True)
+        p.start()
+        child.close()
+        return p, conn
+
+    def start(self):
+        workers = [self._spawn(k) for k in range(self.n_workers)]
+        with self._lock:
+            self._workers = workers
+            self._idle = list(range(self.n_workers))
+        self._collector = threading.Thread(target=self._collect, name="warm-pool-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, job_id: str, images: List[str], steps: List[Dict], output: Optional[Dict] = None):
+        store = self.store
+        plan = cache_plan(steps, output)
+        if not images:
+            self._finish(job_id)
+            return
+        with self._lock:
+            self._pending[job_id] = len(images)
+        for fn in images:
+            store.set_state(job_id, fn, {"state": "queued", "current_filter": None, "worker": None})
+            _append_log(store, job_id, "info", None, "loader", "loader", fn, "queued")
+        with self._lock:
+            self._queue.extend((job_id, fn, steps, plan) for fn in images)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Giao task cho worker rảnh (gọi khi đang giữ ``_lock``)."""
+        while self._queue and self._idle:
+            k = self._idle.pop()
+            task = self._queue.popleft()
+            try:
+                self._workers[k][1].send(task)
+            except OSError:
+                # worker vừa chết: trả task về hàng, collector sẽ thay worker này
+                self._queue.appendleft(task)
+                continue
+            self._busy[k] = task
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                workers = list(self._workers)
+            conns = {conn: k for k, (_p, conn) in enumerate(workers)}
+            sentinels = {p.sentinel: k for k, (p, _conn) in enumerate(workers)}
+            ready = mp_wait([self._wake_r, *conns, *sentinels])
+            if self._wake_r in ready:
+                break
+            dead = {sentinels[r] for r in ready if r in sentinels}
+            for r in ready:
+                if r not in conns:
+                    continue
+                try:
+                    while r.poll():
+                        self._done(conns[r], r.recv())
+                except (EOFError, OSError):
+                    dead.add(conns[r])
+            for k in dead:
+                self._replace(k, workers[k])
+
+    def _done(self, k: int, item: tuple):
+        job_id, _fn = item
+        with self._lock:
+            self._busy.pop(k, None)
+            self._idle.append(k)
+            self._dispatch()
+        self._count(job_id)
+
+    def _count(self, job_id: str):
+        with self._lock:
+            left = self._pending.get(job_id, 0) - 1
+            if left > 0:
+                self._pending[job_id] = left
+                return
+            self._pending.pop(job_id, None)
+            error = self._failed.pop(job_id, None)
+        self._finish(job_id, error)
+
+    def _replace(self, k: int, worker: tuple):
+        """Worker ``k`` đã chết (hoặc đóng pipe): đánh lỗi ảnh nó đang giữ, dựng worker mới thay chỗ."""
+        p, conn = worker
+        p.join(timeout=5)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+        conn.close()
+        new = self._spawn(k)
+        with self._lock:
+            self._workers[k] = new
+            task = self._busy.pop(k, None)
+            if k not in self._idle:
+                self._idle.append(k)
+            self._dispatch()
+        if task is None:
+            return
+        job_id, filename = task[0], task[1]
+        error = f"pool{k+1} died (exit code {p.exitcode})"
+        self.store.set_state(job_id, filename, {"state": "error", "current_filter": None, "worker": f"pool{k+1}", "error": error})
+        _append_log(self.store, job_id, "error", None, "pool", f"pool{k+1}", filename, f"error: {error}")
+        with self._lock:
+            self._failed[job_id] = error
+        self._count(job_id)
+
+    def stats(self) -> Dict:
+        """Số task chưa giao cho worker và số job chưa xong."""
+        with self._lock:
+            return {"queued_tasks": len(self._queue), "pending_jobs": len(self._pending)}
+
+    def _finish(self, job_id: str, error: Optional[str] = None):
+        try:
+            if error:
+                _append_log(self.store, job_id, "error", None, "job", "master", None, f"job error: {error}")
+                self.store.set_status(job_id, "error", error)
+                return
+            _append_log(self.store, job_id, "info", None, "job", "master", None, "job done")
+            self.store.set_status(job_id, "done")
+        except Exception:
+            pass
+
+    def stop(self):
+        # dừng collector trước để worker thoát không bị coi là chết rồi dựng lại
+        self._wake_w.send(None)
+        if self._collector is not None:
+            self._collector.join(timeout=5)
+        with self._lock:
+            workers = list(self._workers)
+        for _p, conn in workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for p, conn in workers:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+            conn.close()
+
+_POOL: Optional[WarmPool] = None
+
+def _load_into(q0: Queue, images: List[str], plan: Dict, pool: FramePool, store: JobStore, job_id: str, n_threads: int):
+    """Loader stage: decode song song bằng thread pool (cv2.imdecode nhả GIL), đẩy ảnh nào xong trước vào q0.
+
+    Chỉ giữ tối đa ``2 * n_threads`` ảnh đang decode/chờ; q0 có maxsize nên loader tự chậm lại
+    khi stage 1 chưa kịp xử lý -> bộ nhớ không phụ thuộc số ảnh của job.
+    Ảnh có sẵn trong result cache được trả thẳng, không đi vào pipeline.
+    """
+    def load(fn):
+        try:
+            img, served, meta = _load_or_serve(fn, plan, store, job_id)
+        except Exception:
+            img, served, meta = None, False, {}
+        return fn, (pool.put(img) if img is not None else None), served, meta
+
+    names = iter(images)
+    window = max(1, n_threads) * 2
+    with ThreadPoolExecutor(max_workers=max(1, n_threads), thread_name_prefix="loader") as ex:
+        pending = set()
+        for fn in names:
+            pending.add(ex.submit(load, fn))
+            if len(pending) >= window:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                fn, frame, served, meta = fut.result()
+                if served:
+                    pass  # _load_or_serve đã đánh dấu done từ result cache
+                elif frame is None:
+                    store.set_state(job_id, fn, {"state": "error", "current_filter": "load", "worker": "loader", "error": "cannot read"})
+                    _append_log(store, job_id, "error", None, "loader", "loader", fn, "cannot read")
+                else:
+                    store.set_state(job_id, fn, {"state": "queued", "current_filter": None, "worker": None})
+                    _append_log(store, job_id, "info", None, "loader", "loader", fn, "queued")
+                    _log_start(store, job_id, "loader", fn, meta)
+                    q0.put((fn, frame, meta))
+                nxt = next(names, None)
+                if nxt is not None:
+                    pending.add(ex.submit(load, nxt))
+
+def _sample_queues(store: JobStore, job_id: str, queues: List[tuple], stop: threading.Event, interval: float):
+    """Ghi độ sâu từng queue của job thành gauge (nhãn job + stage đọc queue đó) mỗi ``interval`` giây."""
+    while not stop.wait(interval):
+        for label, q in queues:
+            try:
+                depth = q.qsize()
+            except NotImplementedError:  # macOS không có sem_getvalue
+                return
+            store.set_gauge("queue_depth", {"job": job_id, "stage": label}, depth)
 
-def run_pipeline_job(job_id: str, images: List[str], steps: List[Dict], JOBS):
-    """Hàm chạy trong process con – dùng proxy JOBS truyền từ cha (không đụng vào globals)."""
+def run_pipeline_job(job_id: str, images: List[str], steps: List[Dict], store: JobStore, queue_maxsize: int = QUEUE_MAXSIZE,
+                     output: Optional[Dict] = None):
+    """Hàm chạy trong process con – dùng JobStore truyền từ cha (không đụng vào globals)."""
+    pool = None
+    stop_sampler = None
     try:
-        job = JOBS[job_id]
-        queues: List[Queue] = [Queue()]
+        queues: List[Queue] = [Queue(maxsize=queue_maxsize)]
         procs: List[Process] = []
+        pool = FramePool(capacity=FRAME_POOL_SLOTS, max_bytes=FRAME_POOL_MAX_BYTES)
 
-        state_map = job["images"]     # proxy manager.dict
-        outputs_list = job["outputs"] # proxy manager.list
-        logs_list = job.get("logs")   # proxy manager.list
-
-        # Dựng chuỗi filter
-        for i, s in enumerate(steps):
-            meta = FILTERS.get(s["name"])
-            if not meta:
+        for s in steps:
+            if s["name"] not in FILTERS:
                 raise RuntimeError(f"Unknown filter: {s['name']}")
+
+        # Dựng chuỗi stage (các bước light liền nhau chạy chung một process),
+        # mỗi stage N replica dùng chung input queue
+        stages = plan_stages(steps)
+        n_upstream = 1  # loader
+        counters = []  # giữ tham chiếu: Value bị GC ở process cha thì vùng nhớ chung bị cấp lại cho Value khác
+        for stage, n_rep in zip(stages, resolve_replicas(steps, stages)):
             in_q = queues[-1]
-            out_q = Queue()
+            out_q = Queue(maxsize=queue_maxsize)
             queues.append(out_q)
-            worker_name = f"worker-{s['name']}-{i+1}"
-            p = Process(
-                target=worker_filter,
-                args=(in_q, out_q, meta["cls"], s["name"], i, job_id, state_map, worker_name, s.get("params") or {}, logs_list)
-            )
-            p.start()
-            procs.append(p)
+            ends_seen = Value("i", 0)
+            counters.append(ends_seen)
+            for r in range(n_rep):
+                suffix = f"-r{r+1}" if n_rep > 1 else ""
+                stage_steps = [{
+                    "idx": i,
+                    "name": steps[i]["name"],
+                    "cls": FILTERS[steps[i]["name"]]["cls"],
+                    "params": steps[i].get("params") or {},
+                    "worker": f"worker-{steps[i]['name']}-{i+1}{suffix}",
+                } for i in stage]
+                p = Process(
+                    target=worker_filter,
+                    args=(in_q, out_q, stage_steps, job_id, store, pool, n_upstream, n_rep, ends_seen)
+                )
+                p.start()
+                procs.append(p)
+            n_upstream = n_rep
 
         # sink
         sink_in = queues[-1]
-        sink_p = Process(target=worker_sink, args=(sink_in, job_id, state_map, outputs_list, logs_list))
+        plan = cache_plan(steps, output)
+        sink_p = Process(target=worker_sink, args=(sink_in, job_id, store, pool, "sink", n_upstream, plan["output"], SINK_ENCODERS))
         sink_p.start()
         procs.append(sink_p)
 
-        # nạp input
+        # gauge độ sâu queue: queue i là input của stage i, queue cuối là của sink
+        labels = ["+".join(steps[i]["name"] for i in stage) for stage in stages] + ["sink"]
+        stop_sampler = threading.Event()
+        sampler = threading.Thread(
+            target=_sample_queues,
+            args=(store, job_id, list(zip(labels, queues)), stop_sampler, METRICS_SAMPLE_INTERVAL),
+            name="queue-sampler", daemon=True,
+        )
+        sampler.start()
+
+        # nạp input (stream: ảnh đầu tiên vào pipeline ngay khi decode xong)
         q0 = queues[0]
-        for fn in images:
-            path = os.path.join(INPUT_DIR, fn)
-            img = read_image_from_disk(path)
-            if img is None:
-                state_map[fn] = {"state": "error", "current_filter": "load", "worker": "loader", "error": "cannot read"}
-                _append_log(logs_list, "error", None, "loader", "loader", fn, "cannot read")
-                continue
-            state_map[fn] = {"state": "queued", "current_filter": None, "worker": None}
-            _append_log(logs_list, "info", None, "loader", "loader", fn, "queued")
-            q0.put((fn, img))
+        _load_into(q0, images, plan, pool, store, job_id, LOADER_THREADS)
 
         # kết thúc input
         q0.put(None)
-        _append_log(logs_list, "info", None, "loader", "loader", None, "input sentinel sent")
+        _append_log(store, job_id, "info", None, "loader", "loader", None, "input sentinel sent")
 
         # đợi tất cả worker xong
         for p in procs:
             p.join()
 
-        job["status"] = "done"
-        JOBS[job_id] = job
-        _append_log(logs_list, "info", None, "job", "master", None, "job done")
+        _append_log(store, job_id, "info", None, "job", "master", None, "job done")
+        store.set_status(job_id, "done")
     except Exception as ex:
-        job = JOBS.get(job_id, None)
-        if job is not None:
-            job["status"] = "error"
-            job["error"] = str(ex)
-            JOBS[job_id] = job
-            logs_list = job.get("logs")
-            if logs_list is not None:
-                _append_log(logs_list, "error", None, "job", "master", None, f"job error: {ex}")
+        _append_log(store, job_id, "error", None, "job", "master", None, f"job error: {ex}")
+        store.set_status(job_id, "error", str(ex))
+    finally:
+        if stop_sampler is not None:
+            stop_sampler.set()
+            store.clear_gauges(job_id)
+        if pool is not None:
+            pool.close()
 
 # =========================
 # Endpoints
@@ -374,91 +1227,187 @@ def root():
 def list_filters():
     return [{"name": name, "params": meta.get("params", {})} for name, meta in FILTERS.items()]
 
+def _list_dir(kind: str, limit: Optional[int], offset: int, prefix: str, sort: str, order: str, refresh: bool):
+    if sort not in SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {list(SORT_COLUMNS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if limit is not None and not 0 <= limit <= LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 0 and {LIST_MAX_LIMIT}")
+    index = get_dir_index(kind)
+    index.refresh(force=refresh)
+    items, total = index.list(limit, max(0, offset), prefix, sort, order == "desc")
+    for it in items:
+        it["url"] = f"/api/file/{kind}/{it['name']}"
+    end = max(0, offset) + len(items)
+    return items, {"total": total, "offset": max(0, offset), "next_offset": end if end < total else None}
+
 @app.get("/api/images")
-def list_input_images():
-    files = []
-    for f in sorted(os.listdir(INPUT_DIR)):
-        if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".webp")):
-            files.append({"name": f, "url": f"/api/file/input/{f}"})
-    return {"images": files}
+def list_input_images(limit: Optional[int] = None, offset: int = 0, prefix: str = "",
+                      sort: str = "name", order: str = "asc", refresh: bool = False):
+    """Ảnh input từ chỉ mục (không listdir mỗi request). Không có ``limit`` thì trả hết;
+    ``next_offset`` None là đã tới trang cuối; ``refresh=true`` quét lại thư mục ngay."""
+    items, page = _list_dir("input", limit, offset, prefix, sort, order, refresh)
+    return {"images": items, **page}
 
 @app.get("/api/outputs")
-def list_outputs():
-    files = []
-    for f in sorted(os.listdir(OUTPUT_DIR)):
-        if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".webp")):
-            files.append({"name": f, "url": f"/api/file/output/{f}"})
-    return {"outputs": files}
-
-@app.post("/api/upload")
-async def upload_images(files: List[UploadFile] = File(...)):
-    saved = []
-    for uf in files:
-        name = uf.filename
-        if not name:
-            continue
-        data = await uf.read()
-        path = os.path.join(INPUT_DIR, name)
-        with open(path, "wb") as f:
-            f.write(data)
-        saved.append(name)
-    return {"saved": saved}
+def list_outputs(limit: Optional[int] = None, offset: int = 0, prefix: str = "",
+                 sort: str = "name", order: str = "asc", refresh: bool = False):
+    items, page = _list_dir("output", limit, offset, prefix, sort, order, refresh)
+    return {"outputs": items, **page}
 
-@app.post("/api/process")
-async def start_process(payload: ProcessRequest):
-    # validate
-    for s in payload.steps:
+_UPLOAD_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["files"],
+    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+}}}}}
+
+@app.post("/api/upload", openapi_extra=_UPLOAD_SCHEMA)
+async def upload_images(request: Request):
+    """Upload nhiều ảnh (multipart, field ``files``): stream thẳng xuống đĩa, hash trong lúc ghi.
+
+    ``files``: mỗi file đã lưu kèm size + hash (blake2b, cùng hash với cache); ``rejected``: file bị từ chối.
+    """
+    try:
+        results = await receive_upload(
+            request.stream(), request.headers.get("content-type", ""), INPUT_DIR,
+            memory_cap=UPLOAD_MEMORY_MB << 20, max_file_bytes=UPLOAD_MAX_FILE_MB << 20, workers=UPLOAD_WORKERS,
+        )
+    except UploadError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    saved = [r for r in results if "error" not in r]
+    index = get_dir_index("input")
+    for r in saved:
+        index.record(r["name"], r["hash"])
+    return {
+        "saved": [r["name"] for r in saved],
+        "files": saved,
+        "rejected": [r for r in results if "error" in r],
+    }
+
+def _validate_steps(steps: List[StepConfig]):
+    for s in steps:
         if s.name not in FILTERS:
             raise HTTPException(status_code=400, detail=f"Unknown filter: {s.name}")
+        if s.replicas != "auto" and s.replicas < 1:
+            raise HTTPException(status_code=400, detail=f"Invalid replicas for {s.name}: {s.replicas}")
+
+@app.post("/api/process")
+async def start_process(payload: ProcessRequest):
+    _validate_steps(payload.steps)
+    if payload.queue_maxsize is not None and payload.queue_maxsize < 1:
+        raise HTTPException(status_code=400, detail="queue_maxsize must be >= 1")
+
+    steps = [s.dict() for s in payload.steps]
+    changes = []
+    if payload.optimize:
+        steps, changes = optimize_steps(steps, FILTERS)
+    output = payload.output.dict() if payload.output is not None else None
 
     # tạo store lazily
-    mgr, JOBS = get_store()
+    store = get_store()
 
-    # khởi tạo job (proxy)
     job_id = uuid4().hex[:8]
-    JOBS[job_id] = {
-        "status": "running",
-        "images": mgr.dict(),
-        "outputs": mgr.list(),
-        "logs": mgr.list(),               # <-- thêm logs list
-        "error": None,
-        "steps": [s.dict() for s in payload.steps],
-        "inputs": payload.images,
-    }
+    store.create_job(job_id, steps, payload.images)
+    for c in changes:
+        _append_log(store, job_id, "info", None, "plan", "planner", None, c)
+
+    if _POOL is not None and len(payload.images) <= POOL_MAX_IMAGES:
+        # job nhỏ: chạy trên WarmPool, không spawn process mới
+        _POOL.submit(job_id, payload.images, steps, output)
+    else:
+        # chạy pipeline (truyền JobStore vào)
+        maxsize = payload.queue_maxsize or QUEUE_MAXSIZE
+        p = Process(target=run_pipeline_job, args=(job_id, payload.images, steps, store, maxsize, output))
+        p.start()
 
-    # chạy pipeline (truyền JOBS proxy vào)
-    p = Process(target=run_pipeline_job, args=(job_id, payload.images, [s.dict() for s in payload.steps], JOBS))
-    p.start()
+    return {"job_id": job_id, "status": "running", "plan_changes": changes}
 
-    return {"job_id": job_id, "status": "running"}
+@app.post("/api/plan")
+def dry_run_plan(payload: PlanRequest):
+    """Xem trước plan sẽ chạy (không tạo job): chuỗi bước sau tối ưu, thay đổi, stage và số replica."""
+    _validate_steps(payload.steps)
+    steps = [s.dict() for s in payload.steps]
+    changes = []
+    if payload.optimize:
+        steps, changes = optimize_steps(steps, FILTERS)
+    stages = plan_stages(steps)
+    return {
+        "steps": steps,
+        "changes": changes,
+        "stages": [{"steps": [steps[i]["name"] for i in stage], "replicas": n}
+                   for stage, n in zip(stages, resolve_replicas(steps, stages))],
+    }
 
 @app.get("/api/jobs/{job_id}/status")
-def job_status(job_id: str):
-    _, JOBS = get_store()
-    job = JOBS.get(job_id)
+def job_status(job_id: str, since: Optional[int] = None):
+    """Trạng thái job. Có ``since`` (cursor lần trước) thì chỉ trả log mới và ảnh đổi state."""
+    store = get_store()
+    job = store.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    images_state = dict(job["images"])
+    if since is not None:
+        delta = store.changes(job_id, since)
+        images, logs, cursor = delta["images"], delta["logs"], delta["cursor"]
+    else:
+        cursor = store.cursor(job_id)
+        images, logs = store.image_states(job_id), store.logs(job_id)
     return {
         "job_id": job_id,
         "status": job["status"],
-        "images": images_state,
+        "images": images,
         "steps": job.get("steps", []),
         "error": job.get("error"),
-        "logs": list(job.get("logs", [])),   # <-- trả về logs
+        "logs": logs,
+        "cursor": cursor,
     }
 
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, since: int = 0):
+    """Server-Sent Events: đẩy log/state mới ngay khi worker flush, kết thúc bằng event ``end``."""
+    store = get_store()
+    if not await run_in_threadpool(store.get_job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_id = request.headers.get("last-event-id")
+    cursor = int(last_id) if last_id and last_id.isdigit() else since
+
+    def _sse(event: str, data: Dict, event_id: Optional[int] = None) -> str:
+        head = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream():
+        nonlocal cursor
+        idle = 0.0
+        while not await request.is_disconnected():
+            # đọc status trước: nếu job đã xong thì lần đọc changes sau đó chắc chắn đủ
+            job = await run_in_threadpool(store.get_job, job_id)
+            delta = await run_in_threadpool(store.changes, job_id, cursor)
+            if delta["logs"] or delta["images"]:
+                cursor = delta["cursor"]
+                idle = 0.0
+                yield _sse("update", delta, cursor)
+            if job["status"] != "running":
+                yield _sse("end", {"status": job["status"], "error": job.get("error"), "cursor": cursor}, cursor)
+                break
+            if idle >= SSE_HEARTBEAT:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
 @app.get("/api/jobs/{job_id}/outputs")
 def job_outputs(job_id: str):
-    _, JOBS = get_store()
-    job = JOBS.get(job_id)
-    if not job:
+    store = get_store()
+    if not store.get_job(job_id):
         raise HTTPException(status_code=404, detail="Job not found")
-    outputs = list(job["outputs"])
+    outputs = store.outputs(job_id)
     return {"job_id": job_id, "outputs": [{"name": n, "url": f"/api/file/output/{n}"} for n in outputs]}
 
 @app.get("/api/file/{kind}/{filename}")
-def get_file(kind: str, filename: str):
+def get_file(kind: str, filename: str, request: Request, w: Optional[int] = None):
+    """File gốc (ETag/304, Range) hoặc thumbnail rộng ``w`` px (có cache, vẫn 304 theo file gốc)."""
     if "/" in filename or "\\" in filename:
         raise HTTPException(status_code=400, detail="Invalid filename")
     if kind == "input":
@@ -467,9 +1416,34 @@ def get_file(kind: str, filename: str):
         path = os.path.join(OUTPUT_DIR, filename)
     else:
         raise HTTPException(status_code=400, detail="Invalid kind")
-    if not os.path.exists(path):
+    if not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path, headers={"Cache-Control": "no-store, max-age=0"})
+    if w is None:
+        return files.serve(request, path)
+    if not THUMB_MIN_WIDTH <= w <= THUMB_MAX_WIDTH:
+        raise HTTPException(status_code=400, detail=f"w must be between {THUMB_MIN_WIDTH} and {THUMB_MAX_WIDTH}")
+    return files.serve_thumbnail(request, path, w, get_thumb_cache())
+
+@app.get("/api/metrics")
+def metrics():
+    """Metrics theo stage (Prometheus text format): items/lỗi, thời gian bận, histogram latency + p50/p95/p99, độ sâu queue."""
+    reg, gauges = get_store().metrics()
+    if _POOL is not None:
+        pool = _POOL.stats()
+        gauges.append(("queue_depth", {"job": "warm_pool", "stage": "tasks"}, pool["queued_tasks"]))
+        gauges.append(("warm_pool_pending_jobs", {}, pool["pending_jobs"]))
+    return Response(render_prometheus(reg, gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    cache = get_result_cache()
+    stages = get_stage_cache()
+    thumbs = get_thumb_cache()
+    return {
+        "results": cache.stats() if cache is not None else None,
+        "stages": stages.stats() if stages is not None else None,
+        "thumbs": thumbs.stats() if thumbs is not None else None,
+    }
 
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
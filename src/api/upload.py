@@ -0,0 +1,278 @@
+"""Nhận upload multipart dạng stream, không đọc cả file vào RAM và không chặn event loop.
+
+- Event loop chỉ đọc chunk từ socket và parse multipart (rẻ); hash + ghi đĩa chạy trên thread
+  pool, mỗi file một luồng ghi tuần tự, các file trong cùng request ghi chồng lên nhau.
+- Số byte đã nhận mà chưa ghi xuống đĩa của một request không vượt ``memory_cap``; vượt thì
+  ngừng đọc socket tới khi writer ghi bớt (backpressure về phía client).
+- Magic bytes được kiểm tra ngay khi có đủ header: không phải ảnh thì bỏ file, không ghi gì.
+- Hash blake2b-160 (giống ``digest_bytes`` của cache) tính trong lúc ghi.
+- Ghi ra ``<tên>.<uuid>.part`` rồi ``os.replace`` khi nhận đủ -> không có file input dở dang.
+"""
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    try:
+        import python_multipart as multipart
+        from python_multipart.multipart import parse_options_header
+    except ModuleNotFoundError:
+        import multipart
+        from multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    multipart = None
+    parse_options_header = None
+
+HEAD_BYTES = 12  # đủ cho magic bytes của mọi định dạng trong sniff()
+
+
+class UploadError(ValueError):
+    pass
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """Loại ảnh theo magic bytes, None nếu không nhận ra."""
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:2] == b"BM":
+        return "bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    return None
+
+
+class _Budget:
+    """Đếm số byte đang nằm trong buffer chờ ghi của một request."""
+    def __init__(self, cap: int):
+        self.cap = max(1, cap)
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self, n: int) -> bool:
+        with self._cond:
+            # chunk to hơn cả cap vẫn cho qua khi buffer rỗng, để không kẹt
+            if self.used + n <= self.cap or self.used == 0:
+                self.used += n
+                return True
+            return False
+
+    def acquire(self, n: int):
+        with self._cond:
+            while not (self.used + n <= self.cap or self.used == 0):
+                self._cond.wait()
+            self.used += n
+
+    def release(self, n: int):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+
+class _FileWriter:
+    """Luồng ghi của một file: lấy chunk từ queue, kiểm tra header, hash và ghi tuần tự."""
+    def __init__(self, dest_dir: str, filename: str, budget: _Budget, max_bytes: int = 0):
+        self.name = filename
+        self.path = os.path.join(dest_dir, filename)
+        self.tmp = f"{self.path}.{uuid4().hex[:8]}.part"
+        self.budget = budget
+        self.max_bytes = max_bytes
+        self.q: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self.hash = hashlib.blake2b(digest_size=20)
+        self.head = b""
+        self.kind = None
+        self.size = 0
+        self.error = None
+        self.ended = False  # đã đưa sentinel vào queue
+        self._f = None
+
+    def run(self) -> Dict:
+        while True:
+            data = self.q.get()
+            if data is None:
+                return self._finish()
+            try:
+                self._write(data)
+            except OSError as ex:
+                self._fail(str(ex))
+            finally:
+                self.budget.release(len(data))
+
+    def _write(self, data: bytes):
+        if self.error:
+            return
+        if self._f is None:
+            self.head += data
+            if len(self.head) >= HEAD_BYTES:
+                self._open()
+            return
+        self._put(data)
+
+    def _open(self):
+        self.kind = sniff(self.head)
+        if self.kind is None:
+            self._fail("not an image")
+            return
+        self._f = open(self.tmp, "wb")
+        data, self.head = self.head, b""
+        self._put(data)
+
+    def _put(self, data: bytes):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self._fail(f"file larger than {self.max_bytes} bytes")
+            return
+        self.hash.update(data)
+        self._f.write(data)
+
+    def _fail(self, error: str):
+        self.error = error
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def _finish(self) -> Dict:
+        try:
+            if not self.error and self._f is None:
+                # file nhỏ hơn HEAD_BYTES
+                if self.head:
+                    self._open()
+                else:
+                    self._fail("empty file")
+            if not self.error:
+                self._f.close()
+                self._f = None
+                os.replace(self.tmp, self.path)
+        except OSError as ex:
+            self._fail(str(ex))
+        if self.error:
+            # abort() chỉ đặt error từ event loop; dọn file tạm ở đây (cùng thread với lúc ghi)
+            self._fail(self.error)
+            return {"name": self.name, "error": self.error}
+        return {"name": self.name, "size": self.size, "hash": self.hash.hexdigest(), "type": self.kind}
+
+    def abort(self, error: str):
+        self.error = self.error or error
+        self.ended = True
+        self.q.put(None)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="upload")
+        return _executor
+
+
+def _safe_name(filename: str) -> Optional[str]:
+    # chỉ lấy tên file (chặn "../"), bỏ tên rỗng / ẩn
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name if name and not name.startswith(".") else None
+
+
+async def receive_upload(stream, content_type: str, dest_dir: str, memory_cap: int,
+                         max_file_bytes: int = 0, workers: int = 4) -> List[Dict]:
+    """Đọc body multipart từ ``stream`` (async iterator bytes), lưu các part có filename vào ``dest_dir``.
+
+    Trả về list kết quả theo thứ tự file: ``{"name", "size", "hash", "type"}`` hoặc ``{"name", "error"}``.
+    """
+    if multipart is None:
+        raise UploadError("python-multipart is required for uploads")
+    ctype, params = parse_options_header(content_type or "")
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise UploadError("Expected multipart/form-data with a boundary")
+
+    budget = _Budget(memory_cap)
+    executor = _get_executor(workers)
+    writers: List[_FileWriter] = []
+    futures = []
+    rejected: List[Dict] = []
+    pending: List[tuple] = []
+    part = {"field": b"", "value": b"", "disposition": b"", "writer": None}
+
+    def on_part_begin():
+        part.update(field=b"", value=b"", disposition=b"", writer=None)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        if part["field"].lower() == b"content-disposition":
+            part["disposition"] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, opts = parse_options_header(part["disposition"])
+        if b"filename" not in opts:
+            return  # field thường: bỏ qua
+        raw = opts[b"filename"].decode("utf-8", "replace")
+        name = _safe_name(raw)
+        if name is None:
+            rejected.append({"name": raw, "error": "invalid filename"})
+            return
+        w = _FileWriter(dest_dir, name, budget, max_file_bytes)
+        writers.append(w)
+        futures.append(executor.submit(w.run))
+        part["writer"] = w
+
+    def on_part_data(data, start, end):
+        if part["writer"] is not None:
+            pending.append((part["writer"], bytes(data[start:end])))
+
+    def on_part_end():
+        if part["writer"] is not None:
+            pending.append((part["writer"], None))
+
+    parser = multipart.MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            for w, data in pending:
+                if data is None:
+                    w.ended = True
+                elif not budget.try_acquire(len(data)):
+                    # buffer đầy: chờ writer ghi bớt (chờ trong threadpool, event loop vẫn rảnh)
+                    await run_in_threadpool(budget.acquire, len(data))
+                w.q.put(data)
+            pending.clear()
+        parser.finalize()
+    except Exception as ex:
+        for w in writers:
+            if not w.ended:
+                w.abort("upload interrupted")
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        raise UploadError(f"Invalid multipart body: {ex}") from ex
+    for w in writers:
+        if not w.ended:
+            w.abort("incomplete part")
+    results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+    return list(results) + rejected
@@ -0,0 +1,171 @@
+"""Benchmark tái lập được: monolith vs ParallelPipeline (thread) vs runner của API (process).
+
+    cd src
+    python -m benchmark --count 32 --size 1280x960 --workers 1,2,4 --queue-sizes 4,8 --stub-rembg
+
+Mỗi cấu hình chạy trong một process con riêng (fork) để peak RSS và trạng thái import không lẫn nhau.
+Kết quả ghi ra ``<out>/report-<thời gian>.json`` và ``.csv``: throughput, latency từng ảnh
+(mean/p50/p95/p99/max) và peak RSS.
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import time
+
+from benchmark.corpus import make_corpus
+from benchmark import runners
+
+DEFAULT_OUT = os.path.join(runners.ROOT_DIR, "data", "bench")
+RUNNERS = ("monolith", "pipeline", "api")
+
+def _size(text):
+    w, _, h = text.lower().partition("x")
+    return int(w), int(h or w)
+
+def _ints(text):
+    return [int(x) for x in text.split(",") if x]
+
+def _percentile(vals, q):
+    if not vals:
+        return 0.0
+    k = min(len(vals) - 1, max(0, int(round(q * (len(vals) - 1)))))
+    return vals[k]
+
+def _rss_mb(who):
+    # Linux: ru_maxrss tính bằng KB (macOS: byte)
+    v = resource.getrusage(who).ru_maxrss
+    return v / (1 << 20) if sys.platform == "darwin" else v / 1024
+
+def _run_one(config, files, base):
+    kind = config["runner"]
+    work = runners.work_dir(base)
+    try:
+        if kind == "monolith":
+            res = runners.run_monolith(files, work, config["resize"])
+        elif kind == "pipeline":
+            res = runners.run_pipeline(files, work, config["resize"], config["workers"], config["queue_size"])
+        else:
+            res = runners.run_api(files, work, config["resize"], config["workers"], config["queue_size"])
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    lat = sorted(res.pop("latencies"))
+    res.update({
+        "throughput": res["ok"] / res["duration"] if res["duration"] else 0.0,
+        "latency_mean": statistics.fmean(lat) if lat else 0.0,
+        "latency_p50": _percentile(lat, 0.50),
+        "latency_p95": _percentile(lat, 0.95),
+        "latency_p99": _percentile(lat, 0.99),
+        "latency_max": lat[-1] if lat else 0.0,
+        "peak_rss_mb": _rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_children_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+    })
+    return res
+
+def _child(conn, config, files, base):
+    try:
+        conn.send(("ok", _run_one(config, files, base)))
+    except Exception as ex:
+        conn.send(("error", f"{type(ex).__name__}: {ex}"))
+    finally:
+        conn.close()
+
+def run_isolated(config, files, base):
+    if "fork" not in mp.get_all_start_methods():
+        return _run_one(config, files, base)
+    ctx = mp.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_child, args=(child, config, files, base))
+    p.start()
+    child.close()
+    status, payload = parent.recv() if parent.poll(None) else ("error", "no result")
+    p.join()
+    if status != "ok":
+        raise RuntimeError(payload)
+    return payload
+
+def build_configs(args):
+    configs = []
+    for rep in range(args.repeat):
+        if "monolith" in args.runners:
+            configs.append({"runner": "monolith", "workers": 1, "queue_size": None, "repeat": rep})
+        for kind in ("pipeline", "api"):
+            if kind in args.runners:
+                for w in args.workers:
+                    for q in args.queue_sizes:
+                        configs.append({"runner": kind, "workers": w, "queue_size": q, "repeat": rep})
+    for c in configs:
+        c["resize"] = list(args.resize)
+    return configs
+
+CSV_FIELDS = ["runner", "workers", "queue_size", "repeat", "files", "ok", "duration", "throughput",
+              "latency_mean", "latency_p50", "latency_p95", "latency_p99", "latency_max",
+              "peak_rss_mb", "peak_rss_children_mb", "error"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark monolith / pipeline / API runner")
+    parser.add_argument("--count", type=int, default=16, help="số ảnh tổng hợp")
+    parser.add_argument("--size", type=_size, default=(1280, 960), help="kích thước ảnh nguồn, vd 1920x1080")
+    parser.add_argument("--resize", type=_size, default=(500, 500), help="kích thước sau bước Resize")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runners", type=lambda s: [r for r in s.split(",") if r], default=list(RUNNERS))
+    parser.add_argument("--workers", type=_ints, default=[1, 2, 4],
+                        help="pipeline: số thread mỗi stage; api: số replica của bước nặng")
+    parser.add_argument("--queue-sizes", type=_ints, default=[8])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--stub-rembg", action="store_true", help="thay rembg bằng mask ngưỡng (không cần model)")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--corpus-dir", default=None)
+    args = parser.parse_args(argv)
+    unknown = set(args.runners) - set(RUNNERS)
+    if unknown:
+        parser.error(f"unknown runner(s): {', '.join(sorted(unknown))}")
+
+    if args.stub_rembg:
+        from benchmark import stub_rembg
+        stub_rembg.install()
+
+    os.makedirs(args.out, exist_ok=True)
+    w, h = args.size
+    corpus_dir = args.corpus_dir or os.path.join(args.out, f"corpus_{args.count}_{w}x{h}_{args.seed}")
+    files = make_corpus(corpus_dir, args.count, w, h, args.seed)
+
+    results = []
+    for config in build_configs(args):
+        label = f"{config['runner']} workers={config['workers']} queue={config['queue_size']}"
+        try:
+            res = run_isolated(config, files, args.out)
+            print(f"[Bench] {label:<36} {res['throughput']:7.2f} img/s  p50={res['latency_p50']*1000:8.1f} ms  "
+                  f"p95={res['latency_p95']*1000:8.1f} ms  rss={res['peak_rss_mb']:.0f}+{res['peak_rss_children_mb']:.0f} MB")
+        except Exception as ex:
+            res = {"error": str(ex)}
+            print(f"[Bench] {label:<36} FAILED: {ex}")
+        results.append({**config, **res})
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    report = {
+        "created": stamp,
+        "corpus": {"dir": corpus_dir, "count": args.count, "width": w, "height": h, "seed": args.seed},
+        "stub_rembg": args.stub_rembg,
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    json_path = os.path.join(args.out, f"report-{stamp}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    csv_path = os.path.join(args.out, f"report-{stamp}.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"[Bench] Report: {json_path}")
+    print(f"[Bench] CSV:    {csv_path}")
+
+if __name__ == "__main__":
+    main()
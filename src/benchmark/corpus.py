@@ -0,0 +1,40 @@
+"""Sinh bộ ảnh tổng hợp (tái lập được theo seed) cho benchmark."""
+import json
+import os
+
+import cv2
+import numpy as np
+
+def _synthetic(rng, w, h):
+    # nền gradient + vài hình khối + nhiễu: đủ chi tiết để encode/resize không quá rẻ
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    c0, c1 = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    t = ((xx / max(1, w - 1) + yy / max(1, h - 1)) / 2)[:, :, None]
+    img = (c0 * (1 - t) + c1 * t).astype(np.uint8)
+    for _ in range(int(rng.integers(4, 10))):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        axes = (int(rng.integers(w // 16 + 1, w // 3 + 2)), int(rng.integers(h // 16 + 1, h // 3 + 2)))
+        cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1, cv2.LINE_AA)
+    noise = rng.normal(0, 6, img.shape).astype(np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def make_corpus(root, count, width, height, seed=0, quality=90):
+    """Tạo (hoặc dùng lại) ``count`` ảnh JPEG ``width``x``height`` trong ``root``; trả về list đường dẫn."""
+    os.makedirs(root, exist_ok=True)
+    spec = {"count": count, "width": width, "height": height, "seed": seed, "quality": quality}
+    meta_path = os.path.join(root, "corpus.json")
+    names = [f"img_{i:04d}.jpg" for i in range(count)]
+    paths = [os.path.join(root, n) for n in names]
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == spec and all(os.path.exists(p) for p in paths):
+                return paths
+    except (OSError, ValueError):
+        pass
+    rng = np.random.default_rng(seed)
+    for p in paths:
+        cv2.imwrite(p, _synthetic(rng, width, height), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    with open(meta_path, "w") as f:
+        json.dump(spec, f)
+    return paths
@@ -0,0 +1,143 @@
+"""Ba cách chạy cùng một chuỗi bước trên cùng bộ ảnh, trả về số đo có cùng dạng.
+
+Chuỗi bước: Resize -> RemoveBackground (nền checker) -> HorizontalFlip -> Watermark "Team 11" -> ghi file.
+Mỗi runner trả về {"files", "ok", "duration", "latencies": [giây/ảnh], ...}.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(SRC_DIR)
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+    # runner in log theo từng ảnh ra stdout; tắt đi để không đo cả I/O terminal
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def _fresh_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+def _link_all(files, dst):
+    # hardlink nếu được (không tốn I/O), khác filesystem thì copy
+    for p in files:
+        target = os.path.join(dst, os.path.basename(p))
+        try:
+            os.link(p, target)
+        except OSError:
+            shutil.copy(p, target)
+
+def run_monolith(files, work_dir, size=(500, 500), quiet=True):
+    from monolith import process_file_monolith
+
+    out_dir = _fresh_dir(os.path.join(work_dir, "out"))
+    latencies, ok = [], 0
+    start = time.perf_counter()
+    with _quiet(quiet):
+        for path in files:
+            t0 = time.perf_counter()
+            ok += bool(process_file_monolith(path, out_dir, size[0], size[1]))
+            latencies.append(time.perf_counter() - t0)
+    return {"files": len(files), "ok": ok, "duration": time.perf_counter() - start, "latencies": latencies}
+
+def run_pipeline(files, work_dir, size=(500, 500), n_workers=2, queue_size=8, quiet=True):
+    """ParallelPipeline trên bản sao thư mục input; latency = từ lúc ConvertFilter nhận ảnh tới lúc ghi xong."""
+    from pipeline import ParallelPipeline
+    from utils import thread_log
+
+    in_dir = _fresh_dir(os.path.join(work_dir, "in"))
+    _link_all(files, in_dir)
+    out_dir = _fresh_dir(os.path.join(work_dir, "out"))
+    db = os.path.join(work_dir, f"dedup-{uuid4().hex[:6]}.db")
+
+    thread_log.set_level("quiet" if quiet else "info")
+    pipe = ParallelPipeline(n_workers=n_workers, resize_shape=size, input_dir=in_dir, output_dir=out_dir,
+                            queue_size=queue_size, dedup_db=db)
+    began, finished = {}, {}
+    convert, output = pipe.stages[0][0], pipe.stages[-1][0]
+
+    def timed_convert(path, _orig=convert.process_single):
+        began[os.path.basename(path)] = time.perf_counter()
+        return _orig(path)
+
+    def timed_output(envelope, _orig=output.process_single):
+        res = _orig(envelope)
+        finished[envelope.get("filename")] = time.perf_counter()
+        return res
+
+    convert.process_single = timed_convert
+    output.process_single = timed_output
+    with _quiet(quiet):
+        summary = pipe.start()
+    latencies = [finished[k] - began[k] for k in finished if k in began]
+    return {"files": len(files), "ok": len(finished), "duration": summary["duration"],
+            "latencies": latencies, "stages": summary["stages"]}
+
+def api_steps(size=(500, 500), rembg=True):
+    steps = [{"name": "Resize", "params": {"width": size[0], "height": size[1]}}]
+    if rembg:
+        steps.append({"name": "RemoveBackground", "params": {"background": "checker"}})
+    steps += [{"name": "HorizontalFlip", "params": {}},
+              {"name": "Watermark", "params": {"text": "Team 11", "pos": "top-left", "opacity": 1.0}}]
+    return steps
+
+def run_api(files, work_dir, size=(500, 500), replicas=1, queue_size=8, quiet=True):
+    """``run_pipeline_job`` của API (multiprocess) chạy trực tiếp, không qua HTTP và không dùng cache kết quả.
+
+    Latency mỗi ảnh = từ lúc loader đưa ảnh vào queue ("queued") tới lúc sink ghi xong ("done").
+    """
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    from src.api import main as api
+    from src.api.job_store import JobStore
+
+    in_dir = _fresh_dir(os.path.join(work_dir, "in"))
+    _link_all(files, in_dir)
+    api.INPUT_DIR = in_dir
+    api.OUTPUT_DIR = _fresh_dir(os.path.join(work_dir, "out"))
+    # đo công việc thật, không đo cache hit
+    api.RESULT_CACHE_MAX_MB = 0
+    api.STAGE_CACHE_MAX_MB = 0
+
+    steps = api_steps(size, rembg="RemoveBackground" in api.FILTERS)
+    for s in steps:
+        if api.FILTERS[s["name"]].get("cost") == "heavy":
+            s["replicas"] = replicas
+    names = [os.path.basename(p) for p in files]
+    db = os.path.join(work_dir, f"jobs-{uuid4().hex[:6]}.db")
+    store = JobStore(db)
+    job_id = uuid4().hex[:8]
+    store.create_job(job_id, steps, names)
+    start = time.perf_counter()
+    with _quiet(quiet):
+        api.run_pipeline_job(job_id, names, steps, store, queue_size)
+    duration = time.perf_counter() - start
+    store.flush()
+
+    queued, done = {}, {}
+    with sqlite3.connect(db) as conn:
+        for fn, ts, data in conn.execute("SELECT file, ts, data FROM events WHERE job_id=? AND kind='state'", (job_id,)):
+            state = (json.loads(data) or {}).get("state")
+            if state == "queued":
+                queued.setdefault(fn, ts)
+            elif state == "done":
+                done[fn] = ts
+    latencies = [done[k] - queued[k] for k in done if k in queued]
+    return {"files": len(files), "ok": len(done), "duration": duration, "latencies": latencies,
+            "steps": [s["name"] for s in steps]}
+
+def work_dir(base=None):
+    return tempfile.mkdtemp(prefix="bench-", dir=base)
@@ -0,0 +1,30 @@
+"""Thay rembg bằng một bản giả rẻ để benchmark chạy không cần tải model.
+
+Mask lấy từ ngưỡng độ sáng (có chi phí tỉ lệ với số pixel như một bước xử lý thật,
+nhưng không phải inference); kết quả vẫn là RGBA như ``rembg.remove``.
+"""
+import sys
+import types
+
+import cv2
+import numpy as np
+
+def _remove(img, session=None, **kwargs):
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.GaussianBlur(mask, (5, 5), 0)
+    rgba = np.dstack([img, mask])
+    rgba[:, :, :3] = (img * (mask[:, :, None] / 255.0)).astype(np.uint8)
+    return rgba
+
+def _new_session(model_name="u2net", *args, **kwargs):
+    return types.SimpleNamespace(model_name=model_name)
+
+def install():
+    """Đăng ký module ``rembg`` giả; gọi trước khi import pipeline/monolith/api."""
+    mod = types.ModuleType("rembg")
+    mod.remove = _remove
+    mod.new_session = _new_session
+    mod.__benchmark_stub__ = True
+    sys.modules["rembg"] = mod
+    return mod
@@ -4,8 +4,8 @@ import os
 import time
 import cv2
 import hashlib
-import numpy as np
 from rembg import remove # Giả định thư viện này đã được cài đặt
+from utils.compositing import composite
 
 # --- HÀM HỖ TRỢ TỪ CÁC FILE UTILS ---
 
@@ -18,15 +18,6 @@ def make_id_for_path(path: str) -> str:
         s = f"{path}|{os.path.basename(path)}"
     return hashlib.sha1(s.encode()).hexdigest()
 
-def _create_checkerboard(w, h, checker_size=20):
-    # Logic tạo background từ RemoveBackground
-    img = np.zeros((h, w, 3), np.uint8)
-    for y in range(0, h, checker_size):
-        for x in range(0, w, checker_size):
-            color = (255,255,255) if (x//checker_size+y//checker_size)%2==0 else (200,200,200)
-            cv2.rectangle(img, (x,y), (x+checker_size, y+checker_size), color, -1)
-    return img
-
 # --- HÀM XỬ LÝ MONOLITH CHÍNH ---
 
 def process_file_monolith(input_path, output_dir, resize_w=500, resize_h=500):
@@ -49,7 +40,6 @@ def process_file_monolith(input_path, output_dir, resize_w=500, resize_h=500):
     img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
 
     # 3. REMOVE BACKGROUND
-    h, w = img.shape[:2]
     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     try:
         rgba = remove(img_rgb)
@@ -58,11 +48,8 @@ def process_file_monolith(input_path, output_dir, resize_w=500, resize_h=500):
         print(f"  [LỖI] Bỏ qua rembg cho {fname}.")
         return False
         
-    alpha = rgba[:,:,3]/255.0
-    fg = rgba[:,:,:3]
-    bg = cv2.cvtColor(_create_checkerboard(w, h), cv2.COLOR_BGR2RGB)
-    combined = (fg*alpha[:,:,None]+bg*(1-alpha[:,:,None])).astype(np.uint8)
-    img = cv2.cvtColor(combined, cv2.COLOR_RGB2BGR)
+    # Logic ghép nền dùng chung với RemoveBackground
+    img = composite(rgba, "checker", 20)
     
     # 4. HORIZONTAL FLIP
     img = cv2.flip(img, 1)
@@ -11,36 +11,80 @@ from Filters.remove_background import RemoveBackground
 from Filters.horizontal_flip import HorizontalFlip
 from Filters.watermark import Watermark
 from Filters.output_filter import OutputFilter
+from utils.dedup import DedupStore
+from utils.dlq import flush_dlq
+from utils import thread_log
+from utils.metrics import Registry
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 class ParallelPipeline:
-    def __init__(self, n_workers=2, resize_shape=(500, 500)):
-        self.input_dir = os.path.join(DATA_DIR, "input")
-        self.output_dir = os.path.join(DATA_DIR, "output")
+    def __init__(self, n_workers=2, resize_shape=(500, 500), input_dir=None, output_dir=None,
+                 queue_size=8, dedup_db="dedup.db", output_format=None):
+        self.input_dir = input_dir or os.path.join(DATA_DIR, "input")
+        self.output_dir = output_dir or os.path.join(DATA_DIR, "output")
         self.n_workers = max(1, n_workers)
         os.makedirs(self.output_dir, exist_ok=True)
 
-        # Cần 6 Queue cho 5 filter + OutputFilter. Kích thước Queue (maxsize=8)
-        self.queues = [Queue(maxsize=8) for _ in range(6)]
+        # Cần 6 Queue cho 5 filter + OutputFilter. Kích thước Queue (mặc định maxsize=8)
+        self.queues = [Queue(maxsize=queue_size) for _ in range(6)]
 
+        # Một DedupStore (một connection + một thread group-commit) dùng chung cho mọi stage
+        self.dedup = DedupStore(dedup_db)
         self.stages = [
-            (ConvertFilter(), self.queues[0], self.queues[1]),
-            (ResizeFilter(resize_shape[0], resize_shape[1]), self.queues[1], self.queues[2]),
-            (RemoveBackground(), self.queues[2], self.queues[3]),
-            (HorizontalFlip(), self.queues[3], self.queues[4]),
-            (Watermark("Team 11"), self.queues[4], self.queues[5]),
-            (OutputFilter(self.output_dir), self.queues[5], None),
+            (ConvertFilter(dedup_db=self.dedup), self.queues[0], self.queues[1]),
+            (ResizeFilter(resize_shape[0], resize_shape[1], dedup_db=self.dedup), self.queues[1], self.queues[2]),
+            (RemoveBackground(dedup_db=self.dedup, replicas=self.n_workers), self.queues[2], self.queues[3]),
+            (HorizontalFlip(dedup_db=self.dedup), self.queues[3], self.queues[4]),
+            (Watermark("Team 11", dedup_db=self.dedup), self.queues[4], self.queues[5]),
+            (OutputFilter(self.output_dir, dedup_db=self.dedup, output_format=output_format), self.queues[5], None),
         ]
+        # ảnh đã xong mọi stage phía sau thì ConvertFilter bỏ qua trước khi decode
+        self.stages[0][0].skip_if_done = {f.stage_name for f, _, _ in self.stages[1:]}
+        # stage kế tiếp thu nhỏ ảnh -> ConvertFilter decode JPEG ở 1/2, 1/4, 1/8 khi đủ lớn
+        self.stages[0][0].resize_hint = self.stages[1][0].target_size
         self.threads = []
+        self.metrics = Registry()
+        self.sample_interval = 0.05  # chu kỳ lấy mẫu độ sâu queue (giây)
 
-    def start(self):
-        if not os.path.exists(self.input_dir):
+    def _sample_queues(self, stop, depth):
+        # depth: stage -> [tổng, số mẫu, max] độ sâu input queue của stage
+        while not stop.wait(self.sample_interval):
+            for filter_obj, in_q, _ in self.stages:
+                d = depth[filter_obj.stage_name]
+                n = in_q.qsize()
+                d[0] += n
+                d[1] += 1
+                d[2] = max(d[2], n)
+
+    def stage_index(self, stage_name):
+        for i, (filter_obj, _, _) in enumerate(self.stages):
+            if filter_obj.stage_name == stage_name:
+                return i
+        raise ValueError(f"Unknown stage: {stage_name}")
+
+    def start(self, inject=None):
+        """
+        Chạy pipeline trên thư mục input.
+        inject: list (stage_idx, item) để đưa thẳng vào queue của stage đó thay cho việc
+        quét input (dùng khi replay DLQ); stage 0 nhận đường dẫn, các stage sau nhận envelope.
+
+        Trả về dict tổng kết: số file, thời gian, và theo từng stage số item/lỗi/skip,
+        thời gian bận, utilization, latency p50/p95/p99, độ sâu queue (trung bình/max).
+        """
+        if inject is None and not os.path.exists(self.input_dir):
             raise FileNotFoundError(f"Input directory not found: {self.input_dir}")
         
         # Bắt đầu tính thời gian
         start_time = time.time() # <-- Bắt đầu tính
+        thread_log.reset()
+        self.metrics.reset()
+        thread_log.add_listener(self.metrics.observe)
+        depth = {f.stage_name: [0, 0, 0] for f, _, _ in self.stages}
+        stop_sampler = threading.Event()
+        sampler = threading.Thread(target=self._sample_queues, args=(stop_sampler, depth), name="queue-sampler", daemon=True)
+        sampler.start()
         
         # Khởi động worker threads trước
         for i, (filter_obj, in_q, out_q) in enumerate(self.stages):
@@ -54,13 +98,20 @@ class ParallelPipeline:
 
         # Đưa files vào Queue đầu tiên
         count = 0
-        file_names = os.listdir(self.input_dir)
-        for fn in file_names:
-            if fn.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
-                # Blocking put là an toàn ở đây
-                self.queues[0].put(os.path.join(self.input_dir, fn)) 
+        if inject is not None:
+            # put xong hết trước khi gửi sentinel -> sentinel luôn đến sau các item inject
+            for stage_idx, item in inject:
+                self.queues[stage_idx].put(item)
                 count += 1
-        print(f"[Pipeline] Enqueued {count} files from {self.input_dir}")
+            print(f"[Pipeline] Injected {count} item(s)")
+        else:
+            file_names = os.listdir(self.input_dir)
+            for fn in file_names:
+                if fn.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
+                    # Blocking put là an toàn ở đây
+                    self.queues[0].put(os.path.join(self.input_dir, fn)) 
+                    count += 1
+            print(f"[Pipeline] Enqueued {count} files from {self.input_dir}")
 
         # Gửi sentinel None cho mỗi worker của stage 0
         for _ in range(self.n_workers):
@@ -77,6 +128,14 @@ class ParallelPipeline:
              if t.is_alive():
                  t.join(timeout=1) # Chờ một chút để thread thoát an toàn
 
+        # Ghi nốt các stage đang chờ group commit và các entry DLQ đang xếp hàng
+        self.dedup.close()
+        flush_dlq()
+        thread_log.flush()
+        thread_log.remove_listener(self.metrics.observe)
+        stop_sampler.set()
+        sampler.join()
+
         end_time = time.time() # <-- Kết thúc tính
         duration = end_time - start_time
         
@@ -86,7 +145,19 @@ class ParallelPipeline:
         print(f"TỔNG KẾT HIỆU SUẤT PIPELINE SONG SONG:")
         print(f"Tổng số file xử lý: {count}")
         print(f"Thời gian thực thi: {duration:.4f} giây")
+        stages = self.metrics.summary()
+        for filter_obj, _, _ in self.stages:
+            name = filter_obj.stage_name
+            st = stages.setdefault(name, {"items": 0, "errors": 0, "skips": 0, "busy": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0})
+            total, samples, peak = depth[name]
+            st["utilization"] = st["busy"] / (duration * self.n_workers) if duration else 0.0
+            st["queue_mean"] = total / samples if samples else 0.0
+            st["queue_max"] = peak
+            print(f"  {name:<10} n={st['items']:<5} err={st['errors']:<3} skip={st['skips']:<4} "
+                  f"p50={st['p50']*1000:8.2f} ms  p95={st['p95']*1000:8.2f} ms  p99={st['p99']*1000:8.2f} ms  "
+                  f"busy={st['utilization']:5.1%}  queue(avg/max)={st['queue_mean']:.1f}/{peak}")
         print("-" * 50)
+        return {"files": count, "duration": duration, "n_workers": self.n_workers, "stages": stages}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+# file: replay_dlq.py
+
+"""Đưa lại các entry trong Dead Letter Queue vào ParallelPipeline.
+
+    python replay_dlq.py [--dlq-dir ../data/dlq] [--stage rembg] [--workers 2] [--keep]
+
+Mặc định mỗi entry được đưa vào đúng stage đã lỗi (ghi trong metadata); ``--stage``
+ép tất cả vào một stage. Entry không có khung ảnh (frame="path" hoặc DLQ định dạng cũ)
+được chạy lại từ đầu bằng đường dẫn ảnh gốc.
+"""
+import argparse
+import os
+
+from pipeline import ParallelPipeline
+from utils.dlq import DLQ_DIR, read_dlq
+
+def build_inject(pipeline, entries, stage=None):
+    names = [f.stage_name for f, _, _ in pipeline.stages]
+    items, used = [], []
+    for path, meta, img in entries:
+        target = stage or meta.get("stage")
+        idx = pipeline.stage_index(target) if target in names else 0
+        if idx > 0 and img is None:
+            idx = 0
+        if idx == 0:
+            item = meta.get("path")
+            if not item:
+                print(f"[Replay] Skip {os.path.basename(path)}: no frame and no source path")
+                continue
+        else:
+            item = {"id": meta.get("id"), "path": meta.get("path"), "filename": meta.get("filename"), "image": img}
+            if meta.get("resize_to"):
+                item["resize_to"] = meta["resize_to"]
+        # bỏ đánh dấu dedup từ stage được inject trở đi để các stage đó chạy lại
+        if meta.get("id"):
+            pipeline.dedup.clear_stages(meta["id"], names[idx:])
+        items.append((idx, item))
+        used.append((path, meta))
+    return items, used
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Dead Letter Queue entries")
+    parser.add_argument("--dlq-dir", default=DLQ_DIR)
+    parser.add_argument("--stage", default=None, help="tên stage để inject (convert, resize, rembg, hflip, watermark, output)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--keep", action="store_true", help="giữ lại entry sau khi replay")
+    args = parser.parse_args()
+
+    entries = read_dlq(args.dlq_dir)
+    if not entries:
+        print(f"[Replay] DLQ empty: {os.path.abspath(args.dlq_dir)}")
+        return
+    pipeline = ParallelPipeline(n_workers=args.workers)
+    items, used = build_inject(pipeline, entries, args.stage)
+    pipeline.start(inject=items)
+
+    if not args.keep:
+        # entry lỗi lại sẽ được ghi thành entry mới (tên không trùng) nên xoá bản cũ an toàn
+        dlq_dir = os.path.dirname(used[0][0]) if used else None
+        for path, meta in used:
+            os.remove(path)
+            if meta.get("frame"):
+                try:
+                    os.remove(os.path.join(dlq_dir, meta["frame"]))
+                except FileNotFoundError:
+                    pass
+        print(f"[Replay] Removed {len(used)} replayed entr{'y' if len(used) == 1 else 'ies'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Ghép ảnh sau khi tách nền (RGBA của rembg) lên nền checker / màu đơn / trong suốt.
+
+- Nền checker dựng bằng numpy (không lặp cv2.rectangle): chỉ cache một ô lặp 2x2 nhỏ theo
+  (ô, màu), nền full-size được ghép từ ô đó vào buffer riêng của mỗi thread và chỉ vẽ lại khi
+  đổi kích thước / tham số. Nhờ vậy bộ nhớ không tăng theo số kích thước ảnh khác nhau đã gặp.
+- Blend bằng ``cv2.blendLinear`` với trọng số float32 (một lượt trong C, không tạo
+  các mảng float64 full-size như ``fg*alpha + bg*(1-alpha)``); buffer trọng số được
+  cấp một lần cho mỗi thread và dùng lại khi cùng kích thước.
+"""
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+BACKGROUNDS = ["checker", "solid", "transparent"]
+CHECKER_COLORS = (255, 200)  # ô sáng / ô tối (xám nên BGR hay RGB như nhau)
+
+_scratch = threading.local()
+
+
+@lru_cache(maxsize=32)
+def checker_tile(size: int = 20, colors=CHECKER_COLORS):
+    """Ô lặp 2x2 của nền caro (2*size x 2*size x 3); nhỏ nên cache được, không được ghi vào."""
+    size = max(1, int(size))
+    ys = (np.arange(2 * size) // size)[:, None]
+    xs = (np.arange(2 * size) // size)[None, :]
+    cells = np.where((ys + xs) % 2 == 0, np.uint8(colors[0]), np.uint8(colors[1]))
+    tile = np.ascontiguousarray(np.repeat(cells[:, :, None], 3, axis=2))
+    tile.setflags(write=False)
+    return tile
+
+
+def checkerboard(w: int, h: int, size: int = 20, colors=CHECKER_COLORS, out=None):
+    """Nền caro 3 kênh kích thước (h, w), ô ``size`` px, ghép từ ``checker_tile``; ghi vào ``out`` nếu có."""
+    tile = checker_tile(size, colors)
+    t = tile.shape[0]
+    if out is None:
+        out = np.empty((h, w, 3), np.uint8)
+    strip = np.tile(tile, (1, -(-w // t), 1))[:, :w]
+    for y in range(0, h, t):
+        out[y:y + t] = strip[:min(t, h - y)]
+    return out
+
+
+def solid(w: int, h: int, color=(255, 255, 255), out=None):
+    if out is None:
+        out = np.empty((h, w, 3), np.uint8)
+    out[...] = color
+    return out
+
+
+def _background(kind: str, w: int, h: int, checker_size: int, color):
+    # một nền full-size mỗi thread, vẽ lại khi kích thước / loại / tham số đổi
+    key = (kind, w, h, checker_size, color)
+    cached = getattr(_scratch, "background", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    buf = cached[1] if cached is not None and cached[1].shape == (h, w, 3) else np.empty((h, w, 3), np.uint8)
+    if kind == "solid":
+        solid(w, h, color, out=buf)
+    else:
+        checkerboard(w, h, checker_size, out=buf)
+    _scratch.background = (key, buf)
+    return buf
+
+
+def _weights(h: int, w: int):
+    bufs = getattr(_scratch, "weights", None)
+    if bufs is None or bufs[0].shape != (h, w):
+        bufs = _scratch.weights = (np.empty((h, w), np.float32), np.empty((h, w), np.float32))
+    return bufs
+
+
+def composite(rgba, background: str = "checker", checker_size: int = 20, color=(255, 255, 255), out=None):
+    """Ghép ``rgba`` (thứ tự RGBA như rembg trả về) lên nền, trả về ảnh BGR (BGRA nếu trong suốt).
+
+    ``color`` là màu BGR của nền ``solid``; ``out`` (tùy chọn) là mảng đích đã cấp sẵn.
+    """
+    if background == "transparent":
+        return cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA, dst=out)
+    h, w = rgba.shape[:2]
+    if background not in ("solid", "checker"):
+        raise ValueError(f"Unknown background: {background}")
+    color = tuple(int(c) for c in color) if background == "solid" else None
+    bg = _background(background, w, h, checker_size if background == "checker" else None, color)
+    fg = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR)
+    w1, w2 = _weights(h, w)
+    np.multiply(rgba[:, :, 3], np.float32(1 / 255), out=w1)
+    np.subtract(np.float32(1), w1, out=w2)
+    if out is None:
+        out = np.empty_like(fg)
+    return cv2.blendLinear(fg, bg, w1, w2, dst=out)
@@ -1,44 +1,190 @@
+import atexit
 import sqlite3
 import threading
-from typing import Set
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
 
 class DedupStore:
     """
-    Simple persistent dedup store using SQLite.
-    Stores id -> comma-separated stages.
+    Persistent dedup store using SQLite (WAL).
+    Stores id -> bitmask of finished stages (bit của từng stage nằm trong bảng dedup_bits).
     Thread-safe.
+
+    write_behind=True: add_stage chỉ cập nhật bộ nhớ, một thread nền gom các upsert
+    lại và commit theo lô mỗi ``flush_interval`` giây (hoặc khi đủ ``batch_size`` id).
+    get_stages trả lời từ cache trong bộ nhớ cho các id vừa gặp. Gọi flush()/close()
+    khi pipeline kết thúc (atexit cũng flush).
     """
-    def __init__(self, db_path="dedup.db"):
+    def __init__(self, db_path="dedup.db", write_behind=True, flush_interval=0.2, batch_size=256, cache_size=65536):
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.lock = threading.Lock()
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, int]" = OrderedDict()  # id -> mask đầy đủ (DB | pending)
+        self._pending: Dict[str, int] = {}  # id -> bit chưa ghi xuống DB
+        self._pending_paths: List[tuple] = []
+        self._paths: Dict[str, tuple] = {}  # path -> (size, mtime_ns, id)
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = None
         self._init_table()
-        
+        atexit.register(self.flush)
+
     def _init_table(self):
         with self.conn:
             self.conn.execute("""
             CREATE TABLE IF NOT EXISTS dedup (
                 id TEXT PRIMARY KEY,
                 stages TEXT,
-                last_ts INTEGER
+                last_ts INTEGER,
+                mask INTEGER DEFAULT 0
             )
             """)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dedup_bits (name TEXT PRIMARY KEY, bit INTEGER UNIQUE)")
+            # memo path -> content id, để file không đổi (size + mtime) thì khỏi hash lại
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS dedup_paths (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, id TEXT)"
+            )
+            cols = [r[1] for r in self.conn.execute("PRAGMA table_info(dedup)")]
+            if "mask" not in cols:
+                # DB cũ chỉ có cột stages dạng chuỗi -> thêm cột mask, đọc chuỗi cũ khi cần
+                self.conn.execute("ALTER TABLE dedup ADD COLUMN mask INTEGER DEFAULT 0")
+        self._bits = dict(self.conn.execute("SELECT name, bit FROM dedup_bits"))
+
+    def _bit(self, stage: str) -> int:
+        # gọi trong self.lock
+        bit = self._bits.get(stage)
+        if bit is None:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO dedup_bits(name, bit) "
+                    "VALUES(?, (SELECT COALESCE(MAX(bit), -1) + 1 FROM dedup_bits))",
+                    (stage,),
+                )
+            self._bits = dict(self.conn.execute("SELECT name, bit FROM dedup_bits"))
+            bit = self._bits[stage]
+        return 1 << bit
+
+    def _names(self, mask: int) -> Set[str]:
+        return {name for name, bit in self._bits.items() if mask >> bit & 1}
+
+    def _remember(self, id_: str, mask: int):
+        self._cache[id_] = mask
+        self._cache.move_to_end(id_)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load_mask(self, id_: str) -> int:
+        # gọi trong self.lock; gộp cả cột stages dạng chuỗi của DB cũ
+        row = self.conn.execute("SELECT mask, stages FROM dedup WHERE id=?", (id_,)).fetchone()
+        mask = 0
+        if row:
+            mask = row[0] or 0
+            for s in (row[1] or "").split(","):
+                if s:
+                    mask |= self._bit(s)
+        return mask | self._pending.get(id_, 0)
 
     def get_stages(self, id_: str) -> Set[str]:
-        cur = self.conn.execute("SELECT stages FROM dedup WHERE id=?", (id_,))
-        row = cur.fetchone()
-        if not row or not row[0]:
-            return set()
-        return set([s for s in row[0].split(",") if s])
+        with self.lock:
+            mask = self._cache.get(id_)
+            if mask is None:
+                mask = self._load_mask(id_)
+                self._remember(id_, mask)
+            return self._names(mask)
 
     def add_stage(self, id_: str, stage: str):
         with self.lock:
-            stages = self.get_stages(id_)
-            stages.add(stage)
-            stages_str = ",".join(sorted(stages))
-            # Sử dụng UPSERT (ON CONFLICT) để cập nhật stages nếu id đã tồn tại
-            self.conn.execute(
-                "INSERT INTO dedup(id, stages, last_ts) VALUES(?,?,strftime('%s','now')) "
-                "ON CONFLICT(id) DO UPDATE SET stages=?, last_ts=strftime('%s','now')",
-                (id_, stages_str, stages_str)
+            bit = self._bit(stage)
+            if id_ in self._cache:
+                self._remember(id_, self._cache[id_] | bit)
+            self._pending[id_] = self._pending.get(id_, 0) | bit
+            if not self.write_behind:
+                self._flush_locked()
+                return
+            full = len(self._pending) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self._wake.set()
+
+    def clear_stages(self, id_: str, stages):
+        """Bỏ đánh dấu các stage của ``id_`` (ghi ngay), để chạy lại, ví dụ khi replay DLQ."""
+        with self.lock:
+            self._flush_locked()
+            mask = self._load_mask(id_)
+            for s in stages:
+                mask &= ~self._bit(s)
+            with self.conn:
+                self.conn.execute("UPDATE dedup SET mask=?, stages=NULL WHERE id=?", (mask, id_))
+            self._remember(id_, mask)
+
+    def path_id(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        """Content id đã tính cho ``path`` nếu file chưa đổi (cùng size + mtime), ngược lại None."""
+        with self.lock:
+            hit = self._paths.get(path)
+            if hit is None:
+                row = self.conn.execute("SELECT size, mtime_ns, id FROM dedup_paths WHERE path=?", (path,)).fetchone()
+                if row is None:
+                    return None
+                hit = self._paths[path] = tuple(row)
+        return hit[2] if hit[0] == size and hit[1] == mtime_ns else None
+
+    def remember_path(self, path: str, size: int, mtime_ns: int, id_: str):
+        with self.lock:
+            self._paths[path] = (size, mtime_ns, id_)
+            self._pending_paths.append((path, size, mtime_ns, id_))
+            if not self.write_behind:
+                self._flush_locked()
+                return
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is None and not self._closed:
+            with self.lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="dedup-flush", daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def _flush_locked(self):
+        if not self._pending and not self._pending_paths:
+            return
+        rows, self._pending = list(self._pending.items()), {}
+        paths, self._pending_paths = self._pending_paths, []
+        # OR bit vào mask ngay trong upsert -> không cần đọc trước rồi mới ghi
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO dedup_paths(path, size, mtime_ns, id) VALUES(?,?,?,?)", paths)
+            self.conn.executemany(
+                "INSERT INTO dedup(id, mask, last_ts) VALUES(?,?,strftime('%s','now')) "
+                "ON CONFLICT(id) DO UPDATE SET mask=COALESCE(mask, 0) | excluded.mask, last_ts=excluded.last_ts",
+                rows,
             )
-            self.conn.commit()
\ No newline at end of file
+
+    def flush(self):
+        """Ghi mọi stage đang chờ xuống DB trong một transaction."""
+        with self.lock:
+            self._flush_locked()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+
+
+def as_store(dedup_db) -> DedupStore:
+    """Cho phép filter nhận một DedupStore dùng chung thay vì đường dẫn DB."""
+    return dedup_db if isinstance(dedup_db, DedupStore) else DedupStore(dedup_db)
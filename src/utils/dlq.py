@@ -1,31 +1,146 @@
+import atexit
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
+from uuid import uuid4
 
-def write_dlq(envelope: dict, dlq_dir: str = "../data/dlq"):
+import cv2
+import numpy as np
+
+DLQ_DIR = os.environ.get("PIPELINE_DLQ_DIR", "../data/dlq")
+DLQ_QUEUE_SIZE = 64
+
+def _entry_name(envelope: dict, stage: str = None) -> str:
+    # Lấy tên file gốc, nếu không có thì fallback về ID (hash)
+    base = envelope.get("filename") or envelope.get("id")
+    if not base and envelope.get("path"):
+        base = os.path.basename(envelope["path"])
+    # Nếu vẫn không có, dùng "unknown"; timestamp + uuid ở cuối để các lần retry không ghi đè nhau
+    base = os.path.splitext(str(base or "unknown"))[0]
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"{base}.{stage or 'na'}.{stamp}.{uuid4().hex[:6]}"
+
+def _meta(envelope: dict, stage: str, error: str) -> dict:
+    """Metadata gọn: bỏ mảng numpy, giá trị không serialize được thì chuyển thành str."""
+    meta = {"stage": stage, "error": error, "ts": time.time()}
+    for k, v in envelope.items():
+        if isinstance(v, np.ndarray):
+            continue
+        if not isinstance(v, (str, int, float, bool, type(None), list, dict)):
+            v = str(v)
+        meta[k] = v
+    return meta
+
+class DLQWriter:
     """
-    Ghi envelope bị lỗi vào Dead Letter Queue.
-    Sử dụng 'filename' hoặc 'id' làm tên file.
+    Ghi Dead Letter Queue ở thread nền với queue có giới hạn.
+    Mỗi entry là ``<tên>.json`` (metadata) + sidecar ``.png`` (ảnh uint8) hoặc ``.npy``.
+    frame="path": không lưu ảnh, khi replay đọc lại từ ``path`` gốc.
+    Queue đầy thì chỉ ghi metadata ngay (không chặn worker vì encode ảnh).
     """
-    dlq_dir = os.path.abspath(dlq_dir)
-    os.makedirs(dlq_dir, exist_ok=True)
+    def __init__(self, dlq_dir: str = DLQ_DIR, frame: str = "png", maxsize: int = DLQ_QUEUE_SIZE):
+        self.dlq_dir = os.path.abspath(dlq_dir)
+        self.frame = frame
+        self._q = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="dlq-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
-    # Lấy tên file gốc, nếu không có thì fallback về ID (hash)
-    file_name_base = envelope.get("filename", envelope.get("id"))
-    
-    # Nếu vẫn không có, dùng timestamp làm fallback cuối cùng
-    if not file_name_base:
-        file_name_base = f"unknown_{int(datetime.now().timestamp())}"
-
-    # Đảm bảo tên file kết thúc bằng .json
-    fname = f"{file_name_base}.json"
-    
-    out_path = os.path.join(dlq_dir, fname)
-    
-    try:
-        # Sử dụng default=str để xử lý numpy array (image) an toàn khi serialize
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(envelope, f, ensure_ascii=False, indent=2, default=str)
-        print(f"[DLQ] Wrote envelope id={envelope.get('id', 'N/A')} to {out_path}")
-    except Exception as e:
-        print(f"[DLQ] Failed to write DLQ for id={envelope.get('id', 'N/A')}: {e}")
\ No newline at end of file
+    def submit(self, envelope: dict, stage: str = None, error: str = None):
+        # giữ tham chiếu tới mảng ảnh hiện tại (filter luôn gán mảng mới, không sửa tại chỗ)
+        item = (_entry_name(envelope, stage), _meta(envelope, stage, error), envelope.get("image"))
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self._write(item[0], item[1], None)
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._q.task_done()
+
+    def _write(self, name: str, meta: dict, img):
+        os.makedirs(self.dlq_dir, exist_ok=True)
+        meta["frame"] = None
+        try:
+            if img is not None and self.frame != "path":
+                if self.frame == "png" and img.dtype == np.uint8:
+                    sidecar = f"{name}.png"
+                    ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+                    if not ok:
+                        raise IOError("Encode PNG failed")
+                    buf.tofile(os.path.join(self.dlq_dir, sidecar))
+                else:
+                    sidecar = f"{name}.npy"
+                    np.save(os.path.join(self.dlq_dir, sidecar), img, allow_pickle=False)
+                meta["frame"] = sidecar
+            out_path = os.path.join(self.dlq_dir, f"{name}.json")
+            with open(out_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, separators=(",", ":"), default=str)
+            print(f"[DLQ] Wrote envelope id={meta.get('id', 'N/A')} to {out_path}")
+        except Exception as e:
+            print(f"[DLQ] Failed to write DLQ for id={meta.get('id', 'N/A')}: {e}")
+
+    def flush(self):
+        """Chờ ghi xong mọi entry đang xếp hàng."""
+        self._q.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout=10)
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(dlq_dir: str = None) -> DLQWriter:
+    key = os.path.abspath(dlq_dir or DLQ_DIR)
+    with _writers_lock:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = DLQWriter(key)
+        return w
+
+def write_dlq(envelope: dict, dlq_dir: str = None, stage: str = None, error: str = None):
+    """
+    Ghi envelope bị lỗi vào Dead Letter Queue (bất đồng bộ).
+    ``stage``: stage bị lỗi, dùng để replay đúng chỗ.
+    """
+    get_writer(dlq_dir).submit(envelope, stage, error)
+
+def flush_dlq():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for w in writers:
+        w.flush()
+
+def read_dlq(dlq_dir: str = None):
+    """Đọc các entry trong DLQ: list (đường dẫn json, metadata, ảnh hoặc None)."""
+    dlq_dir = os.path.abspath(dlq_dir or DLQ_DIR)
+    if not os.path.isdir(dlq_dir):
+        return []
+    entries = []
+    for fn in sorted(os.listdir(dlq_dir)):
+        if not fn.endswith(".json"):
+            continue
+        path = os.path.join(dlq_dir, fn)
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        img = None
+        sidecar = meta.get("frame")
+        if sidecar:
+            sp = os.path.join(dlq_dir, sidecar)
+            img = np.load(sp) if sidecar.endswith(".npy") else cv2.imread(sp, cv2.IMREAD_UNCHANGED)
+        entries.append((path, meta, img))
+    return entries
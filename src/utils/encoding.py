@@ -0,0 +1,87 @@
+"""Encode ảnh output theo định dạng chọn cho từng job, ghi file atomic.
+
+Định dạng là dict ``{"format": "png"|"jpeg"|"webp", "compression": 0-9 (PNG),
+"quality": 0-100 (JPEG/WebP), "lossless": bool (WebP)}``; thiếu khoá nào thì dùng mặc định.
+None = PNG với tham số mặc định của OpenCV (như trước đây).
+"""
+import os
+from typing import Dict, Optional
+from uuid import uuid4
+
+import cv2
+
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+FORMATS = list(EXTENSIONS)
+WEBP_DEFAULT_QUALITY = 80  # OpenCV không truyền quality thì WebP là lossless
+
+
+def normalize(fmt: Optional[Dict] = None) -> Dict:
+    """Dạng chuẩn (đủ khoá, bỏ giá trị thừa) để so sánh và đưa vào cache key."""
+    fmt = dict(fmt or {})
+    name = (fmt.get("format") or "png").lower()
+    if name == "jpg":
+        name = "jpeg"
+    if name not in EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {name}")
+    out = {"format": name}
+    if name == "png" and fmt.get("compression") is not None:
+        out["compression"] = int(fmt["compression"])
+    if name in ("jpeg", "webp") and fmt.get("quality") is not None:
+        out["quality"] = int(fmt["quality"])
+    if name == "webp" and fmt.get("lossless"):
+        out["lossless"] = True
+    return out
+
+
+def is_default(fmt: Optional[Dict]) -> bool:
+    return normalize(fmt) == {"format": "png"}
+
+
+def extension(fmt: Optional[Dict] = None) -> str:
+    return EXTENSIONS[normalize(fmt)["format"]]
+
+
+def encode(img, fmt: Optional[Dict] = None, ext: Optional[str] = None):
+    """Encode ``img`` -> buffer numpy. ``fmt`` None và có ``ext`` thì theo đuôi file (như cv2.imwrite)."""
+    if fmt is None and ext:
+        ok, buf = cv2.imencode(ext, img)
+        if not ok:
+            raise RuntimeError(f"Encode {ext} failed")
+        return buf
+    f = normalize(fmt)
+    params = []
+    if f["format"] == "png":
+        if "compression" in f:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, f["compression"]]
+    elif f["format"] == "jpeg":
+        if img.ndim == 3 and img.shape[2] == 4:
+            # JPEG không có kênh alpha
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        if "quality" in f:
+            params = [cv2.IMWRITE_JPEG_QUALITY, f["quality"]]
+    else:
+        # quality > 100 nghĩa là lossless với encoder WebP của OpenCV
+        q = 101 if f.get("lossless") else f.get("quality", WEBP_DEFAULT_QUALITY)
+        params = [cv2.IMWRITE_WEBP_QUALITY, q]
+    ok, buf = cv2.imencode(EXTENSIONS[f["format"]], img, params)
+    if not ok:
+        raise RuntimeError(f"Encode {f['format']} failed")
+    return buf
+
+
+def write_atomic(buf, path: str):
+    """Ghi ra file tạm cùng thư mục rồi os.replace: người đọc không bao giờ thấy file dở dang,
+    và output luôn là inode mới (không ghi đè lên file đang được hardlink ở chỗ khác)."""
+    tmp = f"{path}.{uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(memoryview(buf))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def save(img, path: str, fmt: Optional[Dict] = None):
+    """Encode + ghi atomic; ``fmt`` None thì định dạng theo đuôi của ``path``."""
+    write_atomic(encode(img, fmt, os.path.splitext(path)[1] if fmt is None else None), path)
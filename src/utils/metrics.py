@@ -0,0 +1,168 @@
+"""Metrics theo stage: số item, lỗi, thời gian bận, histogram latency (p50/p95/p99).
+
+Dùng chung cho ParallelPipeline (thread) và API (process): ``Registry.drain()`` trả về
+phần thay đổi dạng dòng cộng dồn được, để gom metrics từ nhiều process vào một store;
+``render_prometheus`` xuất text format của Prometheus.
+"""
+import bisect
+import math
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# biên trên của bucket (giây), kiểu Prometheus; bucket cuối là +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Ước lượng phân vị bằng nội suy tuyến tính trong bucket (như histogram_quantile)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i]
+                if math.isinf(hi):
+                    return lo
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-2]
+
+class StageMetrics:
+    def __init__(self):
+        self.items = 0
+        self.errors = 0
+        self.skips = 0
+        self.busy = 0.0
+        self.latency = Histogram()
+
+    def observe(self, seconds: float, status: str = "done"):
+        if status == "error":
+            self.errors += 1
+        elif status == "skip":
+            self.skips += 1
+        else:
+            self.items += 1
+        if seconds is not None:
+            self.busy += seconds
+            self.latency.observe(seconds)
+
+    def to_rows(self, stage: str) -> List[Tuple[str, str, float]]:
+        rows = [(stage, "items", self.items), (stage, "errors", self.errors), (stage, "skips", self.skips),
+                (stage, "busy", self.busy), (stage, "sum", self.latency.sum), (stage, "count", self.latency.count)]
+        rows += [(stage, f"le:{b}", c) for b, c in zip(self.latency.buckets, self.latency.counts) if c]
+        return rows
+
+    def add_row(self, key: str, value: float):
+        if key.startswith("le:"):
+            i = self.latency.buckets.index(float(key[3:]))
+            self.latency.counts[i] += int(value)
+        elif key == "sum":
+            self.latency.sum += value
+        elif key == "count":
+            self.latency.count += int(value)
+        else:
+            setattr(self, key, getattr(self, key) + (value if key == "busy" else int(value)))
+
+    def summary(self) -> Dict:
+        out = {"items": self.items, "errors": self.errors, "skips": self.skips, "busy": self.busy}
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}"] = self.latency.quantile(q)
+        return out
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, StageMetrics] = {}
+
+    def observe(self, stage: str, seconds: float, status: str = "done"):
+        with self._lock:
+            m = self.stages.get(stage)
+            if m is None:
+                m = self.stages[stage] = StageMetrics()
+            m.observe(seconds, status)
+
+    def drain(self) -> List[Tuple[str, str, float]]:
+        """Trả về toàn bộ số liệu dạng (stage, key, value) rồi xoá (để cộng dồn ở nơi khác)."""
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        rows = []
+        for stage, m in stages.items():
+            rows += m.to_rows(stage)
+        return rows
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, float]]) -> "Registry":
+        reg = cls()
+        for stage, key, value in rows:
+            m = reg.stages.get(stage)
+            if m is None:
+                m = reg.stages[stage] = StageMetrics()
+            m.add_row(key, value)
+        return reg
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {stage: m.summary() for stage, m in self.stages.items()}
+
+def _labels(**kw) -> str:
+    if not kw:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in kw.items()) + "}"
+
+def _le(b: float) -> str:
+    return "+Inf" if math.isinf(b) else repr(b)
+
+def render_prometheus(registry: Registry, gauges: Iterable[Tuple[str, Dict, float]] = (), prefix: str = "pipeline") -> str:
+    """Text exposition format: counter items/errors/busy, histogram latency, phân vị và các gauge."""
+    lines = [
+        f"# HELP {prefix}_stage_items_total Items finished by stage and status.",
+        f"# TYPE {prefix}_stage_items_total counter",
+    ]
+    stages = sorted(registry.stages.items())
+    for stage, m in stages:
+        for status, v in (("done", m.items), ("error", m.errors), ("skip", m.skips)):
+            lines.append(f"{prefix}_stage_items_total{_labels(stage=stage, status=status)} {v}")
+    lines += [f"# HELP {prefix}_stage_busy_seconds_total Time spent processing items.",
+              f"# TYPE {prefix}_stage_busy_seconds_total counter"]
+    for stage, m in stages:
+        lines.append(f"{prefix}_stage_busy_seconds_total{_labels(stage=stage)} {m.busy:.6f}")
+    lines += [f"# HELP {prefix}_stage_latency_seconds Per-item processing latency.",
+              f"# TYPE {prefix}_stage_latency_seconds histogram"]
+    for stage, m in stages:
+        h = m.latency
+        acc = 0
+        for b, c in zip(h.buckets, h.counts):
+            acc += c
+            lines.append(f"{prefix}_stage_latency_seconds_bucket{_labels(stage=stage, le=_le(b))} {acc}")
+        lines.append(f"{prefix}_stage_latency_seconds_sum{_labels(stage=stage)} {h.sum:.6f}")
+        lines.append(f"{prefix}_stage_latency_seconds_count{_labels(stage=stage)} {h.count}")
+    lines += [f"# HELP {prefix}_stage_latency_quantile_seconds Estimated latency quantiles.",
+              f"# TYPE {prefix}_stage_latency_quantile_seconds gauge"]
+    for stage, m in stages:
+        for q in QUANTILES:
+            lines.append(f"{prefix}_stage_latency_quantile_seconds{_labels(stage=stage, quantile=q)} {m.latency.quantile(q):.6f}")
+    seen = set()
+    for name, labels, value in gauges:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name}{_labels(**labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,81 @@
+"""Tối ưu chuỗi bước trước khi chạy, dựa trên metadata của filter trong registry.
+
+Metadata đọc từ ``registry[name]`` (dict, các khoá đều tuỳ chọn):
+
+- ``"commutes"``: {tên filter: "exact" | "approx"} - đổi thứ tự với filter đó cho cùng kết quả
+  ("exact") hoặc gần như cùng (ví dụ chỉ khác do nội suy). Quan hệ đối xứng, khai báo một phía là đủ.
+  Giá trị cũng có thể là hàm ``fn(params của bước khai báo, params của bước kia) -> mức | None``
+  khi việc giao hoán tuỳ params (ví dụ nền checker có kích thước ô tính bằng pixel).
+- ``"identity"``: bước không đổi ảnh, bỏ luôn.
+- ``"noop"``: fn(params) -> True nếu với params này bước không làm gì.
+- ``"downscale"``: fn(params) -> True nếu bước chắc chắn thu nhỏ ảnh; được kéo lên trước các bước
+  giao hoán với nó để bước nặng chạy trên ảnh nhỏ.
+- ``"involution"``: hai bước cùng params triệt tiêu nhau (flip), bỏ cả cặp nếu các bước ở giữa
+  giao hoán "exact" với nó.
+
+Không phụ thuộc API: ParallelPipeline hay script khác dùng được với registry riêng.
+"""
+from typing import Dict, List, Tuple
+
+
+def _level(registry: Dict[str, Dict], a: Dict, b: Dict):
+    level = registry[a["name"]].get("commutes", {}).get(b["name"])
+    return level(_params(a), _params(b)) if callable(level) else level
+
+
+def commutes(registry: Dict[str, Dict], a: Dict, b: Dict, exact: bool = False) -> bool:
+    """Hai bước ``a``, ``b`` (dict có "name", "params") đổi chỗ được cho nhau không."""
+    level = _level(registry, a, b) or _level(registry, b, a)
+    return level == "exact" if exact else level in ("exact", "approx")
+
+
+def _params(step: Dict) -> Dict:
+    return step.get("params") or {}
+
+
+def _check(registry: Dict[str, Dict], step: Dict, key: str) -> bool:
+    fn = registry[step["name"]].get(key)
+    return bool(fn and fn(_params(step)))
+
+
+def optimize_steps(steps: List[Dict], registry: Dict[str, Dict]) -> Tuple[List[Dict], List[str]]:
+    """Trả về (chuỗi bước đã tối ưu, mô tả các thay đổi). Không sửa ``steps`` đầu vào."""
+    changes: List[str] = []
+
+    # 1. bỏ bước không làm gì
+    out: List[Dict] = []
+    for idx, s in enumerate(steps):
+        if registry[s["name"]].get("identity") or _check(registry, s, "noop"):
+            changes.append(f"drop no-op {s['name']} (step {idx + 1})")
+            continue
+        out.append(dict(s))
+
+    # 2. kéo bước thu nhỏ lên trước các bước giao hoán với nó
+    for i in range(len(out)):
+        s = out[i]
+        if not _check(registry, s, "downscale"):
+            continue
+        j = i
+        while j > 0 and commutes(registry, out[j - 1], s):
+            j -= 1
+        if j < i:
+            passed = [p["name"] for p in out[j:i]]
+            out.insert(j, out.pop(i))
+            changes.append(f"move {s['name']} before {', '.join(passed)}")
+
+    # 3. bỏ các cặp involution (flip ... flip) khi mọi bước ở giữa giao hoán chính xác với nó
+    i = 0
+    while i < len(out):
+        s = out[i]
+        if registry[s["name"]].get("involution"):
+            for j in range(i + 1, len(out)):
+                t = out[j]
+                if t["name"] == s["name"] and _params(t) == _params(s):
+                    changes.append(f"drop {s['name']} pair (cancel out)")
+                    del out[j], out[i]
+                    i = -1  # quét lại từ đầu: bỏ cặp có thể làm lộ cặp khác
+                    break
+                if not commutes(registry, t, s, exact=True):
+                    break
+        i += 1
+    return out, changes
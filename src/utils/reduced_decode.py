@@ -0,0 +1,82 @@
+"""Decode JPEG ở độ phân giải giảm (1/2, 1/4, 1/8) khi bước kế tiếp chỉ cần ảnh nhỏ.
+
+libjpeg thu nhỏ ngay trong lúc giải nén (bỏ bớt hệ số DCT) nên nhanh và tốn ít bộ nhớ
+hơn nhiều so với decode đầy đủ rồi mới resize. Kích thước gốc đọc từ header (SOF, có xoay
+theo EXIF orientation như cv2.imdecode), không cần decode. File không phải JPEG thì decode
+đầy đủ như cũ (OpenCV cũng chỉ giảm được khi giải nén JPEG).
+"""
+from typing import Optional, Tuple
+
+import cv2
+
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+HEAD_BYTES = 1 << 16  # đủ cho SOI + APPn thông thường; không thấy SOF trong đoạn này thì coi như không biết
+# SOF0..SOF15 trừ DHT (C4), JPG (C8), DAC (CC)
+_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _exif_orientation(tiff: bytes) -> Optional[int]:
+    try:
+        order = "little" if tiff[:2] == b"II" else "big"
+        ifd = int.from_bytes(tiff[4:8], order)
+        for k in range(int.from_bytes(tiff[ifd:ifd + 2], order)):
+            e = ifd + 2 + 12 * k
+            if int.from_bytes(tiff[e:e + 2], order) == 0x0112:
+                return int.from_bytes(tiff[e + 8:e + 10], order)
+    except (IndexError, ValueError):
+        pass
+    return None
+
+
+def jpeg_size(buf) -> Optional[Tuple[int, int]]:
+    """(w, h) của ảnh JPEG sau khi xoay theo EXIF; None nếu không phải JPEG hoặc không đọc được header."""
+    b = bytes(buf[:HEAD_BYTES])
+    if b[:2] != b"\xff\xd8":
+        return None
+    i, orientation = 2, 1
+    while i + 4 <= len(b):
+        if b[i] != 0xFF:
+            return None
+        marker = b[i + 1]
+        if marker == 0xFF:  # byte đệm
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # marker không có độ dài
+            i += 2
+            continue
+        seg = int.from_bytes(b[i + 2:i + 4], "big")
+        if marker in _SOF:
+            if i + 9 > len(b):
+                return None
+            h = int.from_bytes(b[i + 5:i + 7], "big")
+            w = int.from_bytes(b[i + 7:i + 9], "big")
+            # orientation 5..8: ảnh xoay 90°, cv2.imdecode trả về ảnh đã xoay
+            return (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+        if marker == 0xE1 and b[i + 4:i + 10] == b"Exif\0\0":
+            orientation = _exif_orientation(b[i + 10:i + 2 + seg]) or orientation
+        if marker == 0xDA:  # bắt đầu dữ liệu ảnh mà chưa thấy SOF
+            return None
+        i += 2 + seg
+    return None
+
+
+def reduction(size: Tuple[int, int], target: Tuple[int, int]) -> int:
+    """Hệ số giảm lớn nhất (8, 4, 2, hoặc 1) mà ảnh decode vẫn không nhỏ hơn ``target`` ở cả hai chiều."""
+    for f in (8, 4, 2):
+        if -(-size[0] // f) >= target[0] and -(-size[1] // f) >= target[1]:
+            return f
+    return 1
+
+
+def imdecode(data, size: Optional[Tuple[int, int]] = None, target: Optional[Tuple[int, int]] = None):
+    """``cv2.imdecode(data, IMREAD_COLOR)``, nhưng decode giảm nếu biết ``size`` gốc và ``target`` đủ nhỏ.
+
+    Trả về (img, factor); ảnh giảm vẫn >= ``target``, caller tự resize về đúng ``target``.
+    """
+    f = reduction(size, target) if size and target else 1
+    if f > 1:
+        img = cv2.imdecode(data, REDUCED_FLAGS[f])
+        if img is not None:
+            return img, f
+    return cv2.imdecode(data, cv2.IMREAD_COLOR), 1
+
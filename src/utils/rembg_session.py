@@ -0,0 +1,77 @@
+"""Session rembg dùng lại được, có warm-up và giới hạn thread của onnxruntime.
+
+``rembg.remove(img)`` không truyền session sẽ tự resolve model mỗi lần gọi, và mỗi
+session onnxruntime mặc định dùng hết số core -> N worker chạy song song tranh nhau
+N x cores thread. Module này tạo một session cho mỗi worker với số intra-op thread
+chia theo ngân sách core.
+
+Cấu hình qua env:
+- ``PIPELINE_REMBG_MODEL``: tên model (mặc định ``u2net``),
+- ``PIPELINE_REMBG_INTRA_THREADS``: ép số intra-op thread, 0 = tự chia ``os.cpu_count() // số replica``,
+- ``PIPELINE_REMBG_INTER_THREADS``: số inter-op thread (mặc định 1; session chạy ORT_SEQUENTIAL nên
+  ít khi cần hơn), 0 = để onnxruntime tự chọn.
+"""
+import os
+import threading
+
+import numpy as np
+
+REMBG_MODEL = os.environ.get("PIPELINE_REMBG_MODEL", "u2net")
+REMBG_INTRA_THREADS = int(os.environ.get("PIPELINE_REMBG_INTRA_THREADS", "0"))
+REMBG_INTER_THREADS = int(os.environ.get("PIPELINE_REMBG_INTER_THREADS", "1"))
+REMBG_MODELS = ["u2net", "u2netp", "u2net_human_seg", "isnet-general-use", "silueta"]
+
+_ENV_LOCK = threading.Lock()
+
+
+def thread_budget(replicas: int = 1) -> int:
+    """Số intra-op thread cho mỗi session để tổng thread của mọi replica ~ số core."""
+    if REMBG_INTRA_THREADS > 0:
+        return REMBG_INTRA_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, replicas))
+
+
+def _session_options(intra_threads: int, inter_threads: int):
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = intra_threads
+    opts.inter_op_num_threads = inter_threads
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return opts
+
+
+def new_session(model: str = None, replicas: int = 1, warmup: bool = True):
+    """Tạo session cho ``model`` (mặc định ``REMBG_MODEL``) và chạy thử một lần nếu ``warmup``."""
+    from rembg import new_session as _rembg_new_session
+
+    model = model or REMBG_MODEL
+    intra = thread_budget(replicas)
+    inter = max(0, REMBG_INTER_THREADS)  # 0: mặc định của onnxruntime
+    try:
+        from rembg.sessions import sessions_class
+
+        cls = next(c for c in sessions_class if c.name() == model)
+        session = cls(model, _session_options(intra, inter))
+    except (ImportError, StopIteration, TypeError):
+        # rembg cũ không cho truyền SessionOptions: chỉ đọc OMP_NUM_THREADS lúc tạo session
+        with _ENV_LOCK:
+            old = os.environ.get("OMP_NUM_THREADS")
+            os.environ["OMP_NUM_THREADS"] = str(intra)
+            try:
+                session = _rembg_new_session(model)
+            finally:
+                if old is None:
+                    os.environ.pop("OMP_NUM_THREADS", None)
+                else:
+                    os.environ["OMP_NUM_THREADS"] = old
+    if warmup:
+        warm(session)
+    return session
+
+
+def warm(session, size: int = 64):
+    """Một lần inference trên ảnh nhỏ: load weight, cấp phát arena trước khi nhận ảnh thật."""
+    from rembg import remove
+
+    remove(np.zeros((size, size, 3), np.uint8), session=session)
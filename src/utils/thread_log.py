@@ -1,11 +1,165 @@
+"""
+Log sự kiện START/END của từng stage, có cấu trúc và ghi theo lô.
+
+Worker chỉ append một dict vào deque (không khoá, không I/O); một thread nền gom
+buffer mỗi ``PIPELINE_LOG_INTERVAL`` giây và ghi một lần ra stderr (dạng dòng như cũ)
+hoặc file JSONL nếu đặt ``PIPELINE_LOG_FILE``. Mức log qua ``PIPELINE_LOG_LEVEL``:
+quiet < error < info (DONE/SKIP/ERROR) < debug (thêm START).
+Cặp START/END được đổi thành mẫu thời gian xử lý theo stage, xem ``durations()``/``summary()``;
+mỗi stage chỉ giữ ``PIPELINE_LOG_SAMPLES`` mẫu gần nhất (process sống lâu không phình bộ nhớ),
+count/total/max vẫn đếm trên mọi mẫu.
+"""
+import atexit
+import json
+import os
+import sys
 import threading
+import time
+from collections import deque
+
+LEVELS = {"quiet": 0, "error": 1, "info": 2, "debug": 3}
+_STATUS_LEVEL = {"start": 3, "done": 2, "skip": 2, "error": 1}
+
+LOG_LEVEL = LEVELS.get(os.environ.get("PIPELINE_LOG_LEVEL", "info").lower(), 2)
+LOG_FILE = os.environ.get("PIPELINE_LOG_FILE") or None
+LOG_INTERVAL = float(os.environ.get("PIPELINE_LOG_INTERVAL", "0.2"))
+DURATION_SAMPLES = max(1, int(os.environ.get("PIPELINE_LOG_SAMPLES", "10000")))
+
+_events = deque()
+_starts = {}  # (stage, thread id) -> monotonic lúc START
+_durations = {}  # stage -> deque các mẫu gần nhất (giây), tối đa DURATION_SAMPLES
+_totals = {}  # stage -> [count, total, max] trên mọi mẫu
+_listeners = []  # fn(stage, seconds, status) gọi ở mỗi END, ví dụ metrics
+_wake = threading.Event()
+_flusher = None
+_flusher_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+def add_listener(fn):
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+def remove_listener(fn):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+def set_level(level):
+    global LOG_LEVEL
+    LOG_LEVEL = LEVELS[level] if isinstance(level, str) else int(level)
+
+def _fname(envelope):
+    return envelope.get("filename") or envelope.get("path") or envelope.get("id")
+
+def _record(filter_name, envelope, status):
+    t = threading.current_thread()
+    now = time.monotonic()
+    key = (filter_name, t.ident)
+    dur = None
+    if status == "start":
+        _starts[key] = now
+    else:
+        began = _starts.pop(key, None)
+        if began is not None:
+            dur = now - began
+            samples = _durations.get(filter_name)
+            if samples is None:
+                _totals.setdefault(filter_name, [0, 0.0, 0.0])  # trước deque: thread khác thấy deque là thấy totals
+                samples = _durations.setdefault(filter_name, deque(maxlen=DURATION_SAMPLES))
+            samples.append(dur)
+            tot = _totals[filter_name]
+            tot[0] += 1
+            tot[1] += dur
+            tot[2] = max(tot[2], dur)
+        for fn in _listeners:
+            fn(filter_name, dur, status)
+    if _STATUS_LEVEL.get(status, 2) > LOG_LEVEL:
+        return
+    _events.append({
+        "ts": now,
+        "wall": time.time(),
+        "stage": filter_name,
+        "thread": t.name,
+        "id": envelope.get("id"),
+        "file": _fname(envelope),
+        "status": status,
+        "dur": dur,
+    })
+    _ensure_flusher()
 
 def log_start(filter_name, envelope):
-    thread_name = threading.current_thread().name
-    fname = envelope.get("filename") or envelope.get("path") or envelope.get("id")
-    print(f"[{thread_name}][{filter_name}] START {fname}")
+    _record(filter_name, envelope, "start")
 
 def log_end(filter_name, envelope, status="done"):
-    thread_name = threading.current_thread().name
-    fname = envelope.get("filename") or envelope.get("path") or envelope.get("id")
-    print(f"[{thread_name}][{filter_name}] {status.upper()} {fname}")
+    _record(filter_name, envelope, status)
+
+# ---------- ghi ra ----------
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="thread-log-flush", daemon=True)
+                _flusher.start()
+
+def _flush_loop():
+    while True:
+        _wake.wait(LOG_INTERVAL)
+        _wake.clear()
+        flush()
+
+def _format(e):
+    return f"[{e['thread']}][{e['stage']}] {e['status'].upper()} {e['file']}"
+
+def flush():
+    """Ghi mọi sự kiện đang trong buffer (gọi khi pipeline kết thúc; atexit cũng gọi)."""
+    with _write_lock:
+        batch = []
+        while True:
+            try:
+                batch.append(_events.popleft())
+            except IndexError:
+                break
+        if not batch:
+            return
+        if LOG_FILE:
+            with open(LOG_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch))
+        else:
+            sys.stderr.write("".join(_format(e) + "\n" for e in batch))
+            sys.stderr.flush()
+
+atexit.register(flush)
+
+# ---------- thống kê ----------
+def durations():
+    """Mẫu thời gian xử lý gần nhất (giây) theo stage: {stage: [..]}."""
+    return {stage: list(samples) for stage, samples in _durations.items()}
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+def summary():
+    """Thống kê theo stage: count, total, mean, max trên mọi mẫu; p50, p95 trên các mẫu gần nhất (giây)."""
+    out = {}
+    for stage, samples in durations().items():
+        vals = sorted(samples)
+        if not vals:
+            continue
+        count, total, longest = _totals[stage]
+        out[stage] = {
+            "count": count,
+            "total": total,
+            "mean": total / count,
+            "p50": _percentile(vals, 0.50),
+            "p95": _percentile(vals, 0.95),
+            "max": longest,
+        }
+    return out
+
+def reset():
+    _starts.clear()
+    _durations.clear()
+    _totals.clear()
@@ -0,0 +1,117 @@
+"""Song song trong một ảnh: chia khung lớn thành dải (strip) và xử lý trên thread pool.
+
+Chỉ dùng cho phép toán theo pixel hoặc cục bộ (cvtColor, flip ngang, blend, resize INTER_AREA),
+mỗi dải ghi thẳng vào vùng tương ứng của mảng kết quả nên không cần ghép lại.
+OpenCV/numpy nhả GIL trong các lệnh này nên các dải chạy thật sự song song.
+
+Ảnh nhỏ hơn ``PIPELINE_TILE_MIN_PIXELS`` (mặc định 16 MP) chạy thẳng một lệnh như cũ;
+``PIPELINE_TILE_THREADS`` là số thread của pool (mặc định số core, 1 = tắt tiling).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+TILE_MIN_PIXELS = int(os.environ.get("PIPELINE_TILE_MIN_PIXELS", str(16_000_000)))
+TILE_THREADS = int(os.environ.get("PIPELINE_TILE_THREADS", "0")) or (os.cpu_count() or 1)
+MIN_STRIP = 64  # số dòng/cột tối thiểu của một dải
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    # pool riêng cho từng process (API fork worker process; thread không đi theo fork)
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=TILE_THREADS, thread_name_prefix="tile")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def should_tile(img) -> bool:
+    return TILE_THREADS > 1 and img.shape[0] * img.shape[1] >= TILE_MIN_PIXELS
+
+
+def strips(n: int, parts: int = None):
+    """Chia ``n`` dòng (hoặc cột) thành tối đa ``parts`` khoảng [a, b) gần bằng nhau."""
+    parts = max(1, min(parts or TILE_THREADS, n // MIN_STRIP or 1))
+    step = -(-n // parts)
+    return [(a, min(n, a + step)) for a in range(0, n, step)]
+
+
+def run_strips(fn, n: int):
+    """Gọi ``fn(a, b)`` cho từng dải trên pool và chờ xong; lỗi ở dải nào thì raise lại."""
+    ranges = strips(n)
+    if len(ranges) == 1:
+        fn(0, n)
+        return
+    ex = _executor()
+    # dải đầu chạy ngay trên thread gọi, không phải chờ pool
+    futs = [ex.submit(fn, a, b) for a, b in ranges[1:]]
+    fn(*ranges[0])
+    for f in futs:
+        f.result()
+
+
+def cvt_color(img, code: int):
+    if not should_tile(img):
+        return cv2.cvtColor(img, code)
+    first = cv2.cvtColor(img[:1], code)
+    out = np.empty((img.shape[0],) + first.shape[1:], first.dtype)
+    run_strips(lambda a, b: cv2.cvtColor(img[a:b], code, dst=out[a:b]), img.shape[0])
+    return out
+
+
+def flip_h(img):
+    if not should_tile(img):
+        return cv2.flip(img, 1)
+    out = np.empty_like(img)
+    run_strips(lambda a, b: cv2.flip(img[a:b], 1, dst=out[a:b]), img.shape[0])
+    return out
+
+
+def resize_area(img, size):
+    """``cv2.resize(img, size, INTER_AREA)``; khi thu nhỏ ảnh lớn thì tách hai lượt.
+
+    INTER_AREA khi thu nhỏ là trung bình theo ô chữ nhật nên tách được: lượt ngang
+    (mỗi dòng độc lập -> chia theo dòng) rồi lượt dọc (mỗi cột độc lập -> chia theo cột),
+    trung gian float32 để chỉ làm tròn một lần. Kết quả lệch tối đa 1 mức xám so với một lệnh.
+    Phóng to hoặc ảnh nhỏ vẫn dùng một lệnh cv2.resize.
+    """
+    w, h = int(size[0]), int(size[1])
+    src_h, src_w = img.shape[:2]
+    if not should_tile(img) or w > src_w or h > src_h:
+        return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    mid = np.empty((src_h, w) + img.shape[2:], np.float32)
+    run_strips(lambda a, b: np.copyto(
+        mid[a:b], cv2.resize(img[a:b].astype(np.float32), (w, b - a), interpolation=cv2.INTER_AREA)
+    ), src_h)
+    out = np.empty((h, w) + img.shape[2:], img.dtype)
+
+    def cols(a, b):
+        res = cv2.resize(mid[:, a:b], (b - a, h), interpolation=cv2.INTER_AREA)
+        np.copyto(out[:, a:b], np.rint(res).reshape(out[:, a:b].shape), casting="unsafe")
+
+    run_strips(cols, w)
+    return out
+
+
+def blend(roi, K, P):
+    """``roi = roi * K + P`` tại chỗ (K, P float32 cùng số dòng với roi), chia theo dòng khi roi lớn."""
+    view = roi[:, :, :3] if roi.ndim == 3 else roi[:, :, None]
+
+    def part(a, b):
+        res = view[a:b] * K[a:b]
+        res += P[a:b]
+        np.copyto(view[a:b], res, casting="unsafe")
+
+    if should_tile(roi):
+        run_strips(part, roi.shape[0])
+    else:
+        part(0, roi.shape[0])
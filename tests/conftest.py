@@ -0,0 +1,5 @@
+import os
+import sys
+
+# test import theo gốc repo (src.api..., src.utils...) giống cách chạy uvicorn src.api.main:app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,67 @@
+import sqlite3
+
+from src.utils.dedup import DedupStore
+
+
+def _db_mask(path, id_):
+    with sqlite3.connect(path) as conn:
+        row = conn.execute("SELECT mask FROM dedup WHERE id=?", (id_,)).fetchone()
+    return row[0] if row else None
+
+
+def test_write_behind_visible_before_flush(tmp_path):
+    db = str(tmp_path / "d.db")
+    store = DedupStore(db, flush_interval=60)
+    store.get_stages("img")  # đưa vào cache trong bộ nhớ
+    store.add_stage("img", "convert")
+    store.add_stage("img", "resize")
+    assert store.get_stages("img") == {"convert", "resize"}
+    assert _db_mask(db, "img") is None  # chưa tới lúc flush
+    store.flush()
+    assert _db_mask(db, "img") == 0b11
+    store.close()
+
+
+def test_persisted_across_instances(tmp_path):
+    db = str(tmp_path / "d.db")
+    a = DedupStore(db)
+    a.add_stage("x", "convert")
+    a.close()
+    b = DedupStore(db)
+    assert b.get_stages("x") == {"convert"}
+    b.add_stage("x", "flip")
+    b.close()
+    assert DedupStore(db, write_behind=False).get_stages("x") == {"convert", "flip"}
+
+
+def test_batch_size_wakes_flusher(tmp_path):
+    db = str(tmp_path / "d.db")
+    store = DedupStore(db, flush_interval=60, batch_size=4)
+    for i in range(4):
+        store.add_stage(f"id{i}", "convert")
+    # đủ batch_size -> flusher ghi ngay, không chờ flush_interval
+    for _ in range(200):
+        if _db_mask(db, "id3"):
+            break
+        store._flusher.join(0.01)
+    assert _db_mask(db, "id3") == 1
+    store.close()
+
+
+def test_clear_stages(tmp_path):
+    store = DedupStore(str(tmp_path / "d.db"))
+    store.add_stage("x", "convert")
+    store.add_stage("x", "resize")
+    store.clear_stages("x", ["resize"])
+    assert store.get_stages("x") == {"convert"}
+    store.close()
+
+
+def test_path_id_follows_size_and_mtime(tmp_path):
+    db = str(tmp_path / "d.db")
+    store = DedupStore(db)
+    store.remember_path("/a.jpg", 10, 111, "h1")
+    assert store.path_id("/a.jpg", 10, 111) == "h1"
+    assert store.path_id("/a.jpg", 10, 222) is None
+    store.close()
+    assert DedupStore(db).path_id("/a.jpg", 10, 111) == "h1"
@@ -0,0 +1,125 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from src.api.cache import digest_bytes
+from src.api.dir_index import DirIndex, image_size
+
+
+def _write(path, w, h):
+    cv2.imwrite(str(path), np.zeros((h, w, 3), np.uint8))
+
+
+def _age_dir(path, seconds=60):
+    # đẩy mtime thư mục về quá khứ: lần quét sau coi như "đã ổn định"
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+@pytest.fixture
+def root(tmp_path):
+    d = tmp_path / "input"
+    d.mkdir()
+    _write(d / "b.png", 30, 20)
+    _write(d / "a.jpg", 10, 40)
+    _write(d / "c.png", 50, 50)
+    (d / "notes.txt").write_text("x")
+    _age_dir(d)
+    return d
+
+
+def _index(tmp_path, root, **kw):
+    return DirIndex(str(tmp_path / "idx.db"), str(root), "input", **kw)
+
+
+def _wait_meta(idx, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        items, _ = idx.list()
+        if all(it["hash"] and it["width"] for it in items):
+            return items
+        time.sleep(0.02)
+    raise AssertionError("metadata not filled")
+
+
+def test_image_size_headers(root):
+    assert image_size(np.fromfile(str(root / "b.png"), np.uint8)) == (30, 20)
+    assert image_size(np.fromfile(str(root / "a.jpg"), np.uint8)) == (10, 40)
+
+
+def test_list_sort_prefix_and_paging(tmp_path, root):
+    idx = _index(tmp_path, root)
+    assert idx.refresh()
+    items, total = idx.list()
+    assert total == 3 and [i["name"] for i in items] == ["a.jpg", "b.png", "c.png"]
+    items, total = idx.list(limit=1, offset=1)
+    assert total == 3 and [i["name"] for i in items] == ["b.png"]
+    items, total = idx.list(sort="size", descending=True)
+    assert [i["size"] for i in items] == sorted((i["size"] for i in items), reverse=True)
+    items, total = idx.list(prefix="b")
+    assert total == 1 and items[0]["name"] == "b.png"
+
+
+def test_metadata_filled_in_background(tmp_path, root):
+    idx = _index(tmp_path, root)
+    idx.refresh()
+    items = {i["name"]: i for i in _wait_meta(idx)}
+    assert (items["c.png"]["width"], items["c.png"]["height"]) == (50, 50)
+    assert items["a.jpg"]["hash"] == digest_bytes((root / "a.jpg").read_bytes())
+    assert idx.digest("a.jpg") == items["a.jpg"]["hash"]
+
+
+def test_incremental_refresh(tmp_path, root):
+    idx = _index(tmp_path, root)
+    idx.refresh()
+    assert not idx.refresh()  # thư mục không đổi, đã ổn định -> không quét
+    os.remove(root / "b.png")
+    _write(root / "d.png", 8, 8)
+    assert idx.refresh()
+    assert [i["name"] for i in idx.list()[0]] == ["a.jpg", "c.png", "d.png"]
+
+
+def test_rescans_while_dir_mtime_is_recent(tmp_path, root):
+    idx = _index(tmp_path, root)
+    _write(root / "d.png", 8, 8)  # mtime thư mục = bây giờ
+    assert idx.refresh()
+    # thay đổi cùng tick có thể không đổi mtime thư mục -> vẫn quét lại cho tới khi ổn định
+    assert idx.refresh()
+    _age_dir(root)
+    assert idx.refresh()
+    assert not idx.refresh()
+
+
+def test_in_place_rewrite_needs_force_or_max_age(tmp_path, root):
+    idx = _index(tmp_path, root)
+    idx.refresh()
+    _wait_meta(idx)
+    with open(root / "c.png", "r+b") as f:  # ghi đè tại chỗ, mtime thư mục giữ nguyên
+        f.seek(0, 2)
+        f.write(b"\0" * 10)
+    _age_dir(root)
+    assert idx.digest("c.png") is None  # size đổi -> hash cũ không còn dùng
+    assert idx.refresh(force=True)
+    assert idx.list(prefix="c")[0][0]["size"] == os.path.getsize(root / "c.png")
+
+    stale = _index(tmp_path, root, max_age=0)
+    stale.refresh()
+    assert stale.refresh()  # max_age=0: lần nào cũng quét
+
+
+def test_record_keeps_known_hash(tmp_path, root):
+    idx = _index(tmp_path, root)
+    idx.refresh()
+    _write(root / "up.png", 12, 6)
+    idx.record("up.png", "f" * 40)
+    _age_dir(root)
+    idx.refresh()  # (size, mtime) khớp bản ghi -> không xoá hash đã biết
+    item = idx.list(prefix="up")[0][0]
+    assert item["hash"] == "f" * 40
+    end = time.time() + 10
+    while idx.list(prefix="up")[0][0]["width"] is None and time.time() < end:
+        time.sleep(0.02)
+    assert idx.list(prefix="up")[0][0]["width"] == 12
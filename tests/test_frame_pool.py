@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from src.api.frame_pool import FramePool, is_handle
+
+
+@pytest.fixture
+def pool():
+    p = FramePool(capacity=2, max_bytes=8 << 20)
+    yield p
+    p.close()
+
+
+def _img(h=100, w=120, value=7):
+    return np.full((h, w, 3), value, np.uint8)
+
+
+def test_put_view_roundtrip(pool):
+    img = _img()
+    frame = pool.put(img)
+    assert is_handle(frame)
+    assert np.array_equal(pool.view(frame), img)
+
+
+def test_release_returns_slot_for_reuse(pool):
+    a = pool.put(_img(value=1))
+    b = pool.put(_img(value=2))
+    # hết slot -> trả lại chính mảng (đi qua queue kiểu pickle)
+    c = pool.put(_img(value=3))
+    assert not is_handle(c)
+    pool.release(a)
+    d = pool.put(_img(value=4))
+    assert is_handle(d) and d.slot == a.slot
+    assert np.array_equal(pool.view(d), _img(value=4))
+    assert np.array_equal(pool.view(b), _img(value=2))
+
+
+def test_incref_keeps_slot_until_last_release(pool):
+    a = pool.put(_img())
+    pool.incref(a)
+    pool.put(_img())
+    pool.release(a)
+    assert not is_handle(pool.put(_img()))  # a vẫn còn một tham chiếu
+    pool.release(a)
+    assert is_handle(pool.put(_img()))
+
+
+def test_store_in_place_and_grow(pool):
+    frame = pool.put(_img())
+    small = pool.store(np.zeros((10, 10), np.uint8), frame)
+    assert small.slot == frame.slot and small.shape == (10, 10)
+    big = pool.store(np.ones((1200, 1000, 3), np.uint8), small)  # > block 1 MiB -> block mới
+    assert big.slot != frame.slot
+    assert pool.view(big).sum() == 1200 * 1000 * 3
+    # block cũ đã được trả lại
+    assert pool.put(_img()).slot == frame.slot
+
+
+def test_max_bytes_falls_back_to_array():
+    p = FramePool(capacity=4, max_bytes=1 << 20)
+    try:
+        assert is_handle(p.put(_img()))
+        assert not is_handle(p.put(_img()))  # vượt ngân sách
+    finally:
+        p.close()
+
+
+def test_inline_frames_pass_through(pool):
+    img = _img()
+    assert pool.view(img) is img
+    pool.release(img)  # không làm gì
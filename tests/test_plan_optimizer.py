@@ -0,0 +1,105 @@
+import pytest
+
+from src.utils.plan_optimizer import commutes, optimize_steps
+
+
+def _checker_aware(p, _other):
+    return None if p.get("background") == "checker" else "approx"
+
+
+REGISTRY = {
+    "Flip": {"involution": True, "commutes": {"Resize": "exact"}},
+    "Gray": {"commutes": {"Flip": "exact", "Resize": "approx"}},
+    "Resize": {"noop": lambda p: not any(p.values()), "downscale": lambda p: (p.get("scale") or 1) < 1},
+    "Heavy": {"commutes": {"Resize": _checker_aware, "Flip": _checker_aware}},
+    "Mark": {},
+    "Out": {"identity": True},
+}
+
+
+def step(name, **params):
+    return {"name": name, "params": params}
+
+
+def names(steps):
+    return [s["name"] for s in steps]
+
+
+def test_commutes_is_symmetric_and_respects_exact():
+    assert commutes(REGISTRY, step("Resize"), step("Flip"), exact=True)
+    assert commutes(REGISTRY, step("Resize"), step("Gray"))
+    assert not commutes(REGISTRY, step("Resize"), step("Gray"), exact=True)
+    assert not commutes(REGISTRY, step("Mark"), step("Flip"))
+
+
+def test_commutes_params_aware():
+    assert commutes(REGISTRY, step("Heavy", background="solid"), step("Resize", scale=0.5))
+    assert not commutes(REGISTRY, step("Resize", scale=0.5), step("Heavy", background="checker"))
+
+
+def test_drops_identity_and_noop():
+    out, changes = optimize_steps([step("Gray"), step("Resize"), step("Out")], REGISTRY)
+    assert names(out) == ["Gray"]
+    assert len(changes) == 2
+
+
+def test_moves_downscale_before_commuting_steps():
+    out, changes = optimize_steps([step("Mark"), step("Heavy"), step("Gray"), step("Resize", scale=0.5)], REGISTRY)
+    # Mark không giao hoán -> Resize dừng ngay sau nó
+    assert names(out) == ["Mark", "Resize", "Heavy", "Gray"]
+    assert changes == ["move Resize before Heavy, Gray"]
+
+
+def test_keeps_order_when_checker_background():
+    steps = [step("Heavy", background="checker"), step("Resize", scale=0.25)]
+    out, changes = optimize_steps(steps, REGISTRY)
+    assert names(out) == ["Heavy", "Resize"]
+    assert changes == []
+
+
+def test_upscale_not_moved():
+    steps = [step("Gray"), step("Resize", scale=2.0)]
+    assert names(optimize_steps(steps, REGISTRY)[0]) == ["Gray", "Resize"]
+
+
+def test_cancels_involution_pairs_only_across_exact_commuters():
+    out, _ = optimize_steps([step("Flip"), step("Gray"), step("Flip")], REGISTRY)
+    assert names(out) == ["Gray"]
+    out, _ = optimize_steps([step("Flip"), step("Mark"), step("Flip")], REGISTRY)
+    assert names(out) == ["Flip", "Mark", "Flip"]
+    # Resize(approx với Gray) không ảnh hưởng; Flip giao hoán exact với Resize
+    out, _ = optimize_steps([step("Flip"), step("Flip"), step("Flip"), step("Resize", width=10), step("Flip")], REGISTRY)
+    assert names(out) == ["Resize"]
+
+
+def test_does_not_mutate_input():
+    steps = [step("Flip"), step("Flip")]
+    optimize_steps(steps, REGISTRY)
+    assert names(steps) == ["Flip", "Flip"]
+
+
+def _samples(name, spec):
+    """Vài bộ params đại diện cho filter ``name`` của registry API."""
+    if name == "Resize":
+        return [{"scale": 0.5}, {"scale": 0.3}, {"width": 37}, {"height": 50}, {"scale": 1.7}]
+    enums = {k: v["options"] for k, v in spec["params"].items() if v.get("type") == "enum"}
+    return [{k: o} for k, opts in enums.items() for o in opts] or [{}]
+
+
+def test_exact_pairs_in_api_registry_are_pixel_identical():
+    np = pytest.importorskip("numpy")
+    from src.api.main import FILTERS
+
+    rng = np.random.default_rng(0)
+    # nhiễu ngẫu nhiên + kích thước lẻ: khác biệt do nội suy / làm tròn không bị che
+    imgs = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for h, w in [(81, 123), (600, 900)]]
+    pairs = [(a, b) for a, spec in FILTERS.items() for b, level in spec.get("commutes", {}).items() if level == "exact"]
+    assert pairs
+    for a, b in pairs:
+        fa, fb = FILTERS[a]["cls"](), FILTERS[b]["cls"]()
+        for pa in _samples(a, FILTERS[a]):
+            for pb in _samples(b, FILTERS[b]):
+                for img in imgs:
+                    ab = fb.apply(fa.apply(img, **pa), **pb)
+                    ba = fa.apply(fb.apply(img, **pb), **pa)
+                    assert np.array_equal(ab, ba), (a, pa, b, pb, img.shape)
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+
+from src.api import upload
+
+pytest.importorskip("multipart")
+
+BOUNDARY = "XbOuNdArY"
+CTYPE = f"multipart/form-data; boundary={BOUNDARY}"
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4
+
+
+def _body(files):
+    out = b""
+    for name, data in files:
+        out += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def _chunks(body, size=1024):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def _receive(body, dest, memory_cap=1 << 20, **kw):
+    coro = upload.receive_upload(_chunks(body), CTYPE, str(dest), memory_cap, **kw)
+    return asyncio.run(asyncio.wait_for(coro, timeout=10))
+
+
+def test_sniff():
+    assert upload.sniff(PNG) == "png"
+    assert upload.sniff(b"\xff\xd8\xff\xe0" + b"\x00" * 8) == "jpeg"
+    assert upload.sniff(b"RIFF\x00\x00\x00\x00WEBP") == "webp"
+    assert upload.sniff(b"hello world!") is None
+
+
+def test_saves_files_with_hash(tmp_path):
+    data = PNG + os.urandom(50_000)
+    res = _receive(_body([("a.png", data), ("b.txt", b"not an image at all")]), tmp_path)
+    by_name = {r["name"]: r for r in res}
+    assert by_name["a.png"]["size"] == len(data)
+    assert by_name["a.png"]["type"] == "png"
+    assert (tmp_path / "a.png").read_bytes() == data
+    assert "error" in by_name["b.txt"]
+    assert sorted(os.listdir(tmp_path)) == ["a.png"]
+
+
+def test_small_memory_cap_backpressure(tmp_path):
+    data = PNG + os.urandom(200_000)
+    res = _receive(_body([("a.png", data), ("c.png", data)]), tmp_path, memory_cap=8192)
+    assert [r.get("size") for r in res] == [len(data), len(data)]
+    assert (tmp_path / "c.png").read_bytes() == data
+
+
+@pytest.mark.parametrize("memory_cap", [8192, 1 << 20])
+def test_truncated_body_does_not_hang(tmp_path, memory_cap):
+    body = _body([("a.png", PNG + os.urandom(200_000))])
+    cut = body[:len(body) // 2]
+    try:
+        res = _receive(cut, tmp_path, memory_cap=memory_cap)
+    except upload.UploadError:
+        res = None
+    if res is not None:
+        assert all("error" in r for r in res)
+    # không để lại file dở dang (.part) hay file input thiếu dữ liệu
+    assert os.listdir(tmp_path) == []
+
+
+def test_max_file_bytes(tmp_path):
+    res = _receive(_body([("a.png", PNG + b"\x00" * 5000)]), tmp_path, max_file_bytes=1000)
+    assert "error" in res[0]
+    assert os.listdir(tmp_path) == []
+
+
+def test_rejects_non_multipart(tmp_path):
+    with pytest.raises(upload.UploadError):
+        asyncio.run(upload.receive_upload(_chunks(b""), "application/json", str(tmp_path), 1024))